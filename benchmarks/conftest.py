@@ -0,0 +1,168 @@
+"""
+Benchmark suite for the API hot paths.
+
+Run it explicitly, it is not part of the default ``pytest`` run::
+
+    pytest benchmarks                                  # measure and compare
+    pytest benchmarks --benchmark-save-baseline        # record a new baseline
+    pytest benchmarks --benchmark-tolerance=0.5        # allow 50% slowdowns
+
+Every run writes its timings to ``--benchmark-json`` (``benchmarks/results/latest.json``
+by default). When ``--benchmark-baseline`` (``benchmarks/baseline.json`` by default)
+exists, a benchmark whose median is slower than the baseline median by more than the
+tolerance fails. Baselines are machine specific, record them on the machine that
+runs the comparison.
+"""
+
+import json
+import os
+import platform
+import statistics
+import time
+from datetime import datetime, timezone
+
+import pytest
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from benchmarks.factories import bulk_counterparties, bulk_territories
+from users.models import CustomUser
+
+BENCHMARK_DIR = os.path.dirname(__file__)
+
+results_key = pytest.StashKey[dict]()
+baseline_key = pytest.StashKey[dict]()
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("benchmark")
+    group.addoption(
+        "--benchmark-json",
+        default=os.path.join(BENCHMARK_DIR, "results", "latest.json"),
+        help="Where to write the timings of this run.",
+    )
+    group.addoption(
+        "--benchmark-baseline",
+        default=os.path.join(BENCHMARK_DIR, "baseline.json"),
+        help="Baseline file to compare against.",
+    )
+    group.addoption(
+        "--benchmark-save-baseline",
+        action="store_true",
+        default=False,
+        help="Write this run's timings to the baseline file instead of comparing.",
+    )
+    group.addoption(
+        "--benchmark-tolerance",
+        type=float,
+        default=0.25,
+        help="Allowed relative slowdown of the median before a benchmark fails.",
+    )
+
+
+def pytest_configure(config):
+    config.stash[results_key] = {}
+    baseline_path = config.getoption("--benchmark-baseline")
+    baseline = {}
+    if not config.getoption("--benchmark-save-baseline") and os.path.exists(
+        baseline_path
+    ):
+        with open(baseline_path) as f:
+            baseline = json.load(f)["benchmarks"]
+    config.stash[baseline_key] = baseline
+
+
+def pytest_sessionfinish(session):
+    config = session.config
+    results = config.stash.get(results_key, {})
+    if not results:
+        return
+    report = {
+        "created": datetime.now(timezone.utc).isoformat(),
+        "machine": platform.node(),
+        "python": platform.python_version(),
+        "benchmarks": results,
+    }
+    paths = [config.getoption("--benchmark-json")]
+    if config.getoption("--benchmark-save-baseline"):
+        paths.append(config.getoption("--benchmark-baseline"))
+    for path in paths:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+
+class BenchmarkRunner:
+    """
+    Time a callable over several rounds and check the median against the baseline.
+    """
+
+    def __init__(self, name, config):
+        self.name = name
+        self.config = config
+
+    def __call__(self, func, rounds=5, warmup=1, setup=None):
+        timings = []
+        result = None
+        for i in range(warmup + rounds):
+            args = setup() if setup else ()
+            start = time.perf_counter()
+            result = func(*args)
+            elapsed = time.perf_counter() - start
+            if i >= warmup:
+                timings.append(elapsed)
+
+        stats = {
+            "rounds": rounds,
+            "min": min(timings),
+            "max": max(timings),
+            "mean": statistics.mean(timings),
+            "median": statistics.median(timings),
+            "stddev": statistics.stdev(timings) if len(timings) > 1 else 0.0,
+        }
+        self.config.stash[results_key][self.name] = stats
+        self.compare(stats)
+        return result
+
+    def compare(self, stats):
+        baseline = self.config.stash[baseline_key].get(self.name)
+        if baseline is None:
+            return
+        tolerance = self.config.getoption("--benchmark-tolerance")
+        allowed = baseline["median"] * (1 + tolerance)
+        if stats["median"] > allowed:
+            pytest.fail(
+                f"Benchmark regression in {self.name}: median "
+                f"{stats['median'] * 1000:.2f}ms vs baseline "
+                f"{baseline['median'] * 1000:.2f}ms "
+                f"(+{(stats['median'] / baseline['median'] - 1) * 100:.0f}%, "
+                f"tolerance {tolerance * 100:.0f}%)"
+            )
+
+
+@pytest.fixture
+def benchmark(request):
+    return BenchmarkRunner(request.node.name, request.config)
+
+
+@pytest.fixture
+def user():
+    return CustomUser.objects.create(username="benchmark", email="bench@example.com")
+
+
+@pytest.fixture
+def authenticated_client(user):
+    client = APIClient()
+    token = RefreshToken.for_user(user).access_token
+    client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")
+    return client
+
+
+@pytest.fixture
+def territories():
+    return bulk_territories(3)
+
+
+@pytest.fixture
+def forwarder():
+    return bulk_counterparties(1)[0]
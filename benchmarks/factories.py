@@ -0,0 +1,82 @@
+"""
+Bulk factories for seeding benchmark data in a handful of queries.
+"""
+
+from datetime import date
+
+from django.utils import timezone
+
+from payment_codes.counters import adjust_counters, status_deltas
+from payment_codes.models import Application, Counterparty, PaymentCode, Territory
+
+# Applications have ~40 columns, keep batches under 65535 bind parameters
+BATCH_SIZE = 1000
+
+
+def bulk_territories(count, prefix="Territory"):
+    return Territory.objects.bulk_create(
+        [Territory(name=f"{prefix} {i}") for i in range(count)], batch_size=BATCH_SIZE
+    )
+
+
+def bulk_counterparties(count, prefix="Counterparty"):
+    return Counterparty.objects.bulk_create(
+        [Counterparty(name=f"{prefix} {i}") for i in range(count)],
+        batch_size=BATCH_SIZE,
+    )
+
+
+def bulk_applications(
+    count, forwarder, territories, manager=None, prefix="BENCH", quantity=1
+):
+    now = timezone.now()
+    applications = Application.objects.bulk_create(
+        [
+            Application(
+                number=f"{prefix}-{i:07d}",
+                sending_type="single",
+                quantity=quantity,
+                date=date(2024, 1, 1),
+                forwarder=forwarder,
+                manager=manager,
+                departure="Moscow",
+                destination="Tashkent",
+                cargo="Benchmark cargo",
+                territories_count=len(territories),
+                created=now,
+                modified=now,
+            )
+            for i in range(count)
+        ],
+        batch_size=BATCH_SIZE,
+    )
+    through = Application.territories.through
+    through.objects.bulk_create(
+        [
+            through(application_id=application.id, territory_id=territory.id)
+            for application in applications
+            for territory in territories
+        ],
+        batch_size=BATCH_SIZE,
+    )
+    return applications
+
+
+def bulk_codes(application, territory, count, start=1):
+    now = timezone.now()
+    # bulk_create skips the counter signals
+    adjust_counters(application.id, **status_deltas([PaymentCode.CHECKING] * count))
+    return PaymentCode.objects.bulk_create(
+        [
+            PaymentCode(
+                application=application,
+                territory=territory,
+                number=str(number).zfill(8),
+                date=application.date,
+                created=now,
+                modified=now,
+            )
+            for number in range(start, start + count)
+        ],
+        batch_size=BATCH_SIZE,
+    )
@@ -0,0 +1,149 @@
+import itertools
+from unittest.mock import patch
+
+import pytest
+from django.contrib.auth.hashers import make_password
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from benchmarks.factories import (
+    bulk_applications,
+    bulk_codes,
+    bulk_counterparties,
+    bulk_territories,
+)
+from users.models import CustomUser
+
+pytestmark = pytest.mark.django_db
+
+
+def stub_convert(docx_file, file_name, path="applications", timeout=30):
+    """Stand-in for the HTTP converter so only our own pipeline is measured"""
+    return f"{path}/{file_name}"
+
+
+class TestApplicationBenchmarks:
+    @patch("payment_codes.utils.convert", side_effect=stub_convert)
+    def test_application_create(
+        self, mock_convert, benchmark, authenticated_client, territories, forwarder
+    ):
+        url = reverse("application-create")
+        numbers = itertools.count()
+
+        def create():
+            payload = {
+                "number": f"CREATE-{next(numbers)}",
+                "sending_type": "single",
+                "quantity": 3,
+                "date": "2024-01-01",
+                "territories": [t.id for t in territories],
+                "forwarder": forwarder.id,
+                "departure": "Moscow",
+                "destination": "Tashkent",
+                "loading_type": "wagon",
+                "weight": "1000.00",
+                "container_type": "20",
+            }
+            response = authenticated_client.post(url, payload, format="json")
+            assert response.status_code == status.HTTP_201_CREATED
+            return response
+
+        benchmark(create, rounds=10)
+
+    @pytest.mark.parametrize("codes", [10, 100, 1000])
+    def test_application_detail(
+        self, benchmark, authenticated_client, territories, forwarder, codes
+    ):
+        application = bulk_applications(1, forwarder, territories, quantity=codes)[0]
+        bulk_codes(application, territories[0], codes)
+        url = reverse("application-detail", args=[application.id])
+
+        response = benchmark(lambda: authenticated_client.get(url), rounds=10)
+
+        assert len(response.data["codes"]) == codes
+
+    @pytest.mark.parametrize("page", [1, 50, 200])
+    def test_application_list_page_depth(
+        self, benchmark, authenticated_client, territories, forwarder, page
+    ):
+        bulk_applications(2000, forwarder, territories)
+        url = reverse("application-list")
+
+        response = benchmark(
+            lambda: authenticated_client.get(url, {"page": page}), rounds=10
+        )
+
+        assert response.status_code == status.HTTP_200_OK
+
+
+class TestPaymentCodeBenchmarks:
+    @pytest.mark.parametrize(
+        "codes,rounds",
+        [(100, 10), (10_000, 3), (100_000, 1)],
+        ids=["100", "10k", "100k"],
+    )
+    def test_code_range_create(
+        self, benchmark, authenticated_client, territories, forwarder, codes, rounds
+    ):
+        territory = territories[0]
+        applications = iter(
+            bulk_applications(rounds + 1, forwarder, [territory], quantity=codes)
+        )
+        # Every round issues numbers the territory has not used yet
+        starts = itertools.count(1, codes)
+
+        def setup():
+            url = reverse("code-range-create", args=[next(applications).id])
+            start = next(starts)
+            payload = {
+                "start_range": str(start).zfill(8),
+                "end_range": str(start + codes - 1).zfill(8),
+                "territory_id": territory.id,
+            }
+            return url, payload
+
+        def create(url, payload):
+            response = authenticated_client.post(url, payload)
+            assert response.status_code == status.HTTP_201_CREATED
+
+        benchmark(create, rounds=rounds, setup=setup)
+
+
+class TestReferenceBenchmarks:
+    def test_territory_list(self, benchmark, authenticated_client):
+        bulk_territories(500)
+        url = reverse("territory-list")
+        benchmark(lambda: authenticated_client.get(url), rounds=10)
+
+    def test_counterparty_list(self, benchmark, authenticated_client):
+        bulk_counterparties(500)
+        url = reverse("counterparty-list")
+        benchmark(lambda: authenticated_client.get(url), rounds=10)
+
+
+class TestLoginBenchmarks:
+    HASHERS = {
+        "argon2": "users.hashers.TunedArgon2PasswordHasher",
+        "bcrypt_sha256": "django.contrib.auth.hashers.BCryptSHA256PasswordHasher",
+        "pbkdf2_sha256": "django.contrib.auth.hashers.PBKDF2PasswordHasher",
+    }
+
+    @pytest.mark.parametrize("hasher", HASHERS)
+    def test_login(self, benchmark, settings, hasher):
+        # The measured hasher goes first so logins do not rehash to another one
+        settings.PASSWORD_HASHERS = [self.HASHERS[hasher]] + [
+            path for name, path in self.HASHERS.items() if name != hasher
+        ]
+        password = "Shift-start-123"
+        CustomUser.objects.create(
+            username="shift", password=make_password(password, hasher=hasher)
+        )
+        client = APIClient()
+        url = reverse("token_obtain_pair")
+
+        def login():
+            response = client.post(url, {"username": "shift", "password": password})
+            assert response.status_code == status.HTTP_200_OK
+
+        benchmark(login, rounds=10)
@@ -0,0 +1,193 @@
+"""
+Client-side load balancing over several instances of an HTTP service.
+
+Each request goes to the endpoint with the lowest ``latency EWMA * (outstanding
+requests + 1)``, so a slow or busy instance gets less traffic and a fast idle
+one gets more. Endpoints without a latency sample yet score zero and are tried
+first.
+
+Health is checked passively: an endpoint that fails ``eject_after`` requests in
+a row is ejected for ``eject_seconds``, doubling with every further ejection up
+to ``max_eject_seconds``, and readmitted afterwards. One success resets it. If
+every endpoint is ejected the one due back first is used anyway, an outage of
+the whole service is the circuit breaker's business.
+
+The state is per worker process, and is exported as metrics per endpoint.
+"""
+
+import logging
+import random
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+
+from interrail_moscow_code.metrics import REGISTRY, counter, gauge
+
+logger = logging.getLogger(__name__)
+
+ENDPOINT_OUTSTANDING = gauge(
+    "upstream_endpoint_outstanding_requests",
+    "Requests in flight per upstream endpoint in this worker.",
+    ["upstream", "endpoint"],
+)
+ENDPOINT_LATENCY = gauge(
+    "upstream_endpoint_latency_ewma_seconds",
+    "Moving average of successful request latency per upstream endpoint.",
+    ["upstream", "endpoint"],
+)
+ENDPOINT_UP = gauge(
+    "upstream_endpoint_up",
+    "1 while an upstream endpoint receives traffic, 0 while it is ejected.",
+    ["upstream", "endpoint"],
+)
+ENDPOINT_REQUESTS = counter(
+    "upstream_endpoint_requests_total",
+    "Requests per upstream endpoint and outcome.",
+    ["upstream", "endpoint", "outcome"],
+)
+ENDPOINT_EJECTIONS = counter(
+    "upstream_endpoint_ejections_total",
+    "Times an upstream endpoint was ejected after consecutive failures.",
+    ["upstream", "endpoint"],
+)
+
+_balancers = weakref.WeakSet()
+
+
+class Endpoint:
+    def __init__(self, url):
+        self.url = url
+        self.outstanding = 0
+        self.ewma = None
+        self.failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+
+    def score(self):
+        return (self.ewma or 0.0) * (self.outstanding + 1)
+
+
+class EndpointBalancer:
+    def __init__(
+        self,
+        name,
+        urls,
+        is_failure=lambda exc: True,
+        alpha=0.3,
+        eject_after=3,
+        eject_seconds=10.0,
+        max_eject_seconds=300.0,
+        clock=time.monotonic,
+    ):
+        if not urls:
+            raise ValueError(f"Balancer {name} needs at least one endpoint")
+        self.name = name
+        self.endpoints = [Endpoint(url) for url in urls]
+        self.is_failure = is_failure
+        self.alpha = alpha
+        self.eject_after = eject_after
+        self.eject_seconds = eject_seconds
+        self.max_eject_seconds = max_eject_seconds
+        self.clock = clock
+        self.lock = threading.Lock()
+        _balancers.add(self)
+
+    def __len__(self):
+        return len(self.endpoints)
+
+    def pick(self, exclude=()):
+        """
+        Choose the endpoint for the next request and count it as outstanding.
+        """
+        with self.lock:
+            candidates = [e for e in self.endpoints if e.url not in exclude]
+            candidates = candidates or self.endpoints
+            now = self.clock()
+            healthy = [e for e in candidates if e.ejected_until <= now]
+            if not healthy:
+                healthy = [min(candidates, key=lambda e: e.ejected_until)]
+            # Shuffle so that ties, such as several unsampled endpoints, spread out
+            random.shuffle(healthy)
+            endpoint = min(healthy, key=Endpoint.score)
+            endpoint.outstanding += 1
+            return endpoint
+
+    def release(self, endpoint, elapsed, failed):
+        """
+        Record the outcome of a request sent to ``endpoint``.
+        """
+        with self.lock:
+            endpoint.outstanding -= 1
+            if not failed:
+                endpoint.failures = endpoint.ejections = 0
+                endpoint.ewma = (
+                    elapsed
+                    if endpoint.ewma is None
+                    else self.alpha * elapsed + (1 - self.alpha) * endpoint.ewma
+                )
+                return
+            endpoint.failures += 1
+            if endpoint.failures < self.eject_after:
+                return
+            endpoint.failures = 0
+            endpoint.ejections += 1
+            duration = min(
+                self.eject_seconds * 2 ** (endpoint.ejections - 1),
+                self.max_eject_seconds,
+            )
+            endpoint.ejected_until = self.clock() + duration
+        ENDPOINT_EJECTIONS.inc(upstream=self.name, endpoint=endpoint.url)
+        logger.warning(
+            f"Ejected {self.name} endpoint {endpoint.url} for {duration:.0f} seconds"
+        )
+
+    @contextmanager
+    def lease(self, exclude=()):
+        """
+        Pick an endpoint for the wrapped request and yield its URL. Exceptions
+        for which ``is_failure`` is true count against the endpoint's health.
+        """
+        endpoint = self.pick(exclude)
+        start = time.perf_counter()
+        failed = False
+        try:
+            yield endpoint.url
+        except Exception as exc:
+            failed = self.is_failure(exc)
+            raise
+        finally:
+            self.release(endpoint, time.perf_counter() - start, failed)
+            ENDPOINT_REQUESTS.inc(
+                upstream=self.name,
+                endpoint=endpoint.url,
+                outcome="failure" if failed else "success",
+            )
+
+    def stats(self):
+        """
+        Current state of every endpoint, as reported in the metrics.
+        """
+        now = self.clock()
+        with self.lock:
+            return [
+                {
+                    "endpoint": e.url,
+                    "outstanding": e.outstanding,
+                    "latency_ewma": e.ewma,
+                    "up": e.ejected_until <= now,
+                }
+                for e in self.endpoints
+            ]
+
+
+def collect_balancer_stats():
+    for balancer in list(_balancers):
+        for stats in balancer.stats():
+            labels = {"upstream": balancer.name, "endpoint": stats["endpoint"]}
+            ENDPOINT_OUTSTANDING.set(stats["outstanding"], **labels)
+            ENDPOINT_LATENCY.set(stats["latency_ewma"] or 0.0, **labels)
+            ENDPOINT_UP.set(1 if stats["up"] else 0, **labels)
+
+
+REGISTRY.add_collector(collect_balancer_stats)
@@ -0,0 +1,144 @@
+"""
+Circuit breaker for calls to external services.
+
+A breaker starts closed and lets calls through, counting the failures of the
+last ``window`` seconds. After ``failure_threshold`` of them it opens, and for
+``reset_timeout`` seconds calls fail fast with CircuitOpenError instead of
+waiting on a service that is down. It then turns half-open: a single caller is
+let through as a probe, its success closes the circuit and its failure opens
+it for another ``reset_timeout``.
+
+The state is kept in the "shared" cache so every worker process sees the same
+circuit, and the first worker to notice an outage spares all the others. Only
+``add`` is relied on to be atomic: each failure claims one of
+``failure_threshold`` keys, so concurrent failures are all counted even on a
+cache whose ``incr`` is a read followed by a write.
+"""
+
+import logging
+import time
+from contextlib import contextmanager
+
+from django.core.cache import caches
+
+from interrail_moscow_code.metrics import counter
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+BREAKER_REJECTIONS = counter(
+    "circuit_breaker_rejections_total",
+    "Calls failed fast because their circuit was open.",
+    ["breaker"],
+)
+BREAKER_TRANSITIONS = counter(
+    "circuit_breaker_transitions_total",
+    "Circuit state changes by breaker and new state.",
+    ["breaker", "state"],
+)
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of calling a service whose circuit is open.
+    """
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name,
+        failure_threshold,
+        window,
+        reset_timeout,
+        failures=(Exception,),
+        is_failure=None,
+        probe_timeout=60,
+        cache_alias="shared",
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.window = window
+        self.reset_timeout = reset_timeout
+        self.failures = failures
+        # Narrows ``failures`` down to the errors that say the service is down
+        self.is_failure = is_failure or (lambda exc: True)
+        # A probe that has not reported back by then is presumed lost
+        self.probe_timeout = probe_timeout
+        self.cache_alias = cache_alias
+        self.failure_keys = [
+            f"breaker:{name}:failure:{n}" for n in range(failure_threshold)
+        ]
+        self.opened_key = f"breaker:{name}:opened_until"
+        self.probe_key = f"breaker:{name}:probe"
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def state(self):
+        opened_until = self.cache.get(self.opened_key)
+        if opened_until is None:
+            return CLOSED
+        return OPEN if time.time() < opened_until else HALF_OPEN
+
+    @contextmanager
+    def guard(self):
+        """
+        Run the wrapped call through the breaker, raising CircuitOpenError
+        without running it while the circuit is open.
+        """
+        state = self.state()
+        probing = state == HALF_OPEN and self.cache.add(
+            self.probe_key, True, self.probe_timeout
+        )
+        if state != CLOSED and not probing:
+            BREAKER_REJECTIONS.inc(breaker=self.name)
+            raise CircuitOpenError(f"Circuit {self.name} is open")
+        failed = False
+        try:
+            yield
+        except self.failures as e:
+            failed = self.is_failure(e)
+            if failed:
+                self.record_failure(probing)
+            raise
+        finally:
+            # Anything but a failure ends the probe, including errors of the
+            # caller's own, which would otherwise hold it for probe_timeout
+            if probing and not failed:
+                self.close()
+
+    def record_failure(self, probing=False):
+        if probing:
+            self.open()
+            return
+        # Each failure takes the first free key and expires with the window
+        claimed = any(
+            self.cache.add(key, True, self.window) for key in self.failure_keys
+        )
+        if not claimed:
+            # Every key is taken, the threshold was reached concurrently
+            self.open()
+        elif len(self.cache.get_many(self.failure_keys)) >= self.failure_threshold:
+            self.open()
+
+    def open(self):
+        self.cache.set(self.opened_key, time.time() + self.reset_timeout, None)
+        self.cache.delete_many([*self.failure_keys, self.probe_key])
+        BREAKER_TRANSITIONS.inc(breaker=self.name, state=OPEN)
+        logger.warning(f"Circuit {self.name} opened for {self.reset_timeout} seconds")
+
+    def close(self):
+        self.cache.delete_many([self.opened_key, *self.failure_keys, self.probe_key])
+        BREAKER_TRANSITIONS.inc(breaker=self.name, state=CLOSED)
+        logger.info(f"Circuit {self.name} closed")
+
+    def reset(self):
+        """
+        Forget all state without recording a transition.
+        """
+        self.cache.delete_many([self.opened_key, *self.failure_keys, self.probe_key])
@@ -0,0 +1,145 @@
+"""
+Routing of safe reads to an optional read replica.
+
+Reads go to the ``replica`` alias when it is configured, unless the current
+request is pinned to the primary (it writes, or the client wrote within the
+last ``REPLICA_PIN_SECONDS``), the read runs inside a transaction on the
+primary, or the replica lags more than ``REPLICA_MAX_LAG_SECONDS``. Writes
+always go to ``default``.
+
+The database cache table is the exception: it is always read and written on
+the ``shared_state`` connection to the primary, which never takes part in the
+request's transaction.
+"""
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+PRIMARY_DB_ALIAS = "default"
+REPLICA_DB_ALIAS = "replica"
+SHARED_STATE_DB_ALIAS = "shared_state"
+# app_label of the model DatabaseCache reads and writes its table through
+CACHE_APP_LABEL = "django_cache"
+
+# Zero while the replica has replayed everything it received, so an idle
+# primary does not read as lag. NULL when the alias is not a standby at all.
+REPLICA_LAG_SQL = """
+SELECT CASE
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+END
+"""
+
+_pinned = ContextVar("pinned_to_primary", default=False)
+
+
+@contextmanager
+def use_primary():
+    """
+    Send every read in the block to the primary.
+    """
+    token = _pinned.set(True)
+    try:
+        yield
+    finally:
+        _pinned.reset(token)
+
+
+def replica_configured() -> bool:
+    return REPLICA_DB_ALIAS in settings.DATABASES
+
+
+class ReplicaLagMonitor:
+    """
+    Per-process view of whether the replica is fresh enough to read from,
+    re-checked at most every ``REPLICA_LAG_CHECK_SECONDS``.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._checked_at = None
+        self._healthy = True
+
+    def healthy(self) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            if (
+                self._checked_at is not None
+                and now - self._checked_at < settings.REPLICA_LAG_CHECK_SECONDS
+            ):
+                return self._healthy
+            self._checked_at = now
+
+        healthy = self.check()
+        with self._lock:
+            if healthy != self._healthy:
+                state = "back in use" if healthy else "bypassed"
+                logger.warning(f"Read replica {state}")
+            self._healthy = healthy
+        return healthy
+
+    def check(self) -> bool:
+        try:
+            with connections[REPLICA_DB_ALIAS].cursor() as cursor:
+                cursor.execute(REPLICA_LAG_SQL)
+                lag = cursor.fetchone()[0]
+        except DatabaseError as e:
+            logger.error(f"Read replica unavailable: {str(e)}")
+            return False
+        return lag is None or float(lag) <= settings.REPLICA_MAX_LAG_SECONDS
+
+    def reset(self):
+        with self._lock:
+            self._checked_at = None
+            self._healthy = True
+
+
+lag_monitor = ReplicaLagMonitor()
+
+
+def shared_state_db(model):
+    if (
+        model._meta.app_label == CACHE_APP_LABEL
+        and SHARED_STATE_DB_ALIAS in settings.DATABASES
+    ):
+        return SHARED_STATE_DB_ALIAS
+    return None
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if shared_state_db(model):
+            return SHARED_STATE_DB_ALIAS
+        if not replica_configured():
+            return None
+        instance = hints.get("instance")
+        if instance is not None and instance._state.db:
+            # Follow relations from the database the instance came from
+            return instance._state.db
+        if _pinned.get() or connections[PRIMARY_DB_ALIAS].in_atomic_block:
+            return PRIMARY_DB_ALIAS
+        if not lag_monitor.healthy():
+            return PRIMARY_DB_ALIAS
+        return REPLICA_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return shared_state_db(model) or PRIMARY_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {PRIMARY_DB_ALIAS, REPLICA_DB_ALIAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica is a physical copy of the primary, and shared_state
+        # another connection to it
+        return db not in (REPLICA_DB_ALIAS, SHARED_STATE_DB_ALIAS)
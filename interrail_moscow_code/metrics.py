@@ -0,0 +1,360 @@
+"""
+In-process metrics registry exposed in the Prometheus text format.
+
+Metrics live in the memory of the worker process that recorded them, so no
+external service is needed. Under gunicorn every worker keeps its own series;
+the scraper sees whichever worker answered the ``/metrics`` request.
+
+The endpoint is only served to METRICS_ALLOWED_IPS and to requests carrying
+METRICS_TOKEN, it exposes traffic and internals of the deployment.
+"""
+
+import bisect
+import hmac
+import ipaddress
+import threading
+from collections.abc import Callable, Iterable, Sequence
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden, HttpResponseNotFound
+
+DEFAULT_LATENCY_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250, 500)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict[str, str]) -> tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(
+                f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}"
+            )
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def clear(self) -> None:
+        raise NotImplementedError
+
+    def samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._series: dict[tuple[str, ...], float] = {}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._series.clear()
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._series.get(self._key(labels), 0)
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            series = sorted(self._series.items())
+        for key, value in series:
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}{labels} {_format_number(value)}"
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = value
+
+
+class _HistogramSeries:
+    __slots__ = ("bucket_counts", "count", "sum")
+
+    def __init__(self, size: int):
+        self.bucket_counts = [0] * size
+        self.count = 0
+        self.sum = 0.0
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: dict[tuple[str, ...], _HistogramSeries] = {}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._series.clear()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = _HistogramSeries(len(self.buckets))
+            if index < len(self.buckets):
+                series.bucket_counts[index] += 1
+            series.count += 1
+            series.sum += value
+
+    def count(self, **labels: str) -> int:
+        series = self._series.get(self._key(labels))
+        return series.count if series else 0
+
+    def sum(self, **labels: str) -> float:
+        series = self._series.get(self._key(labels))
+        return series.sum if series else 0.0
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            series = sorted(
+                (key, list(s.bucket_counts), s.count, s.sum)
+                for key, s in self._series.items()
+            )
+        for key, bucket_counts, count, total in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                labels = _format_labels(
+                    self.labelnames, key, f'le="{_format_number(bound)}"'
+                )
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+            yield f"{self.name}_bucket{labels} {count}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {_format_number(total)}"
+            yield f"{self.name}_count{labels} {count}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, Metric] = {}
+        self._collectors: list[Callable[[], None]] = []
+
+    def register(self, metric: Metric) -> None:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered.")
+        self._metrics[metric.name] = metric
+
+    def add_collector(self, collector: Callable[[], None]) -> None:
+        """
+        Register a callable that updates metrics right before each render, for
+        values read from elsewhere rather than recorded as they happen.
+        """
+        self._collectors.append(collector)
+
+    def get(self, name: str) -> Metric:
+        return self._metrics[name]
+
+    def clear(self) -> None:
+        for metric in self._metrics.values():
+            metric.clear()
+
+    def render(self) -> str:
+        for collector in self._collectors:
+            collector()
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+    metric = Counter(name, documentation, labelnames)
+    REGISTRY.register(metric)
+    return metric
+
+
+def gauge(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+    metric = Gauge(name, documentation, labelnames)
+    REGISTRY.register(metric)
+    return metric
+
+
+def histogram(
+    name: str,
+    documentation: str,
+    labelnames: Sequence[str] = (),
+    buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS,
+) -> Histogram:
+    metric = Histogram(name, documentation, labelnames, buckets)
+    REGISTRY.register(metric)
+    return metric
+
+
+REQUEST_DURATION = histogram(
+    "http_request_duration_seconds",
+    "Request latency by resolved URL name.",
+    ["view", "method", "status"],
+)
+REQUEST_QUERY_COUNT = histogram(
+    "http_request_db_queries",
+    "Number of SQL queries executed per request.",
+    ["view"],
+    buckets=QUERY_COUNT_BUCKETS,
+)
+REQUEST_QUERY_DURATION = histogram(
+    "http_request_db_duration_seconds",
+    "Total time spent in SQL queries per request.",
+    ["view"],
+)
+CONVERTER_DURATION = histogram(
+    "converter_request_duration_seconds",
+    "Duration of DOCX to PDF converter calls.",
+    ["outcome"],
+)
+CACHE_REQUESTS = counter(
+    "cache_requests_total",
+    "Cache lookups by cache name and result.",
+    ["cache", "result"],
+)
+
+DB_POOL_CONNECTIONS = gauge(
+    "db_pool_connections",
+    "Connections in this worker's pool by state.",
+    ["alias", "state"],
+)
+DB_POOL_EVENTS = counter(
+    "db_pool_events_total",
+    "Pool requests, waits and connection failures.",
+    ["alias", "event"],
+)
+
+# psycopg_pool stats reported as current values, the rest are reset on read
+POOL_STATES = {
+    "pool_min": "min",
+    "pool_max": "max",
+    "pool_size": "open",
+    "pool_available": "idle",
+    "requests_waiting": "waiting",
+}
+POOL_EVENTS = {
+    "requests_num": "requests",
+    "requests_queued": "queued",
+    "requests_errors": "request_errors",
+    "requests_wait_ms": "wait_ms",
+    "connections_num": "connects",
+    "connections_errors": "connect_errors",
+    "connections_lost": "lost",
+    "returns_bad": "returned_bad",
+}
+
+
+def collect_pool_stats() -> None:
+    for alias in connections:
+        pool = getattr(connections[alias], "pool", None)
+        if pool is None:
+            continue
+        stats = pool.pop_stats()
+        for stat, state in POOL_STATES.items():
+            DB_POOL_CONNECTIONS.set(stats.get(stat, 0), alias=alias, state=state)
+        for stat, event in POOL_EVENTS.items():
+            if stat in stats:
+                DB_POOL_EVENTS.inc(stats[stat], alias=alias, event=event)
+
+
+REGISTRY.add_collector(collect_pool_stats)
+
+
+def record_cache_access(cache: str, hit: bool) -> None:
+    """
+    Count a cache lookup as a hit or a miss.
+    """
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def scrape_allowed(request) -> bool:
+    """
+    Whether the request comes from METRICS_ALLOWED_IPS or carries METRICS_TOKEN.
+    """
+    if settings.METRICS_TOKEN:
+        scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+        if scheme.lower() == "bearer" and hmac.compare_digest(
+            token.encode(), settings.METRICS_TOKEN.encode()
+        ):
+            return True
+    try:
+        address = ipaddress.ip_address(request.META.get("REMOTE_ADDR", ""))
+    except ValueError:
+        return False
+    return any(
+        address in ipaddress.ip_network(allowed, strict=False)
+        for allowed in settings.METRICS_ALLOWED_IPS
+    )
+
+
+def metrics_view(request):
+    """
+    Expose every registered metric in the Prometheus text format.
+    """
+    if not settings.METRICS_ENABLED:
+        return HttpResponseNotFound()
+    if not scrape_allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(REGISTRY.render(), content_type=CONTENT_TYPE)
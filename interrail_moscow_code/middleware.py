@@ -0,0 +1,279 @@
+import cProfile
+import logging
+import os
+import random
+import re
+import threading
+import time
+from contextlib import nullcontext
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTStatelessUserAuthentication
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+from interrail_moscow_code.db_router import replica_configured, use_primary
+from interrail_moscow_code.metrics import (
+    REQUEST_DURATION,
+    REQUEST_QUERY_COUNT,
+    REQUEST_QUERY_DURATION,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class QueryObserver:
+    """
+    Database execute wrapper that counts queries and the time spent in them.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+
+
+_current_observer = ContextVar("query_observer", default=None)
+
+
+def observe_queries(execute, sql, params, many, context):
+    """
+    Execute wrapper installed on every connection. Hands the query to the
+    observer of the request being served, which follows the request into the
+    threads Django runs sync code in under ASGI.
+    """
+    observer = _current_observer.get()
+    if observer is None:
+        return execute(sql, params, many, context)
+    return observer(execute, sql, params, many, context)
+
+
+def install_query_observer(connection, **kwargs):
+    if observe_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(observe_queries)
+
+
+connection_created.connect(install_query_observer)
+
+
+class RequestMetricsMiddleware:
+    """
+    Record latency and SQL query statistics per resolved URL name.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not settings.METRICS_ENABLED:
+            return self.get_response(request)
+
+        # Connections opened before this module was imported missed the signal
+        for alias in connections:
+            install_query_observer(connections[alias])
+        observer = QueryObserver()
+        token = _current_observer.set(observer)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_observer.reset(token)
+        self.record(request, response, observer, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        if not settings.METRICS_ENABLED:
+            return await self.get_response(request)
+
+        observer = QueryObserver()
+        token = _current_observer.set(observer)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_observer.reset(token)
+        self.record(request, response, observer, time.perf_counter() - start)
+        return response
+
+    def record(self, request, response, observer, duration):
+        view = view_name(request)
+        REQUEST_DURATION.observe(
+            duration, view=view, method=request.method, status=str(response.status_code)
+        )
+        REQUEST_QUERY_COUNT.observe(observer.count, view=view)
+        REQUEST_QUERY_DURATION.observe(observer.duration, view=view)
+
+
+class SlowRequestProfilerMiddleware:
+    """
+    Opt-in sampling profiler. Runs cProfile around a sample of requests and dumps
+    the stats of those slower than ``PROFILE_SLOW_REQUEST_MS`` to ``PROFILE_DIR``.
+
+    The resulting ``.prof`` files can be inspected with ``python -m pstats`` or
+    snakeviz.
+    """
+
+    # Only one profiler can be active per interpreter
+    _lock = threading.Lock()
+
+    def __init__(self, get_response):
+        if not settings.PROFILE_SLOW_REQUEST_MS:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.threshold = settings.PROFILE_SLOW_REQUEST_MS / 1000
+        self.sample_rate = settings.PROFILE_SAMPLE_RATE
+        self.directory = settings.PROFILE_DIR
+
+    def __call__(self, request):
+        if random.random() >= self.sample_rate:
+            return self.get_response(request)
+        if not self._lock.acquire(blocking=False):
+            return self.get_response(request)
+
+        profiler = cProfile.Profile()
+        try:
+            start = time.perf_counter()
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+            duration = time.perf_counter() - start
+        finally:
+            self._lock.release()
+
+        if duration >= self.threshold:
+            self.dump(profiler, request, duration)
+        return response
+
+    def dump(self, profiler, request, duration):
+        os.makedirs(self.directory, exist_ok=True)
+        name = re.sub(r"[^\w.-]+", "_", view_name(request))
+        filename = (
+            f"{time.strftime('%Y%m%d-%H%M%S')}-{name}-{duration * 1000:.0f}ms.prof"
+        )
+        path = os.path.join(self.directory, filename)
+        profiler.dump_stats(path)
+        logger.warning(
+            f"Slow request {request.method} {request.path} took "
+            f"{duration * 1000:.0f}ms, profile written to {path}"
+        )
+
+
+def token_user_id(request):
+    """
+    User id of the valid bearer token the request carries, None without one.
+    """
+    authentication = JWTStatelessUserAuthentication()
+    header = authentication.get_header(request)
+    if header is None:
+        return None
+    try:
+        raw_token = authentication.get_raw_token(header)
+        if raw_token is None:
+            return None
+        token = authentication.get_validated_token(raw_token)
+    except AuthenticationFailed:
+        return None
+    return token.get(jwt_settings.USER_ID_CLAIM)
+
+
+class PrimaryPinningMiddleware:
+    """
+    Keep a client on the primary database while its own writes may not have
+    reached the read replica yet.
+
+    Unsafe requests run entirely on the primary and, when they succeed, pin
+    the client's reads to the primary for ``REPLICA_PIN_SECONDS``. API clients
+    are pinned by the user id of their bearer token, in the shared cache every
+    worker reads. Clients without a token, such as admin sessions, get a cookie
+    instead.
+    """
+
+    cookie_name = "pin_primary"
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not replica_configured():
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        user_id = token_user_id(request)
+        with self.pinning(request, self.user_pinned(user_id)):
+            response = self.get_response(request)
+        return self.pin(request, response, user_id)
+
+    async def __acall__(self, request):
+        user_id = token_user_id(request)
+        pinned = await sync_to_async(self.user_pinned)(user_id)
+        with self.pinning(request, pinned):
+            response = await self.get_response(request)
+        return await sync_to_async(self.pin)(request, response, user_id)
+
+    @staticmethod
+    def pin_key(user_id):
+        return f"replica:pin:{user_id}"
+
+    @staticmethod
+    def writes(request):
+        return request.method not in ("GET", "HEAD", "OPTIONS", "TRACE")
+
+    def user_pinned(self, user_id):
+        if user_id is None:
+            return False
+        return caches["shared"].get(self.pin_key(user_id), False)
+
+    def pinning(self, request, user_pinned):
+        if self.writes(request) or user_pinned or self.cookie_name in request.COOKIES:
+            return use_primary()
+        return nullcontext()
+
+    def pin(self, request, response, user_id):
+        if not self.writes(request) or response.status_code >= 400:
+            return response
+        if user_id is not None:
+            caches["shared"].set(
+                self.pin_key(user_id), True, settings.REPLICA_PIN_SECONDS
+            )
+        else:
+            response.set_cookie(
+                self.cookie_name,
+                "1",
+                max_age=settings.REPLICA_PIN_SECONDS,
+                httponly=True,
+                samesite="Lax",
+            )
+        return response
+
+
+def view_name(request) -> str:
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return "<unresolved>"
+    return match.view_name or "<unnamed>"
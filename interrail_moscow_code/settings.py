@@ -26,7 +26,8 @@ environ.Env.read_env(os.path.join(BASE_DIR, ".env"))
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.1/howto/deployment/checklist/
-DOC_TO_PDF_CONVERTER_URL = env("DOC_TO_PDF_CONVERTER_URL")
+# One or more converter instances, comma separated, requests are balanced between them
+DOC_TO_PDF_CONVERTER_URLS = env.list("DOC_TO_PDF_CONVERTER_URL", default=[])
 # SECURITY WARNING: keep the secret key used in production secret!
 SECRET_KEY = env("SECRET_KEY")
 # SECURITY WARNING: don't run with debug turned on in production!
@@ -47,6 +48,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     "rest_framework",
     "rest_framework_simplejwt",
     "users",
@@ -55,6 +57,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "interrail_moscow_code.middleware.RequestMetricsMiddleware",
+    "interrail_moscow_code.middleware.SlowRequestProfilerMiddleware",
+    "interrail_moscow_code.middleware.PrimaryPinningMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -88,6 +93,13 @@ WSGI_APPLICATION = "interrail_moscow_code.wsgi.application"
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
 # Database
+# Connections come from a psycopg pool in each worker process, health-checked
+# on checkout. Server-side binding lets psycopg prepare queries a connection
+# runs more than DB_PREPARE_THRESHOLD times. Both are off behind PgBouncer in
+# transaction mode, which cannot keep prepared statements across transactions.
+DB_POOL = env.bool("DB_POOL", default=True)
+DB_SERVER_SIDE_BINDING = env.bool("DB_SERVER_SIDE_BINDING", default=True)
+
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.postgresql",
@@ -96,12 +108,89 @@ DATABASES = {
         "PASSWORD": env("DB_PASSWORD"),
         "HOST": env("DB_HOST"),
         "PORT": env("DB_PORT"),
-        "CONN_MAX_AGE": 60,
+        # The pool owns connection lifetime, Django rejects both together
+        "CONN_MAX_AGE": 0 if DB_POOL else 60,
+        "CONN_HEALTH_CHECKS": True,
         "OPTIONS": {
             "connect_timeout": 10,
+            "server_side_binding": DB_SERVER_SIDE_BINDING,
+            "prepare_threshold": env.int("DB_PREPARE_THRESHOLD", default=5),
         },
     }
 }
+if DB_POOL:
+    DATABASES["default"]["OPTIONS"]["pool"] = {
+        "min_size": env.int("DB_POOL_MIN_SIZE", default=2),
+        "max_size": env.int("DB_POOL_MAX_SIZE", default=10),
+        "timeout": env.float("DB_POOL_TIMEOUT", default=10.0),
+        "max_idle": env.float("DB_POOL_MAX_IDLE", default=300.0),
+    }
+
+# Optional read replica, safe reads are routed to it by db_router
+DB_REPLICA_HOST = env("DB_REPLICA_HOST", default="")
+if DB_REPLICA_HOST:
+    DATABASES["replica"] = {
+        **DATABASES["default"],
+        "NAME": env("DB_REPLICA_NAME", default=DATABASES["default"]["NAME"]),
+        "USER": env("DB_REPLICA_USER", default=DATABASES["default"]["USER"]),
+        "PASSWORD": env(
+            "DB_REPLICA_PASSWORD", default=DATABASES["default"]["PASSWORD"]
+        ),
+        "HOST": DB_REPLICA_HOST,
+        "PORT": env("DB_REPLICA_PORT", default=DATABASES["default"]["PORT"]),
+        "TEST": {"MIRROR": "default"},
+    }
+# A second connection to the primary for the shared cache table and the payment
+# code counters. It stays in autocommit outside the request's transaction, so
+# shared state such as the circuit breaker is visible to other workers at once
+# and survives rollbacks.
+DATABASES["shared_state"] = {
+    **DATABASES["default"],
+    "OPTIONS": {
+        **DATABASES["default"]["OPTIONS"],
+        **(
+            {"pool": {**DATABASES["default"]["OPTIONS"]["pool"], "min_size": 1}}
+            if DB_POOL
+            else {}
+        ),
+    },
+    "TEST": {"MIRROR": "default"},
+}
+DATABASE_ROUTERS = ["interrail_moscow_code.db_router.PrimaryReplicaRouter"]
+# Seconds a client's reads stay on the primary after it writes
+REPLICA_PIN_SECONDS = env.int("REPLICA_PIN_SECONDS", default=5)
+# Replica lag above which reads fall back to the primary, and how often to check it
+REPLICA_MAX_LAG_SECONDS = env.float("REPLICA_MAX_LAG_SECONDS", default=2.0)
+REPLICA_LAG_CHECK_SECONDS = env.float("REPLICA_LAG_CHECK_SECONDS", default=1.0)
+
+# The default cache is per worker process. The shared cache holds state every
+# worker must agree on, such as the converter circuit breaker, and defaults to
+# a table in the main database (manage.py createcachetable) written through the
+# shared_state connection. Point SHARED_CACHE_URL at memcached or Redis to keep
+# that traffic off the database.
+CACHES = {
+    "default": env.cache("CACHE_URL", default="locmemcache://"),
+    "shared": env.cache("SHARED_CACHE_URL", default="dbcache://django_cache"),
+}
+
+# Hasher for new passwords: argon2, bcrypt or pbkdf2. The others stay listed so
+# existing hashes keep verifying, and are upgraded on the user's next login.
+PASSWORD_HASHER = env("PASSWORD_HASHER", default="argon2")
+_PASSWORD_HASHERS = {
+    "argon2": "users.hashers.TunedArgon2PasswordHasher",
+    "bcrypt": "django.contrib.auth.hashers.BCryptSHA256PasswordHasher",
+    "pbkdf2": "django.contrib.auth.hashers.PBKDF2PasswordHasher",
+}
+PASSWORD_HASHERS = [_PASSWORD_HASHERS[PASSWORD_HASHER]] + [
+    hasher for name, hasher in _PASSWORD_HASHERS.items() if name != PASSWORD_HASHER
+]
+# Argon2id costs, the defaults follow the OWASP minimum of 19 MiB and 2 passes
+ARGON2_TIME_COST = env.int("ARGON2_TIME_COST", default=2)
+ARGON2_MEMORY_COST = env.int("ARGON2_MEMORY_COST", default=19456)
+ARGON2_PARALLELISM = env.int("ARGON2_PARALLELISM", default=1)
+# Threads hashing login passwords under ASGI, beyond them logins queue
+LOGIN_THREADS = env.int("LOGIN_THREADS", default=4)
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -122,9 +211,7 @@ AUTH_PASSWORD_VALIDATORS = [
 
 REST_FRAMEWORK = {
     "DEFAULT_SCHEMA_CLASS": "drf_spectacular.openapi.AutoSchema",
-    "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
-    ),
+    "DEFAULT_AUTHENTICATION_CLASSES": ("users.authentication.CachedJWTAuthentication",),
     "DEFAULT_PERMISSION_CLASSES": [
         "rest_framework.permissions.IsAuthenticated",
     ],
@@ -135,7 +222,20 @@ SIMPLE_JWT = {
     "REFRESH_TOKEN_LIFETIME": timedelta(days=1),
     "ROTATE_REFRESH_TOKENS": False,
     "BLACKLIST_AFTER_ROTATION": True,
+    "TOKEN_USER_CLASS": "users.authentication.LazyTokenUser",
+    "TOKEN_REFRESH_SERIALIZER": "users.serializers.RevocableTokenRefreshSerializer",
 }
+# How long a worker trusts its cached is_active flag for a token's user
+JWT_USER_CACHE_SECONDS = env.int("JWT_USER_CACHE_SECONDS", default=60)
+# How often a worker pulls new revocations into its bloom filter, bounding how
+# long other workers accept an access token after logout
+TOKEN_BLACKLIST_SYNC_SECONDS = env.int("TOKEN_BLACKLIST_SYNC_SECONDS", default=5)
+TOKEN_BLACKLIST_BLOOM_CAPACITY = env.int(
+    "TOKEN_BLACKLIST_BLOOM_CAPACITY", default=100_000
+)
+TOKEN_BLACKLIST_BLOOM_ERROR_RATE = env.float(
+    "TOKEN_BLACKLIST_BLOOM_ERROR_RATE", default=0.001
+)
 # Internationalization
 # https://docs.djangoproject.com/en/5.1/topics/i18n/
 
@@ -163,6 +263,102 @@ MEDIA_ROOT = BASE_DIR / "media"
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
+# Prometheus-format metrics served at /metrics by the worker that answers
+METRICS_ENABLED = env.bool("METRICS_ENABLED", default=True)
+# Who may scrape them: clients from these addresses or networks (as seen by
+# Django, so the proxy's address behind a reverse proxy), or requests with
+# "Authorization: Bearer <METRICS_TOKEN>" when a token is set
+METRICS_ALLOWED_IPS = env.list("METRICS_ALLOWED_IPS", default=["127.0.0.1", "::1"])
+METRICS_TOKEN = env.str("METRICS_TOKEN", default="")
+
+# Opt-in cProfile dumps for sampled requests slower than the threshold (0 disables)
+PROFILE_SLOW_REQUEST_MS = env.int("PROFILE_SLOW_REQUEST_MS", default=0)
+PROFILE_SAMPLE_RATE = env.float("PROFILE_SAMPLE_RATE", default=0.1)
+PROFILE_DIR = env("PROFILE_DIR", default=os.path.join(BASE_DIR, "profiles"))
+
+# Age in seconds past which a dashboard read starts a background refresh
+STATS_MAX_STALENESS = env.int("STATS_MAX_STALENESS", default=300)
+
+# Unfiltered admin changelists of tables with at least this many rows show the
+# planner's row estimate instead of running COUNT(*)
+ADMIN_ESTIMATED_COUNT_THRESHOLD = env.int(
+    "ADMIN_ESTIMATED_COUNT_THRESHOLD", default=100000
+)
+# How long admin changelist filter choices are cached
+ADMIN_FILTER_CACHE_SECONDS = env.int("ADMIN_FILTER_CACHE_SECONDS", default=300)
+# Bulk admin actions run in the background, this many rows per transaction
+BULK_JOB_CHUNK_SIZE = env.int("BULK_JOB_CHUNK_SIZE", default=1000)
+BULK_JOB_THREADS = env.int("BULK_JOB_THREADS", default=2)
+# A running job without progress for this long is presumed dead and may be
+# taken over by another worker
+BULK_JOB_STALE_MINUTES = env.int("BULK_JOB_STALE_MINUTES", default=10)
+# Largest list accepted by the batch application update endpoint
+APPLICATION_BATCH_MAX_ITEMS = env.int("APPLICATION_BATCH_MAX_ITEMS", default=500)
+# How long the response to an Idempotency-Key is replayed, and how long a
+# duplicate waits for the first request with the same key to finish
+IDEMPOTENCY_KEY_TTL_SECONDS = env.int("IDEMPOTENCY_KEY_TTL_SECONDS", default=86400)
+IDEMPOTENCY_WAIT_SECONDS = env.float("IDEMPOTENCY_WAIT_SECONDS", default=30.0)
+
+# Converter circuit breaker: this many failures within the window open it, and
+# while open applications are saved without a PDF until a probe succeeds
+CONVERTER_TIMEOUT_SECONDS = env.float("CONVERTER_TIMEOUT_SECONDS", default=30.0)
+CONVERTER_BREAKER_FAILURES = env.int("CONVERTER_BREAKER_FAILURES", default=3)
+CONVERTER_BREAKER_WINDOW_SECONDS = env.int(
+    "CONVERTER_BREAKER_WINDOW_SECONDS", default=60
+)
+CONVERTER_BREAKER_RESET_SECONDS = env.int("CONVERTER_BREAKER_RESET_SECONDS", default=30)
+# Converter balancing: weight of the newest sample in the latency average, and a
+# converter failing this many requests in a row is skipped for EJECT_SECONDS,
+# doubling on every repeat up to MAX_EJECT_SECONDS
+CONVERTER_EWMA_ALPHA = env.float("CONVERTER_EWMA_ALPHA", default=0.3)
+CONVERTER_EJECT_FAILURES = env.int("CONVERTER_EJECT_FAILURES", default=3)
+CONVERTER_EJECT_SECONDS = env.float("CONVERTER_EJECT_SECONDS", default=10.0)
+CONVERTER_MAX_EJECT_SECONDS = env.float("CONVERTER_MAX_EJECT_SECONDS", default=300.0)
+
+# Where documents are converted: HttpConverter for the converter service, or
+# LocalOfficeConverter for a pool of LibreOffice workers on this machine, each
+# recycled with a fresh profile after CONVERTER_WORKER_MAX_JOBS conversions
+CONVERTER_BACKEND = env(
+    "CONVERTER_BACKEND", default="payment_codes.converters.HttpConverter"
+)
+CONVERTER_POOL_SIZE = env.int("CONVERTER_POOL_SIZE", default=2)
+CONVERTER_WORKER_MAX_JOBS = env.int("CONVERTER_WORKER_MAX_JOBS", default=200)
+LIBREOFFICE_BINARY = env("LIBREOFFICE_BINARY", default="soffice")
+
+# Numbers given to applications created without one: a str.format pattern with
+# ``seq`` (the sequence value) and ``date`` (today), and how many sequence values
+# each worker reserves at a time
+APPLICATION_NUMBER_FORMAT = env(
+    "APPLICATION_NUMBER_FORMAT", default="{date:%Y}-{seq:06d}"
+)
+APPLICATION_NUMBER_BLOCK = env.int("APPLICATION_NUMBER_BLOCK", default=50)
+# Digits of the payment code numbers allocated by the server, zero padded
+PAYMENT_CODE_NUMBER_WIDTH = env.int("PAYMENT_CODE_NUMBER_WIDTH", default=8)
+
+# Change feed: page sizes, how long deletes are remembered (older cursors must
+# resync), and the clock difference allowed between application servers and
+# the database when deciding which rows are final
+CHANGE_FEED_PAGE_SIZE = env.int("CHANGE_FEED_PAGE_SIZE", default=100)
+CHANGE_FEED_MAX_PAGE_SIZE = env.int("CHANGE_FEED_MAX_PAGE_SIZE", default=1000)
+CHANGE_FEED_RETENTION_DAYS = env.int("CHANGE_FEED_RETENTION_DAYS", default=30)
+CHANGE_FEED_CLOCK_SKEW_SECONDS = env.float(
+    "CHANGE_FEED_CLOCK_SKEW_SECONDS", default=1.0
+)
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+    },
+    "loggers": {
+        "interrail_moscow_code.tracing": {
+            "handlers": ["console"],
+            "level": env("SPAN_LOG_LEVEL", default="INFO"),
+        },
+    },
+}
+
 SPECTACULAR_SETTINGS = {
     "TITLE": "InterRail Ru PaymentCode API",
     "DESCRIPTION": "Payment code api for InterRail Ru",
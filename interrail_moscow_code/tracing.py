@@ -0,0 +1,47 @@
+"""
+Named timing spans emitted as structured logs and aggregated into metrics.
+"""
+
+import logging
+import time
+from contextlib import contextmanager
+
+from interrail_moscow_code.metrics import histogram
+
+logger = logging.getLogger(__name__)
+
+SPAN_DURATION = histogram(
+    "span_duration_seconds",
+    "Duration of named spans inside request handling.",
+    ["span", "outcome"],
+)
+
+
+@contextmanager
+def span(name: str, **fields):
+    """
+    Time the wrapped block, log it as ``span=<name> duration_ms=<ms> ...`` and
+    observe it in ``span_duration_seconds``.
+
+    Extra keyword arguments are attached to the log record and appended to the
+    message as ``key=value`` pairs.
+    """
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        duration = time.perf_counter() - start
+        SPAN_DURATION.observe(duration, span=name, outcome=outcome)
+        if logger.isEnabledFor(logging.INFO):
+            details = "".join(f" {key}={value}" for key, value in fields.items())
+            logger.info(
+                f"span={name} duration_ms={duration * 1000:.1f} outcome={outcome}{details}",
+                extra={
+                    "span": name,
+                    "duration_ms": round(duration * 1000, 3),
+                    "outcome": outcome,
+                    "fields": fields,
+                },
+            )
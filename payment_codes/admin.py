@@ -1,13 +1,184 @@
-from django.contrib import admin
+"""
+Admin for the payment code tables.
 
-from payment_codes.models import PaymentCode, Territory, Counterparty, Application
+The code and application tables grow into the millions, so their changelists run
+in a performance mode: related columns are joined instead of fetched per row, the
+unfiltered row count comes from the planner statistics, filter choices are cached
+and foreign keys are edited through autocomplete widgets instead of full selects.
+
+Bulk actions on codes and applications do not touch the rows in the request,
+they start a background job from payment_codes.jobs and link to its progress.
+"""
+
+from functools import cached_property
+
+from django import forms
+from django.conf import settings
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ACTION_CHECKBOX_NAME
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import connections
+from django.template.response import TemplateResponse
+from django.urls import reverse
+from django.utils.html import format_html
+
+from interrail_moscow_code.metrics import record_cache_access
+from payment_codes import jobs
+from payment_codes.models import (
+    PaymentCode,
+    Territory,
+    Counterparty,
+    Application,
+    BulkJob,
+)
+
+
+def estimated_count(model, using="default"):
+    """
+    Row count of the model's table as estimated by the last ANALYZE, or None if
+    the table has never been analyzed.
+    """
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+            [model._meta.db_table],
+        )
+        row = cursor.fetchone()
+    # reltuples is -1 until the first VACUUM or ANALYZE
+    if row is None or row[0] < 0:
+        return None
+    return row[0]
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that trusts pg_class instead of COUNT(*) for unfiltered lists of
+    large tables.
+
+    Filtered lists and tables below ADMIN_ESTIMATED_COUNT_THRESHOLD rows are
+    counted exactly.
+    """
+
+    @cached_property
+    def count(self):
+        query = getattr(self.object_list, "query", None)
+        if query is not None and not query.where:
+            estimate = estimated_count(self.object_list.model, self.object_list.db)
+            if estimate is not None and (
+                estimate >= settings.ADMIN_ESTIMATED_COUNT_THRESHOLD
+            ):
+                return estimate
+        return super().count
+
+
+class CachedRelatedFieldListFilter(admin.RelatedFieldListFilter):
+    """
+    Related field filter whose choices are cached for ADMIN_FILTER_CACHE_SECONDS.
+    """
+
+    def field_choices(self, field, request, model_admin):
+        key = f"admin-filter:{model_admin.opts.label_lower}:{self.field_path}"
+        choices = cache.get(key)
+        record_cache_access("admin_filter", choices is not None)
+        if choices is None:
+            choices = super().field_choices(field, request, model_admin)
+            cache.set(key, choices, settings.ADMIN_FILTER_CACHE_SECONDS)
+        return choices
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    Changelist settings for tables too large to count or scan on every page view.
+    """
+
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    # Facet counts are one COUNT per filter choice over the whole table
+    show_facets = admin.ShowFacets.NEVER
+
+
+def start_background_job(modeladmin, request, kind, queryset, params=None):
+    """
+    Start a bulk job for the selected rows and tell the user where to follow it.
+    """
+    job = jobs.start_job(kind, queryset, params, user=request.user)
+    url = reverse("admin:payment_codes_bulkjob_change", args=[job.pk])
+    modeladmin.message_user(
+        request,
+        format_html('Started <a href="{}">{}</a> for {} rows.', url, job, job.total),
+        messages.SUCCESS,
+    )
+    return job
+
+
+def transition_action(status):
+    def action(modeladmin, request, queryset):
+        start_background_job(
+            modeladmin, request, BulkJob.TRANSITION, queryset, {"status": status}
+        )
+
+    action.__name__ = f"mark_{status.lower()}"
+    return admin.action(
+        description=f"Mark selected codes as {status}", permissions=["change"]
+    )(action)
+
+
+class ReassignTerritoryForm(forms.Form):
+    territory = forms.ModelChoiceField(queryset=Territory.objects.order_by("name"))
 
 
 @admin.register(PaymentCode)
-class PaymentCodeAdmin(admin.ModelAdmin):
+class PaymentCodeAdmin(LargeTableAdmin):
     list_display = ["number", "territory", "code_status", "date"]
+    list_select_related = ["territory"]
     search_fields = ["number", "code_status"]
-    list_filter = ["code_status", "territory"]
+    list_filter = ["code_status", ("territory", CachedRelatedFieldListFilter)]
+    autocomplete_fields = ["application", "territory"]
+    actions = [
+        *(transition_action(status) for status, _ in PaymentCode.CODE_STATUS_CHOICES),
+        "reassign_territory",
+        "delete_in_background",
+    ]
+
+    def get_actions(self, request):
+        # The stock action collects every selected code in memory before deleting
+        actions = super().get_actions(request)
+        actions.pop("delete_selected", None)
+        return actions
+
+    @admin.action(
+        description="Move selected codes to another territory", permissions=["change"]
+    )
+    def reassign_territory(self, request, queryset):
+        form = ReassignTerritoryForm(request.POST if "apply" in request.POST else None)
+        if form.is_valid():
+            start_background_job(
+                self,
+                request,
+                BulkJob.REASSIGN,
+                queryset,
+                {"territory_id": form.cleaned_data["territory"].pk},
+            )
+            return None
+        return TemplateResponse(
+            request,
+            "admin/payment_codes/reassign_territory.html",
+            {
+                **self.admin_site.each_context(request),
+                "title": "Reassign territory",
+                "opts": self.opts,
+                "form": form,
+                "count": queryset.count(),
+                "selected": request.POST.getlist(ACTION_CHECKBOX_NAME),
+                "select_across": request.POST.get("select_across", "0"),
+                "action_checkbox_name": ACTION_CHECKBOX_NAME,
+            },
+        )
+
+    @admin.action(description="Delete selected codes", permissions=["delete"])
+    def delete_in_background(self, request, queryset):
+        start_background_job(self, request, BulkJob.DELETE, queryset)
 
 
 @admin.register(Territory)
@@ -23,7 +194,50 @@ class CounterpartyAdmin(admin.ModelAdmin):
 
 
 @admin.register(Application)
-class ApplicationAdmin(admin.ModelAdmin):
+class ApplicationAdmin(LargeTableAdmin):
     list_display = ["number", "forwarder", "date"]
+    list_select_related = ["forwarder"]
     search_fields = ["number", "cargo"]
     list_filter = ["sending_type", "date"]
+    autocomplete_fields = ["forwarder", "manager", "territories"]
+    actions = ["regenerate_documents"]
+
+    @admin.action(
+        description="Regenerate PDFs of selected applications", permissions=["change"]
+    )
+    def regenerate_documents(self, request, queryset):
+        start_background_job(self, request, BulkJob.REGENERATE, queryset)
+
+
+@admin.register(BulkJob)
+class BulkJobAdmin(admin.ModelAdmin):
+    list_display = ["__str__", "status", "progress", "failed", "created_by", "created"]
+    list_filter = ["kind", "status"]
+    list_select_related = ["created_by"]
+    fields = [
+        "kind",
+        "params",
+        "status",
+        "progress",
+        "failed",
+        "error",
+        "created_by",
+        "created",
+        "finished",
+    ]
+    readonly_fields = fields
+
+    @admin.display(description="Progress")
+    def progress(self, job):
+        percent = job.processed * 100 // job.total if job.total else 100
+        return f"{job.processed}/{job.total} ({percent}%)"
+
+    def get_queryset(self, request):
+        # object_ids can hold millions of ids, it is never displayed
+        return super().get_queryset(request).defer("object_ids")
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class PaymentCodesConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "payment_codes"
+
+    def ready(self):
+        from payment_codes import signals  # noqa: F401
@@ -0,0 +1,124 @@
+"""
+Archival of closed-out payment codes into the partitioned ``payment_code_archive``.
+
+Completed and Canceled codes are never touched again, yet they are most of
+``payment_code``. Moving them out keeps the table, its indexes and its vacuum
+cost proportional to the codes still being worked on.
+"""
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from payment_codes.models import PaymentCode
+
+CLOSED_STATUSES = [PaymentCode.COMPLETED, PaymentCode.CANCELED]
+
+CODE_COLUMNS = ", ".join(
+    [
+        "id",
+        "created",
+        "modified",
+        "code_status",
+        "number",
+        "date",
+        "smgs_code",
+        "smgs_date",
+        "weight",
+        "wagon_number",
+        "container_number",
+        "rate",
+        "add_charges",
+        "smgs_file",
+        "comment",
+        "application_id",
+        "territory_id",
+    ]
+)
+
+CANDIDATES = """
+FROM payment_code
+WHERE code_status = ANY(%s) AND created < %s AND modified < %s
+"""
+
+MOVE_BATCH = f"""
+WITH batch AS (
+    SELECT id {CANDIDATES}
+    ORDER BY id
+    LIMIT %s
+    FOR UPDATE SKIP LOCKED
+), moved AS (
+    DELETE FROM payment_code
+    USING batch
+    WHERE payment_code.id = batch.id
+    RETURNING payment_code.*
+)
+INSERT INTO payment_code_archive ({CODE_COLUMNS}, archived_at)
+SELECT {CODE_COLUMNS}, %s FROM moved
+"""
+
+
+def months_ago(months, now=None):
+    now = now or timezone.now()
+    month_index = now.year * 12 + now.month - 1 - months
+    year, month = divmod(month_index, 12)
+    return now.replace(
+        year=year, month=month + 1, day=1, hour=0, minute=0, second=0, microsecond=0
+    )
+
+
+def partition_name(year):
+    return f"payment_code_archive_y{year}"
+
+
+def ensure_partitions(first_year, last_year):
+    """
+    Create the yearly archive partitions covering ``first_year..last_year``.
+    """
+    # DDL cannot take bound parameters, the bounds are built from integers
+    with connection.cursor() as cursor:
+        for year in range(first_year, last_year + 1):
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {partition_name(year)} "
+                "PARTITION OF payment_code_archive "
+                f"FOR VALUES FROM ('{year}-01-01') TO ('{year + 1}-01-01')"
+            )
+
+
+def count_archivable(cutoff):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT COUNT(*) {CANDIDATES}", [CLOSED_STATUSES, cutoff, cutoff]
+        )
+        return cursor.fetchone()[0]
+
+
+def archive_codes(cutoff, batch_size=5000, max_batches=None):
+    """
+    Move closed-out codes created and last modified before ``cutoff`` into the
+    archive, ``batch_size`` rows per transaction. Yields the size of each batch.
+
+    Codes locked by a concurrent writer are skipped and picked up by a later run.
+    Rows are moved with plain SQL, so the application counters are left alone:
+    archived codes still count towards them.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT MIN(created) {CANDIDATES}", [CLOSED_STATUSES, cutoff, cutoff]
+        )
+        oldest = cursor.fetchone()[0]
+    if oldest is None:
+        return
+    ensure_partitions(timezone.localtime(oldest).year, timezone.localtime(cutoff).year)
+
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                MOVE_BATCH,
+                [CLOSED_STATUSES, cutoff, cutoff, batch_size, timezone.now()],
+            )
+            moved = cursor.rowcount
+        if not moved:
+            return
+        batches += 1
+        yield moved
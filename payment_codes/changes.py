@@ -0,0 +1,163 @@
+"""
+Change feed of applications and payment codes.
+
+Clients sync incrementally by passing the ``next`` cursor of one page as
+``since`` of the next request. A page holds the records changed after the
+cursor in ``(modified, id)`` order, created and updated ones with their data
+and deleted ones as tombstones, read with keyset pagination on the
+``(modified, id)`` indexes.
+
+``modified`` is set when a row is written, not when its transaction commits, so
+a slow transaction can commit rows older than a cursor already handed out. The
+feed therefore stops short of the oldest write transaction still running on the
+primary, less CHANGE_FEED_CLOCK_SKEW_SECONDS for the application servers' clocks,
+and picks those rows up once they are visible.
+
+Tombstones are kept for CHANGE_FEED_RETENTION_DAYS. A cursor older than that
+may have missed deletes, and the client has to list everything again.
+"""
+
+import base64
+import heapq
+import json
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import BooleanField
+from django.db.models.expressions import RawSQL
+from django.utils import timezone
+
+from payment_codes.models import Tombstone
+
+# Rows older than every write transaction in flight are final
+HORIZON_SQL = """
+SELECT LEAST(statement_timestamp(), MIN(xact_start))
+FROM pg_stat_activity
+WHERE backend_xid IS NOT NULL AND pid <> pg_backend_pid()
+"""
+
+
+class CursorExpired(Exception):
+    """
+    Raised for a cursor older than the tombstones that are still kept.
+    """
+
+
+def encode_cursor(timestamp, pk):
+    raw = json.dumps([timestamp.isoformat(), pk]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Return the ``(timestamp, id)`` of a cursor, raising ValueError if it is
+    malformed.
+    """
+    try:
+        timestamp, pk = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        timestamp = datetime.fromisoformat(timestamp)
+    except (TypeError, ValueError, UnicodeError) as e:
+        raise ValueError(f"Invalid cursor: {e}") from e
+    if timezone.is_naive(timestamp) or not isinstance(pk, int):
+        raise ValueError("Invalid cursor")
+    return timestamp, pk
+
+
+def feed_horizon():
+    """
+    Upper bound of the ``modified`` values that are safe to hand out.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(HORIZON_SQL)
+        horizon = cursor.fetchone()[0]
+    return horizon - timedelta(seconds=settings.CHANGE_FEED_CLOCK_SKEW_SECONDS)
+
+
+def after(queryset, timestamp_field, id_field, position):
+    """
+    Filter ``queryset`` to rows past ``position`` in ``(timestamp, id)`` order,
+    as one row comparison the index can answer.
+    """
+    if position is None:
+        return queryset
+    table = queryset.model._meta.db_table
+    return queryset.filter(
+        RawSQL(
+            f'("{table}"."{timestamp_field}", "{table}"."{id_field}") > (%s, %s)',
+            position,
+            output_field=BooleanField(),
+        )
+    )
+
+
+def read_changes(queryset, kind, since=None, limit=100):
+    """
+    Read one page of changes to the records of ``queryset`` and to the deleted
+    ones of ``kind``.
+
+    Returns ``(changes, next_cursor, has_more)``, each change an
+    ``(action, object_id, timestamp, instance)`` tuple where ``instance`` is None
+    for deletes.
+    """
+    position = decode_cursor(since) if since else None
+    if position and position[0] < timezone.now() - timedelta(
+        days=settings.CHANGE_FEED_RETENTION_DAYS
+    ):
+        raise CursorExpired("Cursor is older than the change feed retention")
+    horizon = feed_horizon()
+
+    # One extra row of each source tells whether there is another page
+    rows = list(
+        after(queryset, "modified", "id", position)
+        .filter(modified__lt=horizon)
+        .order_by("modified", "id")[: limit + 1]
+    )
+    tombstones = list(
+        after(Tombstone.objects.filter(kind=kind), "deleted", "object_id", position)
+        .filter(deleted__lt=horizon)
+        .order_by("deleted", "object_id")[: limit + 1]
+    )
+
+    changes = heapq.merge(
+        (
+            (
+                row.modified,
+                row.pk,
+                "created" if not position or row.created > position[0] else "updated",
+                row,
+            )
+            for row in rows
+        ),
+        (
+            (tombstone.deleted, tombstone.object_id, "deleted", None)
+            for tombstone in tombstones
+        ),
+        key=lambda change: change[:2],
+    )
+    changes = list(changes)
+    page = changes[:limit]
+    if page:
+        next_cursor = encode_cursor(page[-1][0], page[-1][1])
+    else:
+        next_cursor = since
+    return (
+        [(action, pk, timestamp, row) for timestamp, pk, action, row in page],
+        next_cursor,
+        len(changes) > limit,
+    )
+
+
+def purge_tombstones(batch_size=10_000):
+    """
+    Delete tombstones past CHANGE_FEED_RETENTION_DAYS, ``batch_size`` rows at a
+    time. Returns the number of rows deleted.
+    """
+    deleted = 0
+    cutoff = timezone.now() - timedelta(days=settings.CHANGE_FEED_RETENTION_DAYS)
+    while True:
+        expired = Tombstone.objects.filter(deleted__lt=cutoff).values("pk")[:batch_size]
+        count, _ = Tombstone.objects.filter(pk__in=expired).delete()
+        deleted += count
+        if count < batch_size:
+            return deleted
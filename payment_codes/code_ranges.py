@@ -0,0 +1,108 @@
+"""
+Allocation of payment code numbers per territory.
+
+Every territory has a TerritoryCodeCounter row with its next free number. A
+block of numbers is taken with one ``INSERT ... ON CONFLICT DO UPDATE ...
+RETURNING`` that moves the counter past the block and returns where it starts,
+so concurrent dispatchers always get disjoint blocks without checking for
+overlaps or retrying.
+
+Like ``nextval()`` of a sequence, blocks are taken on the shared_state
+connection, which commits the statement right away. The counter row is only
+locked for that statement instead of until the request that creates the codes
+commits, and a request that fails afterwards leaves a gap.
+
+Ranges chosen by clients move the counter past their end in the request's
+transaction, so blocks allocated later never overlap them. The upsert locks the
+counter row even when it leaves the counter alone, which queues explicit ranges
+of a territory behind each other while each one checks by numeric value that
+none of its numbers was issued yet. The unique (territory, number) index
+catches what the check cannot see, codes of a block still being created.
+"""
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.utils import timezone
+
+from interrail_moscow_code.db_router import SHARED_STATE_DB_ALIAS
+from payment_codes.models import NumberValue, PaymentCode
+
+RESERVE_BLOCK = """
+INSERT INTO territory_code_counter AS counter (territory_id, next_number)
+VALUES (%(territory)s, 1 + %(count)s)
+ON CONFLICT (territory_id) DO UPDATE
+    SET next_number = counter.next_number + %(count)s
+RETURNING next_number - %(count)s
+"""
+
+ADVANCE_COUNTER = """
+INSERT INTO territory_code_counter AS counter (territory_id, next_number)
+VALUES (%(territory)s, %(next)s)
+ON CONFLICT (territory_id) DO UPDATE
+    SET next_number = EXCLUDED.next_number
+    WHERE counter.next_number < EXCLUDED.next_number
+"""
+
+
+def reserve_block(territory_id, count):
+    """
+    Take the next ``count`` consecutive numbers of a territory and return the
+    first one. Committed at once, see the module docstring.
+    """
+    alias = (
+        SHARED_STATE_DB_ALIAS
+        if SHARED_STATE_DB_ALIAS in settings.DATABASES
+        else DEFAULT_DB_ALIAS
+    )
+    with connections[alias].cursor() as cursor:
+        cursor.execute(RESERVE_BLOCK, {"territory": territory_id, "count": count})
+        return cursor.fetchone()[0]
+
+
+def advance_counter(territory_id, last):
+    """
+    Make sure numbers up to ``last`` are never allocated for the territory.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(ADVANCE_COUNTER, {"territory": territory_id, "next": last + 1})
+
+
+def claim_range(territory_id, first, last):
+    """
+    Keep the numbers ``first..last`` out of later allocated blocks of a
+    territory. Returns whether none of them was issued yet.
+    """
+    advance_counter(territory_id, last)
+    return not (
+        PaymentCode.objects.filter(territory_id=territory_id)
+        .alias(value=NumberValue("number"))
+        .filter(value__range=(first, last))
+        .exists()
+    )
+
+
+def format_number(number, width=None):
+    width = settings.PAYMENT_CODE_NUMBER_WIDTH if width is None else width
+    return str(number).zfill(width)
+
+
+def create_codes(application, territory_id, first, count, width=None):
+    """
+    Create ``count`` codes of the application numbered from ``first``.
+    """
+    now = timezone.now()
+    codes = [
+        PaymentCode(
+            application=application,
+            date=application.date,
+            number=format_number(number, width),
+            territory_id=territory_id,
+            created=now,
+            modified=now,
+        )
+        for number in range(first, first + count)
+    ]
+    # In batches that stay under the 65535 bind parameters of a server-side
+    # bound statement
+    PaymentCode.objects.bulk_create(codes, batch_size=2000)
+    return codes
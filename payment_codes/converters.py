@@ -0,0 +1,231 @@
+"""
+DOCX to PDF converter backends.
+
+CONVERTER_BACKEND names the class ``convert()`` hands documents to:
+
+- ``HttpConverter`` posts them to the converter service, balanced between the
+  instances listed in DOC_TO_PDF_CONVERTER_URL
+- ``LocalOfficeConverter`` runs LibreOffice on this machine, without the
+  network hop, for single-node deployments
+
+A backend raises one of CONVERTER_UNAVAILABLE when the conversion could not be
+done at all, the application is then saved and its PDF generated later. A
+document the converter refuses (a 4xx response, or LibreOffice exiting with an
+error) is a problem with the document, not with the converter, and is reported
+to the client.
+"""
+
+import atexit
+import logging
+import os
+import queue
+import shutil
+import signal
+import subprocess
+import tempfile
+from functools import cache
+from pathlib import Path
+
+import requests
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+from interrail_moscow_code.balancer import EndpointBalancer
+
+logger = logging.getLogger(__name__)
+
+
+class ConverterUnavailable(Exception):
+    """
+    Raised when a local converter cannot convert the document.
+    """
+
+
+class ConverterTimeout(ConverterUnavailable):
+    """
+    Raised when a local conversion takes longer than its timeout.
+    """
+
+
+class DocumentRejected(Exception):
+    """
+    Raised when a local converter runs but cannot convert the document.
+    """
+
+
+CONVERTER_UNAVAILABLE = (ConverterUnavailable, requests.RequestException)
+CONVERTER_TIMEOUTS = (ConverterTimeout, requests.Timeout)
+
+
+class BaseConverter:
+    def to_pdf(self, docx_file, timeout):
+        """
+        Convert the DOCX file at ``docx_file`` and return the PDF content.
+        """
+        raise NotImplementedError
+
+
+def is_converter_failure(exc):
+    """
+    Whether an error says something about the converter's health: no answer
+    at all or a server error, not a rejected document.
+    """
+    if isinstance(exc, DocumentRejected):
+        return False
+    response = getattr(exc, "response", None)
+    return response is None or response.status_code >= 500
+
+
+def converter_unavailable(exc):
+    """
+    Whether the document could not be converted because of the converter
+    rather than the document, so it can be generated later.
+    """
+    return isinstance(exc, CONVERTER_UNAVAILABLE) and is_converter_failure(exc)
+
+
+class HttpConverter(BaseConverter):
+    def __init__(self):
+        if not settings.DOC_TO_PDF_CONVERTER_URLS:
+            raise ImproperlyConfigured(
+                "HttpConverter needs DOC_TO_PDF_CONVERTER_URL to be set"
+            )
+        self.balancer = EndpointBalancer(
+            "converter",
+            settings.DOC_TO_PDF_CONVERTER_URLS,
+            is_failure=is_converter_failure,
+            alpha=settings.CONVERTER_EWMA_ALPHA,
+            eject_after=settings.CONVERTER_EJECT_FAILURES,
+            eject_seconds=settings.CONVERTER_EJECT_SECONDS,
+            max_eject_seconds=settings.CONVERTER_MAX_EJECT_SECONDS,
+        )
+
+    def to_pdf(self, docx_file, timeout):
+        return self.post(docx_file, timeout).content
+
+    def post(self, docx_file, timeout):
+        """
+        Send the document to the least loaded converter. A converter that cannot
+        be connected to never saw the request, so the next untried one gets it.
+        """
+        tried = []
+        while True:
+            try:
+                with self.balancer.lease(exclude=tried) as url:
+                    tried.append(url)
+                    with open(docx_file, "rb") as document:
+                        response = requests.post(
+                            url, files={"document": document}, timeout=timeout
+                        )
+                    response.raise_for_status()
+                    return response
+            except requests.ConnectionError as e:
+                if len(tried) >= len(self.balancer):
+                    raise
+                logger.warning(f"Converter {url} unreachable, trying another: {e}")
+
+
+class OfficeWorker:
+    """
+    One LibreOffice slot with its own user profile. The profile is what makes
+    a cold start slow, so it is kept between jobs and only thrown away to
+    recycle the worker after ``max_jobs`` conversions or a hung one.
+    """
+
+    def __init__(self, binary, directory, max_jobs):
+        self.binary = binary
+        self.directory = directory
+        self.profile = os.path.join(directory, "profile")
+        self.max_jobs = max_jobs
+        self.jobs = 0
+
+    def command(self, docx_file, outdir):
+        return [
+            self.binary,
+            f"-env:UserInstallation={Path(self.profile).as_uri()}",
+            "--headless",
+            "--norestore",
+            "--nolockcheck",
+            "--convert-to",
+            "pdf",
+            "--outdir",
+            outdir,
+            docx_file,
+        ]
+
+    def convert(self, docx_file, timeout):
+        with tempfile.TemporaryDirectory(dir=self.directory) as outdir:
+            try:
+                process = subprocess.Popen(
+                    self.command(docx_file, outdir),
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                    # Its own process group, so a hung soffice.bin dies with it
+                    start_new_session=True,
+                )
+            except OSError as e:
+                raise ConverterUnavailable(f"Cannot run {self.binary}: {e}") from e
+            try:
+                _, stderr = process.communicate(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                os.killpg(process.pid, signal.SIGKILL)
+                process.communicate()
+                self.recycle()
+                raise ConverterTimeout(f"Conversion took over {timeout} seconds")
+
+            self.jobs += 1
+            if self.jobs >= self.max_jobs:
+                self.recycle()
+            pdf_file = os.path.join(outdir, Path(docx_file).with_suffix(".pdf").name)
+            if process.returncode or not os.path.exists(pdf_file):
+                raise DocumentRejected(
+                    f"{self.binary} exited with {process.returncode}: "
+                    f"{stderr.decode(errors='replace').strip()}"
+                )
+            with open(pdf_file, "rb") as f:
+                return f.read()
+
+    def recycle(self):
+        shutil.rmtree(self.profile, ignore_errors=True)
+        self.jobs = 0
+
+
+class LocalOfficeConverter(BaseConverter):
+    """
+    Convert with a pool of CONVERTER_POOL_SIZE LibreOffice workers in this
+    process. The pool size is the conversion concurrency, further requests
+    wait up to their timeout for a free worker.
+    """
+
+    def __init__(self):
+        self.directory = tempfile.mkdtemp(prefix="office-converter-")
+        atexit.register(shutil.rmtree, self.directory, ignore_errors=True)
+        self.workers = queue.Queue()
+        for index in range(settings.CONVERTER_POOL_SIZE):
+            directory = os.path.join(self.directory, str(index))
+            os.mkdir(directory)
+            self.workers.put(
+                OfficeWorker(
+                    settings.LIBREOFFICE_BINARY,
+                    directory,
+                    settings.CONVERTER_WORKER_MAX_JOBS,
+                )
+            )
+
+    def to_pdf(self, docx_file, timeout):
+        try:
+            worker = self.workers.get(timeout=timeout)
+        except queue.Empty:
+            raise ConverterTimeout(
+                f"No office worker free within {timeout} seconds"
+            ) from None
+        try:
+            return worker.convert(docx_file, timeout)
+        finally:
+            self.workers.put(worker)
+
+
+@cache
+def get_converter():
+    return import_string(settings.CONVERTER_BACKEND)()
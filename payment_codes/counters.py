@@ -0,0 +1,192 @@
+"""
+Maintenance of the denormalized code and territory counters on Application.
+
+Every change is applied as a single ``UPDATE ... SET field = field + n`` so that
+concurrent writers never overwrite each other. Each one also bumps ``modified``,
+which is what the change feed follows. ``manage.py reconcile_counters``
+recomputes the counters from the source tables and fixes any drift.
+"""
+
+from collections import Counter
+
+from django.db import connection
+from django.db.models import Count, F, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from payment_codes.models import Application, ArchivedPaymentCode, PaymentCode
+
+
+def adjust_counters(application_id, **deltas):
+    """
+    Atomically add the given deltas to the counters of one application.
+    """
+    changes = {field: F(field) + delta for field, delta in deltas.items() if delta}
+    if changes:
+        Application.objects.filter(pk=application_id).update(
+            **changes, modified=timezone.now()
+        )
+
+
+def status_deltas(statuses, sign=1):
+    """
+    Build counter deltas for codes with the given statuses.
+    """
+    deltas = Counter()
+    for status, count in Counter(statuses).items():
+        deltas["codes_count"] += sign * count
+        deltas[PaymentCode.STATUS_COUNTER_FIELDS[status]] += sign * count
+    return deltas
+
+
+def reserve_codes(application, count, status=PaymentCode.CHECKING):
+    """
+    Count ``count`` new codes against the application if they fit its quota.
+
+    The quota check and the increment happen in one UPDATE, so concurrent range
+    requests cannot overshoot ``territories_count * quantity``. Returns False when
+    the codes do not fit.
+    """
+    status_field = PaymentCode.STATUS_COUNTER_FIELDS[status]
+    updated = Application.objects.filter(
+        pk=application.pk,
+        codes_count__lte=F("territories_count") * F("quantity") - count,
+    ).update(
+        codes_count=F("codes_count") + count,
+        **{status_field: F(status_field) + count},
+        modified=timezone.now(),
+    )
+    return updated == 1
+
+
+def transition_codes(queryset, status):
+    """
+    Move every code in ``queryset`` to ``status`` with one set-based UPDATE and
+    adjust the per-status counters of the affected applications.
+
+    Should run inside a transaction so the counters and codes change together.
+    Returns the number of codes that changed status.
+    """
+    target = PaymentCode.STATUS_COUNTER_FIELDS[status]
+    changing = queryset.exclude(code_status=status)
+    groups = list(
+        changing.values("application_id", "code_status")
+        .order_by()
+        .annotate(count=Count("id"))
+    )
+    updated = changing.update(code_status=status, modified=timezone.now())
+
+    per_application = {}
+    for group in groups:
+        source = PaymentCode.STATUS_COUNTER_FIELDS[group["code_status"]]
+        deltas = per_application.setdefault(group["application_id"], Counter())
+        deltas[source] -= group["count"]
+        deltas[target] += group["count"]
+    for application_id, deltas in per_application.items():
+        adjust_counters(application_id, **deltas)
+    return updated
+
+
+DELETE_CODES = """
+DELETE FROM payment_code WHERE id = ANY(%s) RETURNING application_id, code_status
+"""
+
+
+def delete_codes(ids):
+    """
+    Delete the codes with the given ids with one DELETE and take them off the
+    counters of their applications, one UPDATE per application.
+
+    The per-code post_delete receiver is bypassed, the statement-level trigger
+    still records the tombstones. Should run inside a transaction. Returns the
+    number of deleted codes.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(DELETE_CODES, [list(ids)])
+        deleted = cursor.fetchall()
+
+    per_application = {}
+    for application_id, status in deleted:
+        per_application.setdefault(application_id, []).append(status)
+    for application_id, statuses in per_application.items():
+        adjust_counters(application_id, **status_deltas(statuses, sign=-1))
+    return len(deleted)
+
+
+def actual_counters():
+    """
+    Counter values computed from the source tables, as Application annotations.
+
+    Codes moved to the archive still count.
+    """
+
+    def count_rows(model, condition):
+        return Coalesce(
+            Subquery(
+                model.objects.filter(condition, application=OuterRef("pk"))
+                .order_by()
+                .values("application")
+                .annotate(count=Count("id"))
+                .values("count")
+            ),
+            Value(0),
+        )
+
+    def count_codes(condition=Q()):
+        return count_rows(PaymentCode, condition) + count_rows(
+            ArchivedPaymentCode, condition
+        )
+
+    through = Application.territories.through
+    counters = {
+        "territories_count": Coalesce(
+            Subquery(
+                through.objects.filter(application=OuterRef("pk"))
+                .order_by()
+                .values("application")
+                .annotate(count=Count("id"))
+                .values("count")
+            ),
+            Value(0),
+        ),
+        "codes_count": count_codes(),
+    }
+    for status, field in PaymentCode.STATUS_COUNTER_FIELDS.items():
+        counters[field] = count_codes(Q(code_status=status))
+    return counters
+
+
+def recount_territories(queryset):
+    """
+    Recompute ``territories_count`` of the applications in ``queryset`` in one UPDATE.
+    """
+    queryset.update(
+        territories_count=actual_counters()["territories_count"],
+        modified=timezone.now(),
+    )
+
+
+def reconcile(queryset=None, dry_run=False):
+    """
+    Recompute the counters of the applications in ``queryset`` and fix the ones
+    that drifted. Returns the number of drifted applications.
+    """
+    queryset = Application.objects.all() if queryset is None else queryset
+    counters = actual_counters()
+    annotations = {
+        f"actual_{field}": expression for field, expression in counters.items()
+    }
+    drift = Q()
+    for field in counters:
+        drift |= ~Q(**{field: F(f"actual_{field}")})
+    drifted = list(
+        queryset.order_by()
+        .annotate(**annotations)
+        .filter(drift)
+        .values_list("pk", flat=True)
+    )
+    if drifted and not dry_run:
+        Application.objects.filter(pk__in=drifted).update(
+            **counters, modified=timezone.now()
+        )
+    return len(drifted)
@@ -0,0 +1,163 @@
+"""
+``Idempotency-Key`` support for create endpoints.
+
+A request carrying the header first inserts an IdempotencyKey row and then runs
+inside the same transaction, storing its response on the row before commit:
+
+- a retry of a finished request gets the stored response back without running
+  the view again, marked with ``Idempotent-Replayed: true``
+- a concurrent duplicate blocks on the insert of the unique (user, key) pair
+  until the first request commits and then replays its response, or gives up
+  with 409 after IDEMPOTENCY_WAIT_SECONDS
+- the same key sent with a different request is rejected with 422
+
+Only successful responses are stored. A failed request rolls back its key with
+everything else, so the client can retry it for real.
+"""
+
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.utils import timezone
+from drf_spectacular.utils import OpenApiParameter
+from rest_framework import status
+from rest_framework.response import Response
+
+from payment_codes.models import IdempotencyKey
+
+HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+
+IDEMPOTENCY_KEY_PARAMETER = OpenApiParameter(
+    HEADER,
+    str,
+    OpenApiParameter.HEADER,
+    description=(
+        "Client-chosen unique key. Retries with the same key get the response "
+        "of the first successful request instead of running it again."
+    ),
+)
+
+
+def request_fingerprint(request):
+    """
+    Hash of what makes two requests the same: method, path and payload.
+    """
+    data = request.data
+    if hasattr(data, "lists"):
+        data = dict(data.lists())
+    payload = json.dumps(data, sort_keys=True, default=str)
+    raw = f"{request.method} {request.path}\n{payload}"
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def claim(user_id, key, fingerprint):
+    """
+    Insert the key, waiting for a concurrent holder to finish. Returns the new
+    row, or the existing one when the key is already taken and not expired.
+    """
+    expires_at = timezone.now() + timedelta(
+        seconds=settings.IDEMPOTENCY_KEY_TTL_SECONDS
+    )
+    for _ in range(2):
+        try:
+            with transaction.atomic():
+                return IdempotencyKey.objects.create(
+                    user_id=user_id,
+                    key=key,
+                    fingerprint=fingerprint,
+                    expires_at=expires_at,
+                )
+        except IntegrityError:
+            existing = IdempotencyKey.objects.get(user_id=user_id, key=key)
+            if existing.expires_at > timezone.now():
+                return existing
+            # The stored outcome outlived its TTL, start over with a fresh key
+            existing.delete()
+    raise IntegrityError(f"Could not claim idempotency key {key!r}")
+
+
+def run_once(request, key, handler):
+    """
+    Run ``handler`` at most once per user and key and return its response,
+    or the stored response of an earlier run.
+    """
+    if len(key) > 255:
+        return Response(
+            {"error": f"{HEADER} must be at most 255 characters."},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    fingerprint = request_fingerprint(request)
+    wait_ms = int(settings.IDEMPOTENCY_WAIT_SECONDS * 1000)
+
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(f"SET LOCAL lock_timeout = {wait_ms}")
+        try:
+            record = claim(request.user.pk, key, fingerprint)
+        except OperationalError:
+            return Response(
+                {"error": "A request with this Idempotency-Key is still running."},
+                status=status.HTTP_409_CONFLICT,
+            )
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL lock_timeout TO DEFAULT")
+
+        if record.fingerprint != fingerprint:
+            return Response(
+                {"error": f"{HEADER} was already used for a different request."},
+                status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            )
+        if record.status_code is not None:
+            return Response(
+                record.response,
+                status=record.status_code,
+                headers={REPLAYED_HEADER: "true"},
+            )
+
+        response = handler()
+        if status.is_success(response.status_code):
+            record.status_code = response.status_code
+            record.response = response.data
+            record.save(update_fields=["status_code", "response"])
+        else:
+            transaction.set_rollback(True)
+        return response
+
+
+class IdempotentCreateMixin:
+    """
+    Make POST honour the ``Idempotency-Key`` header.
+    """
+
+    def post(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if key is None:
+            return super().post(request, *args, **kwargs)
+        return run_once(
+            request,
+            key,
+            lambda: super(IdempotentCreateMixin, self).post(request, *args, **kwargs),
+        )
+
+
+def purge_expired(batch_size=10_000, max_batches=None):
+    """
+    Delete idempotency keys past their TTL, ``batch_size`` rows at a time.
+    Returns the number of rows deleted.
+    """
+    deleted = batches = 0
+    now = timezone.now()
+    while max_batches is None or batches < max_batches:
+        expired = IdempotencyKey.objects.filter(expires_at__lte=now).values("pk")[
+            :batch_size
+        ]
+        count, _ = IdempotencyKey.objects.filter(pk__in=expired).delete()
+        deleted += count
+        batches += 1
+        if count < batch_size:
+            break
+    return deleted
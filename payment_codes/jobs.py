@@ -0,0 +1,255 @@
+"""
+Background execution of bulk admin actions.
+
+An admin action snapshots the selected primary keys into a ``BulkJob`` and
+returns right away. The job then runs on a small thread pool, one chunk of
+BULK_JOB_CHUNK_SIZE rows per transaction, and records its progress after every
+chunk. A worker claims a job before running it, so a job only runs in one
+place at a time. Jobs left behind by a restarted worker are picked up again by
+``manage.py run_bulk_jobs`` once they made no progress for
+BULK_JOB_STALE_MINUTES.
+"""
+
+import logging
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from interrail_moscow_code.tracing import span
+from payment_codes.code_ranges import advance_counter
+from payment_codes.counters import delete_codes, transition_codes
+from payment_codes.models import Application, BulkJob, PaymentCode
+from payment_codes.utils import (
+    build_application_contexts,
+    generate_application_document,
+)
+
+logger = logging.getLogger(__name__)
+
+job_executor = ThreadPoolExecutor(
+    max_workers=settings.BULK_JOB_THREADS, thread_name_prefix="bulk-job"
+)
+
+HANDLERS = {}
+
+# Code numbers with a numeric value, see payment_codes.models.NumberValue
+DIGITS = re.compile(r"[0-9]{1,18}")
+
+
+def handler(kind):
+    """
+    Register the function that applies a job of ``kind`` to one chunk of ids.
+
+    Handlers are called with the ids, the job's params and a ``heartbeat`` that
+    records the job as alive, which handlers with slow rows call after each row.
+    They return the number of rows in the chunk they failed to process.
+    """
+
+    def register(func):
+        HANDLERS[kind] = func
+        return func
+
+    return register
+
+
+@handler(BulkJob.TRANSITION)
+def transition_chunk(ids, params, heartbeat):
+    with transaction.atomic():
+        transition_codes(PaymentCode.objects.filter(pk__in=ids), params["status"])
+    return 0
+
+
+@handler(BulkJob.REASSIGN)
+def reassign_chunk(ids, params, heartbeat):
+    territory_id = params["territory_id"]
+    with transaction.atomic():
+        codes = list(
+            PaymentCode.objects.filter(pk__in=ids)
+            .exclude(territory_id=territory_id)
+            .order_by("pk")
+            .values_list("pk", "number")
+        )
+        values = [int(number) for _, number in codes if DIGITS.fullmatch(number)]
+        if values:
+            # Keep the moved numbers out of blocks allocated in the territory
+            # later, this also queues the chunk behind explicit ranges there
+            advance_counter(territory_id, max(values))
+        taken = set(
+            PaymentCode.objects.filter(
+                territory_id=territory_id,
+                number__in=[number for _, number in codes if number],
+            ).values_list("number", flat=True)
+        )
+        moved, skipped = [], []
+        for pk, number in codes:
+            if number in taken:
+                skipped.append(pk)
+                continue
+            if number:
+                taken.add(number)
+            moved.append(pk)
+        PaymentCode.objects.filter(pk__in=moved).update(
+            territory_id=territory_id, modified=timezone.now()
+        )
+    if skipped:
+        logger.warning(
+            f"Codes {skipped} not moved to territory {territory_id}, "
+            "their numbers are taken there"
+        )
+    return len(skipped)
+
+
+@handler(BulkJob.DELETE)
+def delete_chunk(ids, params, heartbeat):
+    # One DELETE per chunk instead of the collector and a signal per code
+    with transaction.atomic():
+        delete_codes(ids)
+    return 0
+
+
+@handler(BulkJob.REGENERATE)
+def regenerate_chunk(ids, params, heartbeat):
+    failed = 0
+    applications = Application.objects.filter(pk__in=ids)
+    if params.get("pending_only"):
+        # Skip documents another job generated in the meantime
+        applications = applications.filter(document_pending=True)
+    applications = list(applications.order_by("pk"))
+    # Related data of the whole chunk in a fixed number of queries
+    with span("document.context", applications=len(applications)):
+        contexts = build_application_contexts(applications)
+    for application in applications:
+        # A conversion can take CONVERTER_TIMEOUT_SECONDS, keep the job from
+        # looking stale to run_bulk_jobs while the chunk is under way
+        heartbeat()
+        old_file = application.request_file.path if application.request_file else None
+        try:
+            pdf_path = generate_application_document(
+                application, contexts[application.pk]
+            )
+        except Exception as e:
+            failed += 1
+            logger.error(
+                f"Error generating PDF for application {application.id}: {str(e)}"
+            )
+            continue
+        application.request_file = pdf_path
+        application.document_pending = False
+        application.save(update_fields=["request_file", "document_pending", "modified"])
+        if old_file and old_file != application.request_file.path:
+            if os.path.exists(old_file):
+                os.remove(old_file)
+    return failed
+
+
+def start_job(kind, queryset, params=None, user=None, background=True):
+    """
+    Snapshot the ids in ``queryset`` into a new job and, unless ``background``
+    is False, schedule it once the current transaction commits.
+    """
+    ids = list(queryset.order_by("pk").values_list("pk", flat=True))
+    job = BulkJob.objects.create(
+        kind=kind,
+        params=params or {},
+        object_ids=ids,
+        total=len(ids),
+        # The id is enough, token users are not model instances
+        created_by_id=user.pk if user else None,
+    )
+    if background:
+        transaction.on_commit(lambda: schedule(job.pk))
+    return job
+
+
+def schedule(job_id):
+    """
+    Run a job on the background pool.
+    """
+    return job_executor.submit(run_in_pool, job_id)
+
+
+def run_in_pool(job_id):
+    try:
+        run_job(job_id)
+    finally:
+        close_old_connections()
+
+
+def unfinished_jobs(stale_after):
+    """
+    Pending and running jobs that have not made progress for ``stale_after``.
+    """
+    return BulkJob.objects.filter(
+        status__in=[BulkJob.PENDING, BulkJob.RUNNING],
+        modified__lt=timezone.now() - stale_after,
+    ).order_by("pk")
+
+
+def claim_job(job_id, stale_after):
+    """
+    Mark a job as running here, unless another worker already runs it.
+
+    A pending job can always be claimed, a running one only once it made no
+    progress for ``stale_after``. The check and the update are one statement,
+    so of two workers claiming the same job only one succeeds.
+    """
+    claimable = Q(status=BulkJob.PENDING) | Q(
+        status=BulkJob.RUNNING, modified__lt=timezone.now() - stale_after
+    )
+    claimed = BulkJob.objects.filter(claimable, pk=job_id).update(
+        status=BulkJob.RUNNING, modified=timezone.now()
+    )
+    return claimed == 1
+
+
+def run_job(job_id, stale_after=None):
+    """
+    Apply a job chunk by chunk, starting after the last recorded chunk.
+
+    Returns None without doing anything when the job is finished or running
+    elsewhere, see ``claim_job``.
+    """
+    if stale_after is None:
+        stale_after = timedelta(minutes=settings.BULK_JOB_STALE_MINUTES)
+    if not claim_job(job_id, stale_after):
+        logger.info(f"Bulk job {job_id} is finished or running elsewhere")
+        return None
+    job = BulkJob.objects.get(pk=job_id)
+    apply = HANDLERS[job.kind]
+
+    def heartbeat():
+        BulkJob.objects.filter(pk=job.pk).update(modified=timezone.now())
+
+    size = settings.BULK_JOB_CHUNK_SIZE
+    try:
+        with span("bulk_job.run", job=job.pk, kind=job.kind):
+            # Progress is recorded after the chunk commits, a job interrupted in
+            # between repeats that chunk, which every handler tolerates
+            for start in range(job.processed, job.total, size):
+                chunk = job.object_ids[start : start + size]
+                failed = apply(chunk, job.params, heartbeat) or 0
+                BulkJob.objects.filter(pk=job.pk).update(
+                    processed=F("processed") + len(chunk),
+                    failed=F("failed") + failed,
+                    modified=timezone.now(),
+                )
+    except Exception as e:
+        logger.exception(f"Bulk job {job.pk} failed")
+        status, error = BulkJob.FAILED, str(e)
+    else:
+        status, error = BulkJob.DONE, ""
+    BulkJob.objects.filter(pk=job.pk).update(
+        status=status, error=error, finished=timezone.now(), modified=timezone.now()
+    )
+    job.refresh_from_db()
+    logger.info(
+        f"Bulk job {job.pk} {job.status}: "
+        f"{job.processed}/{job.total} processed, {job.failed} failed"
+    )
+    return job
@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand
+
+from payment_codes.archive import archive_codes, count_archivable, months_ago
+
+
+class Command(BaseCommand):
+    help = (
+        "Move Completed and Canceled payment codes older than the given age into "
+        "the partitioned payment_code_archive table."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--older-than-months",
+            type=int,
+            default=12,
+            help="Archive codes created and last modified before this many months ago.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=5000,
+            help="Codes moved per transaction.",
+        )
+        parser.add_argument(
+            "--max-batches",
+            type=int,
+            default=None,
+            help="Stop after this many batches, to bound a single run.",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report how many codes would be archived.",
+        )
+
+    def handle(self, *args, **options):
+        cutoff = months_ago(options["older_than_months"])
+        if options["dry_run"]:
+            count = count_archivable(cutoff)
+            self.stdout.write(
+                self.style.SUCCESS(f"{count} codes older than {cutoff:%Y-%m-%d}")
+            )
+            return
+
+        total = 0
+        for moved in archive_codes(
+            cutoff,
+            batch_size=options["batch_size"],
+            max_batches=options["max_batches"],
+        ):
+            total += moved
+            self.stdout.write(f"Archived {total} codes")
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Archived {total} codes older than {cutoff:%Y-%m-%d}")
+        )
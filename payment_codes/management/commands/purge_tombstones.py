@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from payment_codes.changes import purge_tombstones
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete change feed tombstones older than CHANGE_FEED_RETENTION_DAYS. "
+        "Clients with an older cursor have to list everything again."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=10_000,
+            help="Rows deleted per statement.",
+        )
+
+    def handle(self, *args, **options):
+        deleted = purge_tombstones(batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Purged {deleted} tombstones"))
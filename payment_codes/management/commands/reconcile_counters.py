@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+
+from payment_codes.counters import reconcile
+from payment_codes.models import Application
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the denormalized code and territory counters on applications "
+        "and fix any that drifted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=10_000,
+            help="Applications checked per transaction, by id range.",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report how many applications drifted.",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        last_id = Application.objects.aggregate(last=Max("id"))["last"] or 0
+        drifted = 0
+        for start in range(0, last_id + 1, batch_size):
+            with transaction.atomic():
+                drifted += reconcile(
+                    Application.objects.filter(
+                        id__gte=start, id__lt=start + batch_size
+                    ),
+                    dry_run=options["dry_run"],
+                )
+
+        verb = "Found" if options["dry_run"] else "Fixed"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {drifted} drifted applications"))
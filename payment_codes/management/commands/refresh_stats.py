@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from payment_codes.stats import refresh_summaries
+
+
+class Command(BaseCommand):
+    help = "Refresh the materialized views behind the dashboard statistics API."
+
+    def handle(self, *args, **options):
+        refreshed_at = refresh_summaries()
+        self.stdout.write(
+            self.style.SUCCESS(f"Dashboard summaries refreshed as of {refreshed_at}")
+        )
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+
+from interrail_moscow_code.circuit_breaker import OPEN
+from payment_codes.jobs import run_job, start_job
+from payment_codes.models import Application, BulkJob
+from payment_codes.utils import converter_breaker
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate the PDFs of applications saved while the converter was "
+        "unavailable. Does nothing while the converter circuit is open or "
+        "another run is still under way."
+    )
+
+    def handle(self, *args, **options):
+        if converter_breaker.state() == OPEN:
+            self.stdout.write("Converter circuit is open, nothing regenerated")
+            return
+        # Resume the previous run instead of starting a second job over the
+        # same applications, run_job leaves it alone while it is still alive
+        job = (
+            BulkJob.objects.filter(
+                kind=BulkJob.REGENERATE,
+                params__pending_only=True,
+                status__in=[BulkJob.PENDING, BulkJob.RUNNING],
+            )
+            .order_by("pk")
+            .first()
+        )
+        if job is None:
+            pending = Application.objects.filter(document_pending=True)
+            job = start_job(
+                BulkJob.REGENERATE, pending, {"pending_only": True}, background=False
+            )
+        job_id = job.pk
+        job = run_job(job_id)
+        if job is None:
+            self.stdout.write(f"Job {job_id} is still regenerating documents")
+            return
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Regenerated {job.processed - job.failed} of {job.total} documents"
+            )
+        )
@@ -0,0 +1,37 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from payment_codes.jobs import run_job, unfinished_jobs
+
+
+class Command(BaseCommand):
+    help = (
+        "Run bulk admin jobs that were left pending or running, for example by a "
+        "restarted web worker. Each job resumes after its last finished chunk."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--stale-minutes",
+            type=int,
+            default=settings.BULK_JOB_STALE_MINUTES,
+            help="Only pick up jobs without progress for this many minutes.",
+        )
+
+    def handle(self, *args, **options):
+        stale_after = timedelta(minutes=options["stale_minutes"])
+        job_ids = list(unfinished_jobs(stale_after).values_list("pk", flat=True))
+        ran = 0
+        for job_id in job_ids:
+            job = run_job(job_id, stale_after)
+            if job is None:
+                self.stdout.write(f"Job {job_id} was claimed by another worker")
+                continue
+            ran += 1
+            self.stdout.write(
+                f"Job {job.pk} {job.status}: {job.processed}/{job.total} processed, "
+                f"{job.failed} failed"
+            )
+        self.stdout.write(self.style.SUCCESS(f"Ran {ran} jobs"))
@@ -0,0 +1,370 @@
+import io
+import random
+import time
+from datetime import datetime, time as dt_time, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from payment_codes.models import Application, Counterparty, PaymentCode, Territory
+from users.models import CustomUser
+
+SEED_PREFIX = "SEED"
+
+STATIONS = [
+    ("Москва-Товарная", "181102"),
+    ("Ташкент-Товарный", "720007"),
+    ("Санкт-Петербург-Сорт.", "030004"),
+    ("Екатеринбург-Товарный", "780106"),
+    ("Новосибирск-Восточный", "850606"),
+    ("Алматы-1", "700006"),
+    ("Самара", "639002"),
+    ("Казань", "648400"),
+    ("Чукурсай", "721409"),
+    ("Бухара-1", "736207"),
+]
+CARGOES = [
+    ("Хлопковое волокно", "5201", "321027"),
+    ("Пшеница", "1001", "011005"),
+    ("Уголь каменный", "2701", "161005"),
+    ("Лесоматериалы", "4403", "081016"),
+    ("Удобрения минеральные", "3102", "434008"),
+    ("Автозапчасти", "8708", "391070"),
+    ("Металлопрокат", "7208", "312035"),
+]
+ROLLING_STOCK_1 = ["Собственный (СПС)", "Инвентарный (МПС)"]
+ROLLING_STOCK_2 = ["Платформа", "Цистерна", "Вагон", "Фитинговая платформа"]
+CONDITIONS = ["FOR-FOR", "FOB-FOR", "FOR-FOB", "DAP-FOR"]
+CONTAINER_TYPES = [choice for choice, _ in Application.CONTAINER_TYPE_CHOICES]
+
+# Codes older than this are mostly closed out, recent ones are still in flight
+SETTLED_AFTER = timedelta(days=90)
+SETTLED_STATUSES = (
+    [PaymentCode.COMPLETED, PaymentCode.CANCELED, PaymentCode.USED],
+    [85, 10, 5],
+)
+OPEN_STATUSES = (
+    [
+        PaymentCode.CHECKING,
+        PaymentCode.USED,
+        PaymentCode.COMPLETED,
+        PaymentCode.CANCELED,
+    ],
+    [40, 40, 15, 5],
+)
+
+
+def zipf_weights(count, exponent=1.1):
+    """A few forwarders and territories get most of the traffic"""
+    return [1 / (rank**exponent) for rank in range(1, count + 1)]
+
+
+class TableWriter:
+    """
+    Write rows to a model table, with COPY on PostgreSQL and bulk_create elsewhere.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.fields = model._meta.concrete_fields
+        self.use_copy = connection.vendor == "postgresql"
+
+    def reserve_ids(self, count):
+        if not count:
+            return []
+        table = self.model._meta.db_table
+        with connection.cursor() as cursor:
+            if self.use_copy:
+                cursor.execute(
+                    "SELECT nextval(pg_get_serial_sequence(%s, 'id')) "
+                    "FROM generate_series(1, %s)",
+                    [table, count],
+                )
+                return [row[0] for row in cursor.fetchall()]
+            cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}")  # nosec B608
+            start = cursor.fetchone()[0] + 1
+            return list(range(start, start + count))
+
+    def write(self, rows):
+        if not rows:
+            return
+        if self.use_copy:
+            self._copy(rows)
+        else:
+            self.model.objects.bulk_create(
+                [self.model(**row) for row in rows], batch_size=5000
+            )
+
+    def _copy(self, rows):
+        # Primary keys that were not reserved up front come from the sequence
+        fields = [f for f in self.fields if f.attname in rows[0] or not f.primary_key]
+        buffer = io.StringIO()
+        for row in rows:
+            values = [
+                row[f.attname] if f.attname in row else f.get_default() for f in fields
+            ]
+            buffer.write("\t".join(self._copy_value(value) for value in values))
+            buffer.write("\n")
+        buffer.seek(0)
+        columns = ", ".join(connection.ops.quote_name(f.column) for f in fields)
+        sql = f"COPY {connection.ops.quote_name(self.model._meta.db_table)} ({columns}) FROM STDIN"
+        with connection.cursor() as cursor:
+            raw = cursor.cursor
+            if hasattr(raw, "copy_expert"):  # psycopg2
+                raw.copy_expert(sql, buffer)
+            else:  # psycopg 3
+                with raw.copy(sql) as copy:
+                    copy.write(buffer.getvalue())
+
+    @staticmethod
+    def _copy_value(value):
+        if value is None:
+            return "\\N"
+        if isinstance(value, bool):
+            return "t" if value else "f"
+        return (
+            str(value)
+            .replace("\\", "\\\\")
+            .replace("\t", "\\t")
+            .replace("\n", "\\n")
+            .replace("\r", "\\r")
+        )
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate a deterministic production-scale dataset of territories, "
+        "counterparties, applications and payment codes for benchmarking."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--applications", type=int, default=1_000_000)
+        parser.add_argument("--territories", type=int, default=60)
+        parser.add_argument("--counterparties", type=int, default=5_000)
+        parser.add_argument("--managers", type=int, default=40)
+        parser.add_argument(
+            "--years",
+            type=int,
+            default=3,
+            help="How many years of history the application dates cover.",
+        )
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=10_000,
+            help="Applications generated and written per transaction.",
+        )
+        parser.add_argument(
+            "--flush",
+            action="store_true",
+            help="Delete a previously seeded dataset before generating a new one.",
+        )
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options["seed"])
+        self.today = timezone.now().date()
+        self.years = options["years"]
+
+        if options["flush"]:
+            self.flush()
+        elif Application.objects.filter(number__startswith=f"{SEED_PREFIX}-").exists():
+            raise CommandError(
+                "Seed data already present, re-run with --flush to replace it."
+            )
+
+        started = time.monotonic()
+        territories = self.seed_reference(
+            Territory, "Seed territory", options["territories"]
+        )
+        forwarders = self.seed_reference(
+            Counterparty, "Seed forwarder", options["counterparties"]
+        )
+        managers = self.seed_managers(options["managers"])
+
+        self.territory_weights = zipf_weights(len(territories))
+        self.forwarder_weights = zipf_weights(len(forwarders))
+        # Each territory hands out its own increasing block of code numbers
+        self.next_code = {
+            t: self.rng.randint(10_000_000, 20_000_000) for t in territories
+        }
+
+        totals = {"applications": 0, "codes": 0}
+        remaining = options["applications"]
+        index = 0
+        while remaining > 0:
+            size = min(options["chunk_size"], remaining)
+            with transaction.atomic():
+                codes = self.seed_chunk(index, size, territories, forwarders, managers)
+            index += size
+            remaining -= size
+            totals["applications"] += size
+            totals["codes"] += codes
+            self.stdout.write(
+                f"{totals['applications']} applications, {totals['codes']} codes "
+                f"({time.monotonic() - started:.0f}s)"
+            )
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Seeded {len(territories)} territories, {len(forwarders)} counterparties, "
+                f"{totals['applications']} applications and {totals['codes']} payment codes "
+                f"in {time.monotonic() - started:.0f}s"
+            )
+        )
+
+    def flush(self):
+        applications = Application.objects.filter(number__startswith=f"{SEED_PREFIX}-")
+        PaymentCode.objects.filter(application__in=applications).delete()
+        Application.territories.through.objects.filter(
+            application__in=applications
+        ).delete()
+        applications.delete()
+        Territory.objects.filter(name__startswith="Seed territory ").delete()
+        Counterparty.objects.filter(name__startswith="Seed forwarder ").delete()
+        CustomUser.objects.filter(username__startswith="seed_manager_").delete()
+
+    def seed_reference(self, model, prefix, count):
+        model.objects.bulk_create(
+            [model(name=f"{prefix} {i:05d}") for i in range(count)], batch_size=5000
+        )
+        return list(
+            model.objects.filter(name__startswith=f"{prefix} ")
+            .order_by("name")
+            .values_list("id", flat=True)
+        )
+
+    def seed_managers(self, count):
+        password = make_password(None)
+        CustomUser.objects.bulk_create(
+            [
+                CustomUser(username=f"seed_manager_{i:03d}", password=password)
+                for i in range(count)
+            ]
+        )
+        return list(
+            CustomUser.objects.filter(username__startswith="seed_manager_")
+            .order_by("username")
+            .values_list("id", flat=True)
+        )
+
+    def random_date(self):
+        # Volume grows over time, so later days are drawn more often
+        days = int(self.years * 365 * (1 - self.rng.random() ** 2))
+        return self.today - timedelta(days=days)
+
+    def seed_chunk(self, start, size, territories, forwarders, managers):
+        rng = self.rng
+        application_writer = TableWriter(Application)
+        code_writer = TableWriter(PaymentCode)
+        through_writer = TableWriter(Application.territories.through)
+
+        application_ids = application_writer.reserve_ids(size)
+        applications, links, codes = [], [], []
+        for offset, application_id in enumerate(application_ids):
+            app_date = self.random_date()
+            stamp = timezone.make_aware(
+                datetime.combine(app_date, dt_time(8))
+                + timedelta(seconds=rng.randrange(36_000))
+            )
+            block_train = rng.random() < 0.2
+            quantity = (
+                rng.randint(20, 70)
+                if block_train
+                else rng.choice([1, 1, 1, 2, 3, 4, 5])
+            )
+            departure, departure_code = rng.choice(STATIONS)
+            destination, destination_code = rng.choice(STATIONS)
+            cargo, hs_code, etcng = rng.choice(CARGOES)
+            loading_type = rng.choice(["wagon", "container"])
+            app_territories = sorted(
+                set(
+                    rng.choices(
+                        territories,
+                        weights=self.territory_weights,
+                        k=rng.choices([1, 2, 3], weights=[70, 20, 10])[0],
+                    )
+                )
+            )
+            applications.append(
+                {
+                    "id": application_id,
+                    "created": stamp,
+                    "modified": stamp,
+                    "number": f"{SEED_PREFIX}-{start + offset:08d}",
+                    "request_file": f"applications/application_{SEED_PREFIX}-{start + offset:08d}.pdf",
+                    "sending_type": "block_train" if block_train else "single",
+                    "quantity": quantity,
+                    "date": app_date,
+                    "forwarder_id": rng.choices(
+                        forwarders, weights=self.forwarder_weights
+                    )[0],
+                    "paid_telegram": rng.random() < 0.3,
+                    "departure": departure,
+                    "departure_code": departure_code,
+                    "destination": destination,
+                    "destination_code": destination_code,
+                    "cargo": cargo,
+                    "hs_code": hs_code,
+                    "etcng": etcng,
+                    "loading_type": loading_type,
+                    "weight": Decimal(rng.randint(10_000, 6_800_000)) / 100,
+                    "container_type": (
+                        rng.choice(CONTAINER_TYPES)
+                        if loading_type == "container"
+                        else ""
+                    ),
+                    "rolling_stock_1": rng.choice(ROLLING_STOCK_1),
+                    "rolling_stock_2": rng.choice(ROLLING_STOCK_2),
+                    "conditions_of_carriage": rng.choice(CONDITIONS),
+                    "agreed_rate": Decimal(rng.randint(30_000, 450_000)) / 100,
+                    "add_charges": Decimal(
+                        rng.choice([0, 0, 0, rng.randint(1_000, 50_000)])
+                    )
+                    / 100,
+                    "containers_or_wagons": "",
+                    "manager_id": rng.choice(managers) if managers else None,
+                }
+            )
+            links.extend(
+                {"application_id": application_id, "territory_id": territory_id}
+                for territory_id in app_territories
+            )
+
+            settled = self.today - app_date > SETTLED_AFTER
+            statuses, weights = SETTLED_STATUSES if settled else OPEN_STATUSES
+            fill = 1.0 if settled and rng.random() < 0.9 else rng.random()
+            # COPY bypasses the counter signals, so fill the counters in directly
+            counters = applications[-1]
+            counters["territories_count"] = len(app_territories)
+            for territory_id in app_territories:
+                for _ in range(round(quantity * fill)):
+                    number = self.next_code[territory_id]
+                    self.next_code[territory_id] += 1
+                    status = rng.choices(statuses, weights=weights)[0]
+                    counters["codes_count"] = counters.get("codes_count", 0) + 1
+                    status_field = PaymentCode.STATUS_COUNTER_FIELDS[status]
+                    counters[status_field] = counters.get(status_field, 0) + 1
+                    codes.append(
+                        {
+                            "created": stamp,
+                            "modified": stamp,
+                            "code_status": status,
+                            "application_id": application_id,
+                            "number": str(number).zfill(8),
+                            "territory_id": territory_id,
+                            "date": app_date,
+                            "rate": applications[-1]["agreed_rate"],
+                        }
+                    )
+
+        application_writer.write(applications)
+        through_writer.write(links)
+        code_ids = code_writer.reserve_ids(len(codes))
+        for code, code_id in zip(codes, code_ids):
+            code["id"] = code_id
+        code_writer.write(codes)
+        return len(codes)
@@ -0,0 +1,209 @@
+# Generated by Django 5.0 on 2026-10-19 06:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    initial = True
+
+    dependencies = []
+
+    operations = [
+        migrations.CreateModel(
+            name="Application",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("created", models.DateTimeField(auto_now_add=True)),
+                ("modified", models.DateTimeField(auto_now=True)),
+                ("number", models.CharField(blank=True, max_length=100, unique=True)),
+                (
+                    "request_file",
+                    models.FileField(
+                        blank=True,
+                        null=True,
+                        upload_to="interrail_russian/applications/",
+                    ),
+                ),
+                (
+                    "sending_type",
+                    models.CharField(
+                        blank=True,
+                        choices=[("single", "Одиночный"), ("block_train", "КП")],
+                        max_length=100,
+                    ),
+                ),
+                ("quantity", models.IntegerField(default=1)),
+                ("date", models.DateField(blank=True, null=True)),
+                ("paid_telegram", models.BooleanField(default=False)),
+                ("departure", models.TextField(blank=True)),
+                ("departure_code", models.TextField(blank=True)),
+                ("destination", models.TextField(blank=True)),
+                ("destination_code", models.TextField(blank=True)),
+                ("cargo", models.TextField(blank=True)),
+                ("hs_code", models.TextField(blank=True)),
+                ("etcng", models.TextField(blank=True)),
+                (
+                    "loading_type",
+                    models.CharField(
+                        choices=[("wagon", "Wagon"), ("container", "Container")],
+                        default="wagon",
+                        max_length=100,
+                    ),
+                ),
+                (
+                    "weight",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=10),
+                ),
+                (
+                    "container_type",
+                    models.CharField(
+                        blank=True,
+                        choices=[
+                            ("20", "20"),
+                            ("20HC", "20HC"),
+                            ("40", "40"),
+                            ("40HC", "40HC"),
+                            ("45", "45"),
+                        ],
+                        default="",
+                        max_length=255,
+                    ),
+                ),
+                ("rolling_stock_1", models.TextField(blank=True)),
+                ("rolling_stock_2", models.TextField(blank=True)),
+                ("conditions_of_carriage", models.TextField(blank=True)),
+                (
+                    "agreed_rate",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=10),
+                ),
+                (
+                    "add_charges",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=10),
+                ),
+                ("border_crossing", models.TextField(blank=True)),
+                ("containers_or_wagons", models.TextField(default="")),
+                ("period", models.TextField(blank=True)),
+                ("shipper", models.TextField(blank=True)),
+                ("consignee", models.TextField(blank=True)),
+                ("departure_country", models.TextField(blank=True)),
+                ("destination_country", models.TextField(blank=True)),
+                ("comment", models.TextField(blank=True)),
+            ],
+            options={
+                "verbose_name": "Application",
+                "verbose_name_plural": "Applications",
+                "db_table": "application",
+                "ordering": ["-id"],
+            },
+        ),
+        migrations.CreateModel(
+            name="Counterparty",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=255, unique=True)),
+            ],
+            options={
+                "verbose_name": "Counterparty",
+                "verbose_name_plural": "Counterparties",
+                "db_table": "counterparty",
+            },
+        ),
+        migrations.CreateModel(
+            name="PaymentCode",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("created", models.DateTimeField(auto_now_add=True)),
+                ("modified", models.DateTimeField(auto_now=True)),
+                (
+                    "code_status",
+                    models.CharField(
+                        choices=[
+                            ("Checking", "Checking"),
+                            ("Used", "Used"),
+                            ("Canceled", "Canceled"),
+                            ("Completed", "Completed"),
+                        ],
+                        default="Checking",
+                        max_length=50,
+                    ),
+                ),
+                ("number", models.CharField(blank=True, max_length=20)),
+                ("date", models.DateField(blank=True, null=True)),
+                ("smgs_code", models.CharField(blank=True, max_length=20)),
+                ("smgs_date", models.DateField(blank=True, null=True)),
+                ("weight", models.CharField(blank=True, default="", max_length=100)),
+                (
+                    "wagon_number",
+                    models.CharField(blank=True, default="", max_length=100),
+                ),
+                (
+                    "container_number",
+                    models.CharField(blank=True, default="", max_length=100),
+                ),
+                (
+                    "rate",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=10),
+                ),
+                (
+                    "add_charges",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=10),
+                ),
+                (
+                    "smgs_file",
+                    models.FileField(
+                        blank=True, null=True, upload_to="applications/smgs_file/"
+                    ),
+                ),
+                ("comment", models.TextField(blank=True, default="")),
+            ],
+            options={
+                "verbose_name": "PaymentCode",
+                "verbose_name_plural": "PaymentCodes",
+                "db_table": "payment_code",
+            },
+        ),
+        migrations.CreateModel(
+            name="Territory",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=100, unique=True)),
+            ],
+            options={
+                "verbose_name": "Territory",
+                "verbose_name_plural": "Territories",
+                "db_table": "territory",
+            },
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 5.0 on 2026-10-19 06:57
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    initial = True
+
+    dependencies = [
+        ("payment_codes", "0001_initial"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="application",
+            name="manager",
+            field=models.ForeignKey(
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="applications",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.AddField(
+            model_name="application",
+            name="forwarder",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="ru_applications",
+                to="payment_codes.counterparty",
+            ),
+        ),
+        migrations.AddField(
+            model_name="paymentcode",
+            name="application",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="codes",
+                to="payment_codes.application",
+            ),
+        ),
+        migrations.AddField(
+            model_name="paymentcode",
+            name="territory",
+            field=models.ForeignKey(
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="codes",
+                to="payment_codes.territory",
+            ),
+        ),
+        migrations.AddField(
+            model_name="application",
+            name="territories",
+            field=models.ManyToManyField(
+                related_name="ru_applications", to="payment_codes.territory"
+            ),
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 5.0 on 2026-10-19 06:57
+
+import django.contrib.postgres.indexes
+from django.conf import settings
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction. Building the
+    # indexes concurrently keeps payment_code and application writable meanwhile.
+    atomic = False
+
+    dependencies = [
+        ("payment_codes", "0002_initial"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="application",
+            index=models.Index(fields=["date"], name="application_date_idx"),
+        ),
+        AddIndexConcurrently(
+            model_name="application",
+            index=models.Index(
+                fields=["sending_type", "date"], name="application_sending_date_idx"
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="paymentcode",
+            index=models.Index(
+                fields=["application", "territory"], name="payment_code_app_terr_idx"
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="paymentcode",
+            index=models.Index(
+                fields=["territory", "number"], name="payment_code_terr_num_idx"
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="paymentcode",
+            index=models.Index(
+                condition=models.Q(("code_status__in", ["Checking", "Used"])),
+                fields=["code_status", "territory"],
+                name="payment_code_active_idx",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="paymentcode",
+            index=models.Index(
+                condition=models.Q(("container_number", ""), _negated=True),
+                fields=["container_number"],
+                name="payment_code_container_idx",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="paymentcode",
+            index=django.contrib.postgres.indexes.BrinIndex(
+                fields=["created"], name="payment_code_created_brin"
+            ),
+        ),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 5.0 on 2026-10-19 06:59
+
+from django.db import migrations, models
+
+BACKFILL_COUNTERS = """
+UPDATE application
+SET territories_count = links.count
+FROM (
+    SELECT application_id, COUNT(*) AS count
+    FROM application_territories
+    GROUP BY application_id
+) AS links
+WHERE links.application_id = application.id;
+
+UPDATE application
+SET codes_count = codes.total,
+    checking_codes_count = codes.checking,
+    used_codes_count = codes.used,
+    canceled_codes_count = codes.canceled,
+    completed_codes_count = codes.completed
+FROM (
+    SELECT application_id,
+           COUNT(*) AS total,
+           COUNT(*) FILTER (WHERE code_status = 'Checking') AS checking,
+           COUNT(*) FILTER (WHERE code_status = 'Used') AS used,
+           COUNT(*) FILTER (WHERE code_status = 'Canceled') AS canceled,
+           COUNT(*) FILTER (WHERE code_status = 'Completed') AS completed
+    FROM payment_code
+    GROUP BY application_id
+) AS codes
+WHERE codes.application_id = application.id;
+"""
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("payment_codes", "0003_hot_column_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="application",
+            name="canceled_codes_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="application",
+            name="checking_codes_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="application",
+            name="codes_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="application",
+            name="completed_codes_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="application",
+            name="territories_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="application",
+            name="used_codes_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunSQL(BACKFILL_COUNTERS, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,120 @@
+# Generated by Django 5.0 on 2026-10-19 07:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+CREATE_SUMMARIES = """
+CREATE MATERIALIZED VIEW stats_territory_codes AS
+SELECT row_number() OVER (ORDER BY territory_id, code_status) AS id,
+       territory_id,
+       code_status,
+       COUNT(*) AS codes
+FROM payment_code
+GROUP BY territory_id, code_status;
+
+CREATE UNIQUE INDEX stats_territory_codes_key
+    ON stats_territory_codes (territory_id, code_status);
+
+CREATE MATERIALIZED VIEW stats_forwarder_month AS
+SELECT row_number() OVER (ORDER BY forwarder_id, date_trunc('month', date)) AS id,
+       forwarder_id,
+       date_trunc('month', date)::date AS month,
+       COUNT(*) AS applications,
+       SUM(agreed_rate) AS agreed_rate,
+       SUM(add_charges) AS add_charges
+FROM application
+WHERE date IS NOT NULL
+GROUP BY forwarder_id, date_trunc('month', date);
+
+CREATE UNIQUE INDEX stats_forwarder_month_key
+    ON stats_forwarder_month (forwarder_id, month);
+CREATE INDEX stats_forwarder_month_month_idx
+    ON stats_forwarder_month (month);
+"""
+
+DROP_SUMMARIES = """
+DROP MATERIALIZED VIEW IF EXISTS stats_forwarder_month;
+DROP MATERIALIZED VIEW IF EXISTS stats_territory_codes;
+"""
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("payment_codes", "0004_application_counters"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SummaryRefresh",
+            fields=[
+                (
+                    "name",
+                    models.CharField(max_length=100, primary_key=True, serialize=False),
+                ),
+                ("refreshed_at", models.DateTimeField()),
+            ],
+            options={
+                "db_table": "stats_refresh",
+            },
+        ),
+        migrations.RunSQL(CREATE_SUMMARIES, DROP_SUMMARIES),
+        migrations.CreateModel(
+            name="ForwarderMonthSummary",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "forwarder",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        related_name="+",
+                        to="payment_codes.counterparty",
+                    ),
+                ),
+                ("month", models.DateField()),
+                ("applications", models.PositiveIntegerField()),
+                ("agreed_rate", models.DecimalField(decimal_places=2, max_digits=16)),
+                ("add_charges", models.DecimalField(decimal_places=2, max_digits=16)),
+            ],
+            options={
+                "db_table": "stats_forwarder_month",
+                "managed": False,
+            },
+        ),
+        migrations.CreateModel(
+            name="TerritoryCodeSummary",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "territory",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        related_name="+",
+                        to="payment_codes.territory",
+                    ),
+                ),
+                ("code_status", models.CharField(max_length=50)),
+                ("codes", models.PositiveIntegerField()),
+            ],
+            options={
+                "db_table": "stats_territory_codes",
+                "managed": False,
+            },
+        ),
+    ]
@@ -0,0 +1,157 @@
+# Generated by Django 5.0 on 2026-10-19 07:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+CREATE_ARCHIVE = """
+CREATE TABLE payment_code_archive (
+    id bigint NOT NULL,
+    created timestamp with time zone NOT NULL,
+    modified timestamp with time zone NOT NULL,
+    code_status varchar(50) NOT NULL,
+    number varchar(20) NOT NULL,
+    date date NULL,
+    smgs_code varchar(20) NOT NULL,
+    smgs_date date NULL,
+    weight varchar(100) NOT NULL,
+    wagon_number varchar(100) NOT NULL,
+    container_number varchar(100) NOT NULL,
+    rate numeric(10, 2) NOT NULL,
+    add_charges numeric(10, 2) NOT NULL,
+    smgs_file varchar(100) NULL,
+    comment text NOT NULL,
+    application_id bigint NOT NULL,
+    territory_id bigint NULL,
+    archived_at timestamp with time zone NOT NULL,
+    PRIMARY KEY (id, created)
+) PARTITION BY RANGE (created);
+
+CREATE INDEX payment_code_archive_application_idx
+    ON payment_code_archive (application_id);
+CREATE INDEX payment_code_archive_territory_idx
+    ON payment_code_archive (territory_id);
+
+-- Archived codes keep counting in the dashboard totals
+DROP MATERIALIZED VIEW stats_territory_codes;
+CREATE MATERIALIZED VIEW stats_territory_codes AS
+SELECT row_number() OVER (ORDER BY territory_id, code_status) AS id,
+       territory_id,
+       code_status,
+       SUM(codes) AS codes
+FROM (
+    SELECT territory_id, code_status, COUNT(*) AS codes
+    FROM payment_code
+    GROUP BY territory_id, code_status
+    UNION ALL
+    SELECT territory_id, code_status, COUNT(*) AS codes
+    FROM payment_code_archive
+    GROUP BY territory_id, code_status
+) AS codes
+GROUP BY territory_id, code_status;
+CREATE UNIQUE INDEX stats_territory_codes_key
+    ON stats_territory_codes (territory_id, code_status);
+
+-- Archiving deletes in batches, vacuum the hot table before dead rows pile up
+ALTER TABLE payment_code SET (
+    autovacuum_vacuum_scale_factor = 0.02,
+    autovacuum_analyze_scale_factor = 0.02
+);
+"""
+
+DROP_ARCHIVE = """
+ALTER TABLE payment_code RESET (
+    autovacuum_vacuum_scale_factor,
+    autovacuum_analyze_scale_factor
+);
+
+DROP MATERIALIZED VIEW stats_territory_codes;
+CREATE MATERIALIZED VIEW stats_territory_codes AS
+SELECT row_number() OVER (ORDER BY territory_id, code_status) AS id,
+       territory_id,
+       code_status,
+       COUNT(*) AS codes
+FROM payment_code
+GROUP BY territory_id, code_status;
+CREATE UNIQUE INDEX stats_territory_codes_key
+    ON stats_territory_codes (territory_id, code_status);
+
+DROP TABLE payment_code_archive;
+"""
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("payment_codes", "0005_dashboard_summaries"),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_ARCHIVE, DROP_ARCHIVE),
+        migrations.CreateModel(
+            name="ArchivedPaymentCode",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("created", models.DateTimeField(auto_now_add=True)),
+                ("modified", models.DateTimeField(auto_now=True)),
+                (
+                    "code_status",
+                    models.CharField(
+                        choices=[
+                            ("Checking", "Checking"),
+                            ("Used", "Used"),
+                            ("Canceled", "Canceled"),
+                            ("Completed", "Completed"),
+                        ],
+                        max_length=50,
+                    ),
+                ),
+                ("number", models.CharField(blank=True, max_length=20)),
+                ("date", models.DateField(blank=True, null=True)),
+                ("smgs_code", models.CharField(blank=True, max_length=20)),
+                ("smgs_date", models.DateField(blank=True, null=True)),
+                ("weight", models.CharField(blank=True, max_length=100)),
+                ("wagon_number", models.CharField(blank=True, max_length=100)),
+                ("container_number", models.CharField(blank=True, max_length=100)),
+                ("rate", models.DecimalField(decimal_places=2, max_digits=10)),
+                ("add_charges", models.DecimalField(decimal_places=2, max_digits=10)),
+                (
+                    "smgs_file",
+                    models.FileField(
+                        blank=True, null=True, upload_to="applications/smgs_file/"
+                    ),
+                ),
+                ("comment", models.TextField(blank=True)),
+                ("archived_at", models.DateTimeField()),
+                (
+                    "application",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="archived_codes",
+                        to="payment_codes.application",
+                    ),
+                ),
+                (
+                    "territory",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="archived_codes",
+                        to="payment_codes.territory",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Archived PaymentCode",
+                "verbose_name_plural": "Archived PaymentCodes",
+                "db_table": "payment_code_archive",
+                "managed": False,
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.1.4 on 2026-10-19 07:32
+
+from django.conf import settings
+from django.core.management import call_command
+from django.db import migrations, models
+
+
+def create_cache_table(apps, schema_editor):
+    # The shared cache holding the converter circuit breaker state
+    call_command("createcachetable", database=schema_editor.connection.alias)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("payment_codes", "0008_idempotency_key"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="application",
+            name="document_pending",
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name="application",
+            index=models.Index(
+                condition=models.Q(("document_pending", True)),
+                fields=["id"],
+                name="application_doc_pending_idx",
+            ),
+        ),
+        migrations.RunPython(create_cache_table, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.1.4 on 2026-10-19 07:40
+
+from django.db import migrations
+
+CREATE_SEQUENCE = """
+CREATE SEQUENCE application_number_seq;
+"""
+
+DROP_SEQUENCE = """
+DROP SEQUENCE IF EXISTS application_number_seq;
+"""
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("payment_codes", "0009_application_document_pending"),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_SEQUENCE, DROP_SEQUENCE),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.1.4 on 2026-10-19 07:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Start every territory after the highest numeric code it already has
+BACKFILL_COUNTERS = """
+INSERT INTO territory_code_counter (territory_id, next_number)
+SELECT territory.id, COALESCE(MAX(codes.number::bigint), 0) + 1
+FROM territory
+LEFT JOIN (
+    SELECT territory_id, number FROM payment_code
+    UNION ALL
+    SELECT territory_id, number FROM payment_code_archive
+) AS codes
+    ON codes.territory_id = territory.id AND codes.number ~ '^[0-9]{1,18}$'
+GROUP BY territory.id;
+"""
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("payment_codes", "0010_application_number_seq"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TerritoryCodeCounter",
+            fields=[
+                (
+                    "territory",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="code_counter",
+                        serialize=False,
+                        to="payment_codes.territory",
+                    ),
+                ),
+                ("next_number", models.BigIntegerField(default=1)),
+            ],
+            options={
+                "db_table": "territory_code_counter",
+            },
+        ),
+        migrations.RunSQL(BACKFILL_COUNTERS, migrations.RunSQL.noop),
+    ]
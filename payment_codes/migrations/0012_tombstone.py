@@ -0,0 +1,78 @@
+# Generated by Django 5.1.4 on 2026-10-19 07:44
+
+from django.conf import settings
+from django.db import migrations, models
+
+# One INSERT per DELETE statement, however many rows it removed
+CREATE_TRIGGERS = """
+CREATE FUNCTION record_tombstones() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    INSERT INTO change_tombstone (kind, object_id, deleted)
+    SELECT TG_ARGV[0], id, statement_timestamp() FROM deleted_rows;
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER application_tombstones
+    AFTER DELETE ON application
+    REFERENCING OLD TABLE AS deleted_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION record_tombstones('application');
+
+CREATE TRIGGER payment_code_tombstones
+    AFTER DELETE ON payment_code
+    REFERENCING OLD TABLE AS deleted_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION record_tombstones('payment_code');
+"""
+
+DROP_TRIGGERS = """
+DROP TRIGGER IF EXISTS payment_code_tombstones ON payment_code;
+DROP TRIGGER IF EXISTS application_tombstones ON application;
+DROP FUNCTION IF EXISTS record_tombstones();
+"""
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("payment_codes", "0011_territory_code_counter"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Tombstone",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "kind",
+                    models.CharField(
+                        choices=[
+                            ("application", "Application"),
+                            ("payment_code", "Payment code"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                ("object_id", models.BigIntegerField()),
+                ("deleted", models.DateTimeField()),
+            ],
+            options={
+                "db_table": "change_tombstone",
+            },
+        ),
+        migrations.AddIndex(
+            model_name="tombstone",
+            index=models.Index(
+                fields=["kind", "deleted", "object_id"],
+                name="change_tombstone_feed_idx",
+            ),
+        ),
+        migrations.RunSQL(CREATE_TRIGGERS, DROP_TRIGGERS),
+    ]
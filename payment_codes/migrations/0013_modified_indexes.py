@@ -0,0 +1,29 @@
+# Generated by Django 5.1.4 on 2026-10-19 07:44
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction, and both tables
+    # must stay writable while the indexes are built
+    atomic = False
+
+    dependencies = [
+        ("payment_codes", "0012_tombstone"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="application",
+            index=models.Index(
+                fields=["modified", "id"], name="application_modified_idx"
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="paymentcode",
+            index=models.Index(
+                fields=["modified", "id"], name="payment_code_modified_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,71 @@
+# Generated by Django 5.1.4 on 2026-10-19 08:11
+
+import django.db.models.constraints
+from django.conf import settings
+from django.db import migrations, models
+
+# The index of the deferrable constraint is built next to the current one,
+# which then hands over to it in a single ALTER TABLE. One statement each,
+# CONCURRENTLY is refused in a multi-statement query. An index left INVALID by
+# an interrupted build is dropped and built again.
+MAKE_DEFERRABLE = [
+    "DROP INDEX CONCURRENTLY IF EXISTS application_number_deferrable;",
+    "CREATE UNIQUE INDEX CONCURRENTLY application_number_deferrable ON application (number);",
+    """
+    ALTER TABLE application
+        DROP CONSTRAINT application_number_key,
+        ADD CONSTRAINT application_number_key UNIQUE
+            USING INDEX application_number_deferrable DEFERRABLE INITIALLY IMMEDIATE;
+    """,
+    # Nothing filters numbers by prefix
+    "DROP INDEX CONCURRENTLY IF EXISTS application_number_138a18de_like;",
+]
+
+MAKE_IMMEDIATE = [
+    "DROP INDEX CONCURRENTLY IF EXISTS application_number_immediate;",
+    "CREATE UNIQUE INDEX CONCURRENTLY application_number_immediate ON application (number);",
+    """
+    ALTER TABLE application
+        DROP CONSTRAINT application_number_key,
+        ADD CONSTRAINT application_number_key UNIQUE
+            USING INDEX application_number_immediate;
+    """,
+    """
+    CREATE INDEX CONCURRENTLY IF NOT EXISTS application_number_138a18de_like
+        ON application (number varchar_pattern_ops);
+    """,
+]
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction, and
+    # applications must stay writable while the index is built
+    atomic = False
+
+    dependencies = [
+        ("payment_codes", "0013_modified_indexes"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(MAKE_DEFERRABLE, MAKE_IMMEDIATE),
+            ],
+            state_operations=[
+                migrations.AlterField(
+                    model_name="application",
+                    name="number",
+                    field=models.CharField(blank=True, max_length=100),
+                ),
+                migrations.AddConstraint(
+                    model_name="application",
+                    constraint=models.UniqueConstraint(
+                        deferrable=django.db.models.constraints.Deferrable["IMMEDIATE"],
+                        fields=("number",),
+                        name="application_number_key",
+                    ),
+                ),
+            ],
+        ),
+    ]
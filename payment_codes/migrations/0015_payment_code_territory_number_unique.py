@@ -0,0 +1,76 @@
+# Generated by Django 5.1.4 on 2026-10-19 08:15
+
+from django.contrib.postgres.operations import RemoveIndexConcurrently
+from django.db import migrations, models
+
+FIND_DUPLICATES = """
+SELECT territory_id, number, COUNT(*)
+FROM payment_code
+WHERE number <> ''
+GROUP BY territory_id, number
+HAVING COUNT(*) > 1
+ORDER BY territory_id, number
+LIMIT 20
+"""
+
+# One statement each, CONCURRENTLY is refused in a multi-statement query. An
+# index left INVALID by an interrupted build is dropped and built again.
+CREATE_UNIQUE_INDEX = [
+    "DROP INDEX CONCURRENTLY IF EXISTS payment_code_terr_num_uniq;",
+    """
+    CREATE UNIQUE INDEX CONCURRENTLY payment_code_terr_num_uniq
+        ON payment_code (territory_id, number) WHERE NOT (number = '');
+    """,
+]
+
+DROP_UNIQUE_INDEX = ["DROP INDEX CONCURRENTLY IF EXISTS payment_code_terr_num_uniq;"]
+
+
+def check_duplicate_numbers(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(FIND_DUPLICATES)
+        duplicates = cursor.fetchall()
+    if duplicates:
+        listed = ", ".join(
+            f"territory {territory_id} number {number!r} ({count} codes)"
+            for territory_id, number, count in duplicates
+        )
+        raise RuntimeError(
+            "Payment codes share a number within a territory, renumber them "
+            f"before migrating: {listed}"
+        )
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction, and codes must
+    # stay writable while the index is built
+    atomic = False
+
+    dependencies = [
+        ("payment_codes", "0014_application_number_deferrable"),
+    ]
+
+    operations = [
+        migrations.RunPython(check_duplicate_numbers, migrations.RunPython.noop),
+        # The unique index replaces the plain one, built first so lookups by
+        # territory and number stay indexed in between
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(CREATE_UNIQUE_INDEX, DROP_UNIQUE_INDEX),
+            ],
+            state_operations=[
+                migrations.AddConstraint(
+                    model_name="paymentcode",
+                    constraint=models.UniqueConstraint(
+                        condition=models.Q(("number", ""), _negated=True),
+                        fields=("territory", "number"),
+                        name="payment_code_terr_num_uniq",
+                    ),
+                ),
+            ],
+        ),
+        RemoveIndexConcurrently(
+            model_name="paymentcode",
+            name="payment_code_terr_num_idx",
+        ),
+    ]
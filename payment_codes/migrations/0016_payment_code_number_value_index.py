@@ -0,0 +1,26 @@
+# Generated by Django 5.1.4 on 2026-10-19 08:33
+
+import payment_codes.models
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction, and codes must
+    # stay writable while the index is built
+    atomic = False
+
+    dependencies = [
+        ("payment_codes", "0015_payment_code_territory_number_unique"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="paymentcode",
+            index=models.Index(
+                models.F("territory"),
+                payment_codes.models.NumberValue("number"),
+                name="payment_code_terr_value_idx",
+            ),
+        ),
+    ]
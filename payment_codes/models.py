@@ -1,5 +1,9 @@
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import BrinIndex
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 
+from payment_codes.numbering import next_application_number
 from users.models import CustomUser
 
 
@@ -56,11 +60,14 @@ class Application(TimeStampedModel):
     number: models.CharField = models.CharField(
         max_length=100,
         blank=True,
-        unique=True,
     )
     request_file: models.FileField = models.FileField(
         upload_to="interrail_russian/applications/", blank=True, null=True
     )
+    # Saved while the PDF converter was unavailable, the document is generated later
+    document_pending: models.BooleanField = models.BooleanField(
+        default=False, editable=False
+    )
     sending_type: models.CharField = models.CharField(
         max_length=100, blank=True, choices=SENDING_TYPE_CHOICES
     )
@@ -109,16 +116,98 @@ class Application(TimeStampedModel):
         CustomUser, related_name="applications", on_delete=models.SET_NULL, null=True
     )
     comment: models.TextField = models.TextField(blank=True)
+    # Denormalized counters, kept in sync by payment_codes.counters
+    territories_count: models.PositiveIntegerField = models.PositiveIntegerField(
+        default=0, editable=False
+    )
+    codes_count: models.PositiveIntegerField = models.PositiveIntegerField(
+        default=0, editable=False
+    )
+    checking_codes_count: models.PositiveIntegerField = models.PositiveIntegerField(
+        default=0, editable=False
+    )
+    used_codes_count: models.PositiveIntegerField = models.PositiveIntegerField(
+        default=0, editable=False
+    )
+    canceled_codes_count: models.PositiveIntegerField = models.PositiveIntegerField(
+        default=0, editable=False
+    )
+    completed_codes_count: models.PositiveIntegerField = models.PositiveIntegerField(
+        default=0, editable=False
+    )
+
+    COUNTER_FIELDS = (
+        "territories_count",
+        "codes_count",
+        "checking_codes_count",
+        "used_codes_count",
+        "canceled_codes_count",
+        "completed_codes_count",
+    )
 
     class Meta:
         ordering = ["-id"]
         verbose_name = "Application"
         verbose_name_plural = "Applications"
         db_table = "application"
+        constraints = [
+            # Deferrable so uniqueness is checked at the end of each statement,
+            # which lets a batch update swap the numbers of two applications
+            models.UniqueConstraint(
+                fields=["number"],
+                name="application_number_key",
+                deferrable=models.Deferrable.IMMEDIATE,
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["date"], name="application_date_idx"),
+            # sending_type alone has two values, only useful together with date
+            models.Index(
+                fields=["sending_type", "date"], name="application_sending_date_idx"
+            ),
+            models.Index(
+                fields=["id"],
+                condition=models.Q(document_pending=True),
+                name="application_doc_pending_idx",
+            ),
+            # Keyset order of the change feed
+            models.Index(fields=["modified", "id"], name="application_modified_idx"),
+        ]
 
     def __str__(self) -> str:
         return self.number
 
+    def save(self, *args, **kwargs):
+        if self._state.adding and not self.number:
+            self.number = next_application_number()
+        # Counters only change through atomic UPDATEs, saving a loaded instance
+        # must not write back a stale copy of them
+        if not self._state.adding and kwargs.get("update_fields") is None:
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.COUNTER_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
+    @property
+    def allowed_codes(self) -> int:
+        return self.territories_count * self.quantity
+
+
+class NumberValue(models.Func):
+    """
+    The numeric value of a payment code number, NULL when it is not all digits.
+
+    The pattern is part of the template rather than a parameter, so queries
+    spell the expression exactly like the index built on it.
+    """
+
+    template = (
+        "CASE WHEN %(expressions)s ~ '^[0-9]{1,18}$' THEN (%(expressions)s)::bigint END"
+    )
+    output_field = models.BigIntegerField()
+
 
 class PaymentCode(TimeStampedModel):
     CHECKING = "Checking"
@@ -131,6 +220,12 @@ class PaymentCode(TimeStampedModel):
         ("Canceled", "Canceled"),
         ("Completed", "Completed"),
     )
+    STATUS_COUNTER_FIELDS = {
+        CHECKING: "checking_codes_count",
+        USED: "used_codes_count",
+        CANCELED: "canceled_codes_count",
+        COMPLETED: "completed_codes_count",
+    }
 
     code_status: models.CharField = models.CharField(
         choices=CODE_STATUS_CHOICES, default=CODE_STATUS_CHOICES[0][0], max_length=50
@@ -167,6 +262,292 @@ class PaymentCode(TimeStampedModel):
         verbose_name = "PaymentCode"
         verbose_name_plural = "PaymentCodes"
         db_table = "payment_code"
+        constraints = [
+            # Also the index of lookups by territory and number
+            models.UniqueConstraint(
+                fields=["territory", "number"],
+                condition=~models.Q(number=""),
+                name="payment_code_terr_num_uniq",
+            ),
+        ]
+        indexes = [
+            # Overlap checks of explicit ranges compare numbers by value
+            models.Index(
+                "territory", NumberValue("number"), name="payment_code_terr_value_idx"
+            ),
+            models.Index(
+                fields=["application", "territory"], name="payment_code_app_terr_idx"
+            ),
+            # Closed-out codes are the bulk of the table and are rarely filtered on
+            models.Index(
+                fields=["code_status", "territory"],
+                condition=models.Q(code_status__in=["Checking", "Used"]),
+                name="payment_code_active_idx",
+            ),
+            models.Index(
+                fields=["container_number"],
+                condition=~models.Q(container_number=""),
+                name="payment_code_container_idx",
+            ),
+            # Rows are appended in created order, so a BRIN index stays tiny
+            BrinIndex(fields=["created"], name="payment_code_created_brin"),
+            # Keyset order of the change feed
+            models.Index(fields=["modified", "id"], name="payment_code_modified_idx"),
+        ]
+
+    def __str__(self) -> str:
+        return self.number
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember what the counters were built from, see payment_codes.signals
+        instance._counted_as = (
+            instance.__dict__.get("application_id"),
+            instance.__dict__.get("code_status"),
+        )
+        return instance
+
+
+class ArchivedPaymentCode(TimeStampedModel):
+    """
+    Closed-out payment codes moved out of ``payment_code`` by
+    ``manage.py archive_codes``.
+
+    The table is range-partitioned by ``created`` into yearly partitions and
+    its primary key is ``(id, created)``. Archived codes still count towards
+    the counters on their application.
+    """
+
+    code_status: models.CharField = models.CharField(
+        choices=PaymentCode.CODE_STATUS_CHOICES, max_length=50
+    )
+    application: models.ForeignKey = models.ForeignKey(
+        Application, on_delete=models.CASCADE, related_name="archived_codes"
+    )
+    number: models.CharField = models.CharField(max_length=20, blank=True)
+    territory: models.ForeignKey = models.ForeignKey(
+        Territory, related_name="archived_codes", on_delete=models.SET_NULL, null=True
+    )
+    date: models.DateField = models.DateField(blank=True, null=True)
+    smgs_code: models.CharField = models.CharField(max_length=20, blank=True)
+    smgs_date: models.DateField = models.DateField(blank=True, null=True)
+    weight: models.CharField = models.CharField(max_length=100, blank=True)
+    wagon_number: models.CharField = models.CharField(max_length=100, blank=True)
+    container_number: models.CharField = models.CharField(max_length=100, blank=True)
+    rate: models.DecimalField = models.DecimalField(max_digits=10, decimal_places=2)
+    add_charges: models.DecimalField = models.DecimalField(
+        max_digits=10, decimal_places=2
+    )
+    smgs_file: models.FileField = models.FileField(
+        upload_to="applications/smgs_file/", blank=True, null=True
+    )
+    comment: models.TextField = models.TextField(blank=True)
+    archived_at: models.DateTimeField = models.DateTimeField()
+
+    class Meta:
+        managed = False
+        db_table = "payment_code_archive"
+        verbose_name = "Archived PaymentCode"
+        verbose_name_plural = "Archived PaymentCodes"
 
     def __str__(self) -> str:
         return self.number
+
+
+class TerritoryCodeSummary(models.Model):
+    """
+    Payment codes per territory and status, read from a materialized view.
+    """
+
+    territory: models.ForeignKey = models.ForeignKey(
+        Territory, on_delete=models.DO_NOTHING, null=True, related_name="+"
+    )
+    code_status: models.CharField = models.CharField(max_length=50)
+    codes: models.PositiveIntegerField = models.PositiveIntegerField()
+
+    class Meta:
+        managed = False
+        db_table = "stats_territory_codes"
+
+
+class ForwarderMonthSummary(models.Model):
+    """
+    Applications and agreed amounts per forwarder and month, read from a
+    materialized view.
+    """
+
+    forwarder: models.ForeignKey = models.ForeignKey(
+        Counterparty, on_delete=models.DO_NOTHING, related_name="+"
+    )
+    month: models.DateField = models.DateField()
+    applications: models.PositiveIntegerField = models.PositiveIntegerField()
+    agreed_rate: models.DecimalField = models.DecimalField(
+        max_digits=16, decimal_places=2
+    )
+    add_charges: models.DecimalField = models.DecimalField(
+        max_digits=16, decimal_places=2
+    )
+
+    class Meta:
+        managed = False
+        db_table = "stats_forwarder_month"
+
+
+class SummaryRefresh(models.Model):
+    name: models.CharField = models.CharField(max_length=100, primary_key=True)
+    refreshed_at: models.DateTimeField = models.DateTimeField()
+
+    class Meta:
+        db_table = "stats_refresh"
+
+
+class BulkJob(TimeStampedModel):
+    """
+    A bulk admin action applied in the background, chunk by chunk.
+
+    The selected primary keys are snapshotted when the action starts and
+    ``processed`` counts how many of them have been handled, so an interrupted
+    job resumes where it stopped.
+    """
+
+    TRANSITION = "transition"
+    REASSIGN = "reassign"
+    DELETE = "delete"
+    REGENERATE = "regenerate"
+    KIND_CHOICES = (
+        (TRANSITION, "Change code status"),
+        (REASSIGN, "Reassign territory"),
+        (DELETE, "Delete codes"),
+        (REGENERATE, "Regenerate PDFs"),
+    )
+
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = (
+        (PENDING, "Pending"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    )
+
+    kind: models.CharField = models.CharField(max_length=20, choices=KIND_CHOICES)
+    params: models.JSONField = models.JSONField(default=dict, blank=True)
+    object_ids: ArrayField = ArrayField(models.BigIntegerField(), default=list)
+    total: models.PositiveIntegerField = models.PositiveIntegerField(default=0)
+    processed: models.PositiveIntegerField = models.PositiveIntegerField(default=0)
+    failed: models.PositiveIntegerField = models.PositiveIntegerField(default=0)
+    status: models.CharField = models.CharField(
+        max_length=20, choices=STATUS_CHOICES, default=PENDING
+    )
+    error: models.TextField = models.TextField(blank=True, default="")
+    created_by: models.ForeignKey = models.ForeignKey(
+        CustomUser, on_delete=models.SET_NULL, null=True, blank=True, related_name="+"
+    )
+    finished: models.DateTimeField = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        db_table = "bulk_job"
+        verbose_name = "Bulk job"
+        verbose_name_plural = "Bulk jobs"
+        indexes = [
+            models.Index(
+                fields=["status"],
+                condition=models.Q(status__in=["pending", "running"]),
+                name="bulk_job_unfinished_idx",
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.get_kind_display()} #{self.pk}"
+
+
+class IdempotencyKey(models.Model):
+    """
+    The outcome of a create request sent with an ``Idempotency-Key`` header,
+    replayed to retries of the same request until ``expires_at``.
+
+    The row is inserted before the request runs and committed together with its
+    result, so a concurrent duplicate blocks on the insert until the first one
+    finishes.
+    """
+
+    user: models.ForeignKey = models.ForeignKey(
+        CustomUser, on_delete=models.CASCADE, related_name="+"
+    )
+    key: models.CharField = models.CharField(max_length=255)
+    fingerprint: models.CharField = models.CharField(max_length=64)
+    status_code: models.PositiveSmallIntegerField = models.PositiveSmallIntegerField(
+        null=True
+    )
+    response: models.JSONField = models.JSONField(null=True, encoder=DjangoJSONEncoder)
+    created: models.DateTimeField = models.DateTimeField(auto_now_add=True)
+    expires_at: models.DateTimeField = models.DateTimeField(db_index=True)
+
+    class Meta:
+        db_table = "idempotency_key"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "key"], name="idempotency_key_user_key_uniq"
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return self.key
+
+
+class TerritoryCodeCounter(models.Model):
+    """
+    The next free payment code number of a territory. Blocks of numbers are
+    taken with one ``UPDATE ... RETURNING``, see payment_codes.code_ranges.
+    """
+
+    territory: models.OneToOneField = models.OneToOneField(
+        Territory,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="code_counter",
+    )
+    next_number: models.BigIntegerField = models.BigIntegerField(default=1)
+
+    class Meta:
+        db_table = "territory_code_counter"
+
+    def __str__(self) -> str:
+        return f"{self.territory_id}: {self.next_number}"
+
+
+class Tombstone(models.Model):
+    """
+    A deleted application or payment code, for the change feed to report.
+
+    Rows are inserted by statement-level ``AFTER DELETE`` triggers on
+    ``application`` and ``payment_code``, so every way of deleting is covered,
+    cascades and archiving included. ``manage.py purge_tombstones`` removes them
+    after CHANGE_FEED_RETENTION_DAYS.
+    """
+
+    APPLICATION = "application"
+    PAYMENT_CODE = "payment_code"
+    KIND_CHOICES = (
+        (APPLICATION, "Application"),
+        (PAYMENT_CODE, "Payment code"),
+    )
+
+    kind: models.CharField = models.CharField(max_length=20, choices=KIND_CHOICES)
+    object_id: models.BigIntegerField = models.BigIntegerField()
+    deleted: models.DateTimeField = models.DateTimeField()
+
+    class Meta:
+        db_table = "change_tombstone"
+        indexes = [
+            models.Index(
+                fields=["kind", "deleted", "object_id"],
+                name="change_tombstone_feed_idx",
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.kind} {self.object_id}"
@@ -0,0 +1,58 @@
+"""
+Server-side allocation of application numbers.
+
+Numbers come from the ``application_number_seq`` PostgreSQL sequence. nextval
+never blocks and is never rolled back, so concurrent creates cannot collide or
+wait on each other. Each worker process reserves APPLICATION_NUMBER_BLOCK values
+with one query and hands them out from memory, so most creates do not touch
+the sequence at all.
+
+Numbers are unique but not gapless: values reserved by a worker that exits are
+skipped, and numbers from different workers interleave rather than follow the
+order of creation.
+"""
+
+import threading
+from collections import deque
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+SEQUENCE = "application_number_seq"
+
+
+class NumberAllocator:
+    def __init__(self, sequence):
+        self.sequence = sequence
+        self.reserved = deque()
+        self.lock = threading.Lock()
+
+    def reserve(self, count):
+        """
+        Take ``count`` values from the sequence in one round trip.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT nextval(%s) FROM generate_series(1, %s)",
+                [self.sequence, count],
+            )
+            return [value for (value,) in cursor.fetchall()]
+
+    def next_value(self):
+        with self.lock:
+            if not self.reserved:
+                self.reserved.extend(self.reserve(settings.APPLICATION_NUMBER_BLOCK))
+            return self.reserved.popleft()
+
+
+application_numbers = NumberAllocator(SEQUENCE)
+
+
+def next_application_number():
+    """
+    Format the next sequence value with APPLICATION_NUMBER_FORMAT.
+    """
+    return settings.APPLICATION_NUMBER_FORMAT.format(
+        seq=application_numbers.next_value(), date=timezone.localdate()
+    )
@@ -1,9 +1,17 @@
+from django.conf import settings
 from rest_framework import serializers, generics
 from rest_framework.exceptions import ValidationError
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.permissions import IsAuthenticated
 
-from payment_codes.models import Territory, Counterparty, Application, PaymentCode
+from payment_codes.models import (
+    Territory,
+    Counterparty,
+    Application,
+    PaymentCode,
+    TerritoryCodeSummary,
+    ForwarderMonthSummary,
+)
 
 
 class TerritorySerializer(serializers.ModelSerializer):
@@ -23,13 +31,18 @@ class ApplicationSerializer(serializers.ModelSerializer):
         model = Application
         fields = "__all__"
         read_only_fields = ("created", "modified", "request_file", "id", "manager")
+        extra_kwargs = {
+            "number": {
+                "help_text": "Leave out to have the server assign the next number."
+            }
+        }
 
 
 class ApplicationListSerializer(serializers.ModelSerializer):
     class Meta:
         model = Application
-        fields = ["id"]
-        read_only_fields = ["id"]
+        fields = ["id", "quantity", "territories_count", "codes_count"]
+        read_only_fields = ["id", "quantity", "territories_count", "codes_count"]
 
 
 class PaymentCodeSerializer(serializers.ModelSerializer):
@@ -49,6 +62,54 @@ class ApplicationRetrieveSerializer(serializers.ModelSerializer):
         read_only_fields = ("created", "modified", "request_file", "id", "manager")
 
 
+class PreloadedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    Primary key field that resolves ids from ``context["preloaded"][model]`` when
+    the caller loaded them for a whole batch, instead of one query per value.
+    """
+
+    def to_internal_value(self, data):
+        preloaded = self.context.get("preloaded", {}).get(self.get_queryset().model)
+        if preloaded is None:
+            return super().to_internal_value(data)
+        if isinstance(data, bool):
+            self.fail("incorrect_type", data_type=type(data).__name__)
+        try:
+            return preloaded[int(data)]
+        except KeyError:
+            self.fail("does_not_exist", pk_value=data)
+        except (TypeError, ValueError):
+            self.fail("incorrect_type", data_type=type(data).__name__)
+
+
+class ApplicationBatchItemSerializer(ApplicationSerializer):
+    """
+    Changed fields of one application in a batch update, identified by ``id``.
+    """
+
+    id = serializers.IntegerField()
+    forwarder = PreloadedPrimaryKeyRelatedField(queryset=Counterparty.objects.all())
+    territories = PreloadedPrimaryKeyRelatedField(
+        queryset=Territory.objects.all(), many=True
+    )
+
+    class Meta(ApplicationSerializer.Meta):
+        read_only_fields = ("created", "modified", "request_file", "manager")
+        # Uniqueness is checked for the whole batch at once by the view, which
+        # also lets two rows swap their numbers
+        extra_kwargs = {
+            "number": {
+                **ApplicationSerializer.Meta.extra_kwargs["number"],
+                "validators": [],
+            }
+        }
+
+
+class ApplicationBatchUpdateResultSerializer(serializers.Serializer):
+    updated = serializers.ListField(child=serializers.IntegerField())
+    regeneration_job = serializers.IntegerField(allow_null=True)
+
+
 class ApplicationCreateView(generics.CreateAPIView):
     queryset = Application.objects.all()
     serializer_class = ApplicationSerializer
@@ -66,9 +127,11 @@ class ApplicationRetrieveView(generics.RetrieveAPIView):
     permission_classes = [IsAuthenticated]
 
 
-class PaymentCodeCreateSerializer(serializers.Serializer):
-    start_range = serializers.CharField(required=True)
-    end_range = serializers.CharField(required=True)
+class PaymentCodeIssueSerializer(serializers.Serializer):
+    """
+    Territory and application checks shared by the ways of issuing codes.
+    """
+
     territory_id = serializers.IntegerField(required=True)
 
     def validate_territory_id(self, value):
@@ -81,33 +144,147 @@ class PaymentCodeCreateSerializer(serializers.Serializer):
             raise serializers.ValidationError("Territory does not exist.")
         return value
 
-    # check for correct range
-    def validate(self, data):
+    def get_application(self, num_codes):
         """
-        Check that the start range is less than or equal to the end range
-        and that the range does not exceed the application's quantity.
+        Load the application of the URL and check that ``num_codes`` more codes
+        fit its quantity.
         """
-        start_range = data["start_range"]
-        end_range = data["end_range"]
         application = self.context["view"].kwargs.get("pk")
-
         try:
             application = Application.objects.get(id=application)
         except Application.DoesNotExist:
             raise ValidationError({"error": "Application not found."})
 
+        if num_codes + application.codes_count > application.allowed_codes:
+            raise ValidationError(
+                {"error": "Range exceeds the application's quantity."}
+            )
+        return application
+
+
+class PaymentCodeCreateSerializer(PaymentCodeIssueSerializer):
+    start_range = serializers.RegexField(r"^[0-9]{1,18}$", required=True)
+    end_range = serializers.RegexField(r"^[0-9]{1,18}$", required=True)
+
+    # check for correct range
+    def validate(self, data):
+        """
+        Check that the start range is less than or equal to the end range
+        and that the range does not exceed the application's quantity.
+        """
+        # Compared as numbers, "999" comes before "1000"
+        start_range = int(data["start_range"])
+        end_range = int(data["end_range"])
+
+        application = self.get_application(max(end_range - start_range + 1, 0))
         if start_range > end_range:
             raise ValidationError(
                 {"error": "Start range must be less than or equal to end range."}
             )
 
-        num_codes = int(end_range) - int(start_range) + 1
-        total_allowed = application.territories.count() * application.quantity
-        current_codes = application.codes.count()
+        data["application"] = application
+        return data
+
+
+class PaymentCodeAllocateSerializer(PaymentCodeIssueSerializer):
+    count = serializers.IntegerField(min_value=1)
+
+    def validate(self, data):
+        data["application"] = self.get_application(data["count"])
+        return data
+
+
+class PaymentCodeBlockSerializer(serializers.Serializer):
+    territory_id = serializers.IntegerField()
+    count = serializers.IntegerField()
+    start_range = serializers.CharField()
+    end_range = serializers.CharField()
+
+
+class StatsQuerySerializer(serializers.Serializer):
+    month_from = serializers.DateField(required=False)
+    month_to = serializers.DateField(required=False)
+    forwarder = serializers.IntegerField(required=False)
+
+
+class TerritoryCodeSummarySerializer(serializers.ModelSerializer):
+    territory_name = serializers.CharField(source="territory.name", default=None)
+
+    class Meta:
+        model = TerritoryCodeSummary
+        fields = ["territory", "territory_name", "code_status", "codes"]
+
+
+class ForwarderMonthSummarySerializer(serializers.ModelSerializer):
+    forwarder_name = serializers.CharField(source="forwarder.name")
+
+    class Meta:
+        model = ForwarderMonthSummary
+        fields = [
+            "forwarder",
+            "forwarder_name",
+            "month",
+            "applications",
+            "agreed_rate",
+            "add_charges",
+        ]
+
+
+class StatsTotalsSerializer(serializers.Serializer):
+    applications = serializers.IntegerField()
+    agreed_rate = serializers.DecimalField(max_digits=16, decimal_places=2)
+    add_charges = serializers.DecimalField(max_digits=16, decimal_places=2)
+
+
+class DashboardStatsSerializer(serializers.Serializer):
+    refreshed_at = serializers.DateTimeField(allow_null=True)
+    codes_by_territory = TerritoryCodeSummarySerializer(many=True)
+    applications_by_forwarder = ForwarderMonthSummarySerializer(many=True)
+    totals = StatsTotalsSerializer()
+
+
+class ChangeFeedQuerySerializer(serializers.Serializer):
+    since = serializers.CharField(
+        required=False,
+        help_text="The next cursor of the previous page. Leave out to start from the beginning.",
+    )
+    limit = serializers.IntegerField(required=False, min_value=1)
 
-        if num_codes + current_codes > total_allowed:
+    def validate_limit(self, value):
+        if value > settings.CHANGE_FEED_MAX_PAGE_SIZE:
             raise ValidationError(
-                {"error": "Range exceeds the application's quantity."}
+                f"Ensure this value is less than or equal to {settings.CHANGE_FEED_MAX_PAGE_SIZE}."
             )
+        return value
 
-        return data
+
+class PaymentCodeFeedSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = PaymentCode
+        fields = "__all__"
+
+
+class ChangeSerializer(serializers.Serializer):
+    action = serializers.ChoiceField(choices=["created", "updated", "deleted"])
+    id = serializers.IntegerField()
+    timestamp = serializers.DateTimeField()
+
+
+class ApplicationChangeSerializer(ChangeSerializer):
+    data = ApplicationSerializer(allow_null=True, help_text="Null for deletes.")
+
+
+class PaymentCodeChangeSerializer(ChangeSerializer):
+    data = PaymentCodeFeedSerializer(allow_null=True, help_text="Null for deletes.")
+
+
+class ApplicationChangePageSerializer(serializers.Serializer):
+    results = ApplicationChangeSerializer(many=True)
+    next = serializers.CharField(allow_null=True)
+    has_more = serializers.BooleanField()
+
+
+class PaymentCodeChangePageSerializer(serializers.Serializer):
+    results = PaymentCodeChangeSerializer(many=True)
+    next = serializers.CharField(allow_null=True)
+    has_more = serializers.BooleanField()
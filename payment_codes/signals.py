@@ -0,0 +1,56 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from payment_codes.counters import adjust_counters, recount_territories, status_deltas
+from payment_codes.models import Application, PaymentCode
+
+
+@receiver(post_save, sender=PaymentCode)
+def count_saved_code(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    current = (instance.application_id, instance.code_status)
+    previous = None if created else getattr(instance, "_counted_as", None)
+    instance._counted_as = current
+    if created:
+        adjust_counters(
+            instance.application_id, **status_deltas([instance.code_status])
+        )
+    elif previous and None not in previous and previous != current:
+        adjust_counters(previous[0], **status_deltas([previous[1]], sign=-1))
+        adjust_counters(
+            instance.application_id, **status_deltas([instance.code_status])
+        )
+
+
+@receiver(post_delete, sender=PaymentCode)
+def count_deleted_code(sender, instance, origin=None, **kwargs):
+    # Codes cascading from a deleted application have nothing left to count into
+    if isinstance(origin, Application) or getattr(origin, "model", None) is Application:
+        return
+    application_id, status = getattr(
+        instance, "_counted_as", (instance.application_id, instance.code_status)
+    )
+    adjust_counters(application_id, **status_deltas([status], sign=-1))
+
+
+@receiver(m2m_changed, sender=Application.territories.through)
+def count_territories(sender, instance, action, reverse, pk_set, **kwargs):
+    # Links are recounted rather than adjusted by len(pk_set): remove() reports
+    # ids that may not have been linked in the first place
+    if not reverse:
+        if action in ("post_add", "post_remove", "post_clear"):
+            recount_territories(Application.objects.filter(pk=instance.pk))
+            instance.refresh_from_db(fields=["territories_count"])
+        return
+
+    if action == "pre_clear":
+        instance._cleared_application_ids = list(
+            instance.ru_applications.values_list("pk", flat=True)
+        )
+    elif action in ("post_add", "post_remove"):
+        recount_territories(Application.objects.filter(pk__in=pk_set))
+    elif action == "post_clear":
+        recount_territories(
+            Application.objects.filter(pk__in=instance._cleared_application_ids)
+        )
@@ -0,0 +1,99 @@
+"""
+Dashboard summaries kept in PostgreSQL materialized views.
+
+The views are refreshed with ``REFRESH MATERIALIZED VIEW CONCURRENTLY`` so the
+dashboard keeps reading the previous snapshot while a refresh runs. Refreshes
+happen from ``manage.py refresh_stats`` on a schedule. A read that finds the
+last snapshot older than ``STATS_MAX_STALENESS`` seconds still serves it and
+starts a refresh on a background thread, so no request waits for one.
+"""
+
+import logging
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from interrail_moscow_code.tracing import span
+from payment_codes.models import SummaryRefresh
+
+logger = logging.getLogger(__name__)
+
+# Held while this process runs a background refresh
+background_refresh = threading.Lock()
+
+SUMMARY_NAME = "dashboard"
+SUMMARY_VIEWS = ("stats_territory_codes", "stats_forwarder_month")
+# Arbitrary application-wide key for pg_try_advisory_xact_lock
+REFRESH_LOCK_ID = 0x53544154
+
+
+def last_refreshed():
+    state = SummaryRefresh.objects.filter(name=SUMMARY_NAME).first()
+    return state.refreshed_at if state else None
+
+
+def refresh_summaries(wait=True):
+    """
+    Refresh every summary view and record the time.
+
+    With ``wait=False`` the refresh is skipped when another process is already
+    running one. Returns the time of the snapshot the views now hold.
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        if wait:
+            cursor.execute("SELECT pg_advisory_xact_lock(%s)", [REFRESH_LOCK_ID])
+        else:
+            cursor.execute("SELECT pg_try_advisory_xact_lock(%s)", [REFRESH_LOCK_ID])
+            if not cursor.fetchone()[0]:
+                return last_refreshed()
+
+        started = timezone.now()
+        with span("stats.refresh"):
+            for view in SUMMARY_VIEWS:
+                cursor.execute(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {view}")
+        SummaryRefresh.objects.update_or_create(
+            name=SUMMARY_NAME, defaults={"refreshed_at": started}
+        )
+    logger.info(f"Refreshed dashboard summaries as of {started.isoformat()}")
+    return started
+
+
+def refresh_in_background():
+    """
+    Refresh the summaries on a daemon thread, unless this process is already
+    doing so. Returns the thread, or None when one was already running.
+    """
+    if not background_refresh.acquire(blocking=False):
+        return None
+
+    def run():
+        try:
+            refresh_summaries(wait=False)
+        except Exception:
+            logger.exception("Background refresh of the dashboard summaries failed")
+        finally:
+            connection.close()
+            background_refresh.release()
+
+    thread = threading.Thread(target=run, name="stats-refresh", daemon=True)
+    thread.start()
+    return thread
+
+
+def ensure_fresh(max_staleness=None):
+    """
+    Return the time of the snapshot to serve, None if the views have not been
+    refreshed since they were created. A snapshot older than ``max_staleness``
+    seconds is still served, and a refresh is started in the background.
+    """
+    if max_staleness is None:
+        max_staleness = settings.STATS_MAX_STALENESS
+    refreshed_at = last_refreshed()
+    if refreshed_at is None or timezone.now() - refreshed_at > timedelta(
+        seconds=max_staleness
+    ):
+        refresh_in_background()
+    return refreshed_at
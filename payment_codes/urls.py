@@ -6,9 +6,14 @@ from payment_codes.views import (
     CounterpartyViewSet,
     ApplicationCreateView,
     ApplicationUpdateView,
+    ApplicationBatchUpdateView,
     ApplicationRetrieveView,
     PaymentCodeCreateRange,
+    PaymentCodeAllocate,
     ApplicationListView,
+    DashboardStatsView,
+    ApplicationChangesView,
+    PaymentCodeChangesView,
 )
 
 router = DefaultRouter()
@@ -21,6 +26,11 @@ urlpatterns = [
         PaymentCodeCreateRange.as_view(),
         name="code-range-create",
     ),
+    path(
+        "code_range/<int:pk>/allocate/",
+        PaymentCodeAllocate.as_view(),
+        name="code-range-allocate",
+    ),
     path(
         "application/create/",
         ApplicationCreateView.as_view(),
@@ -36,9 +46,21 @@ urlpatterns = [
         ApplicationUpdateView.as_view(),
         name="application-update",
     ),
+    path(
+        "application/batch_update/",
+        ApplicationBatchUpdateView.as_view(),
+        name="application-batch-update",
+    ),
     path(
         "application/<int:pk>/detail/",
         ApplicationRetrieveView.as_view(),
         name="application-detail",
     ),
+    path("stats/", DashboardStatsView.as_view(), name="dashboard-stats"),
+    path(
+        "changes/applications/",
+        ApplicationChangesView.as_view(),
+        name="application-changes",
+    ),
+    path("changes/codes/", PaymentCodeChangesView.as_view(), name="code-changes"),
 ]
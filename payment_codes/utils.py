@@ -1,14 +1,41 @@
+import logging
 import os
-import requests
+import time
 
 from django.conf import settings
+from django.db.models import prefetch_related_objects
 from docxtpl import DocxTemplate
-from interrail_moscow_code.settings import DOC_TO_PDF_CONVERTER_URL
+from interrail_moscow_code.circuit_breaker import CircuitBreaker, CircuitOpenError
+from interrail_moscow_code.metrics import CONVERTER_DURATION
+from interrail_moscow_code.tracing import span
+from payment_codes import converters
+from payment_codes.models import Application
+
+logger = logging.getLogger(__name__)
+
+converter_breaker = CircuitBreaker(
+    "converter",
+    failure_threshold=settings.CONVERTER_BREAKER_FAILURES,
+    window=settings.CONVERTER_BREAKER_WINDOW_SECONDS,
+    reset_timeout=settings.CONVERTER_BREAKER_RESET_SECONDS,
+    failures=converters.CONVERTER_UNAVAILABLE,
+    is_failure=converters.is_converter_failure,
+    probe_timeout=settings.CONVERTER_TIMEOUT_SECONDS * 2,
+)
+
+
+def converter_unavailable(exc):
+    """
+    Whether an error means the converter could not be used rather than a bad
+    document, the application is then kept and its PDF generated later.
+    """
+    return isinstance(exc, CircuitOpenError) or converters.converter_unavailable(exc)
 
 
-def generate_application_document(application):
+def generate_application_document(application, context=None):
     """
-    Generate DOCX document from template and convert to PDF using custom converter
+    Generate DOCX document from template and convert to PDF using custom converter.
+    ``context`` may be passed in when it was built for a batch of applications.
     """
     # Path to your template
     template_path = os.path.join(
@@ -25,58 +52,20 @@ def generate_application_document(application):
     os.makedirs(os.path.join(settings.MEDIA_ROOT, "temp"), exist_ok=True)
 
     try:
-        # Prepare context data for template
-        context = {
-            "order_number": application.number,
-            "date": application.date.strftime("%d.%m.%Y") if application.date else "",
-            "sending_type": dict(application.SENDING_TYPE_CHOICES).get(
-                application.sending_type, ""
-            ),
-            "quantity": application.quantity,
-            "departure": application.departure,
-            "departure_code": application.departure_code,
-            "destination": application.destination,
-            "destination_code": application.destination_code,
-            "cargo": application.cargo,
-            "hs_code": application.hs_code,
-            "etcng": application.etcng,
-            "loading_type": dict(application.LOADING_TYPE_CHOICES).get(
-                application.loading_type, ""
-            ),
-            "weight": application.weight,
-            "container_type": dict(application.CONTAINER_TYPE_CHOICES).get(
-                application.container_type, ""
-            ),
-            "paid_telegram": (
-                "Прошу также предоставить проплатную телеграмму"
-                if application.paid_telegram
-                else ""
-            ),
-            "rolling_stock_1": application.rolling_stock_1,
-            "rolling_stock_2": application.rolling_stock_2,
-            "conditions_of_carriage": application.conditions_of_carriage,
-            "agreed_rate": application.agreed_rate,
-            "add_charges": application.add_charges,
-            "border_crossing": application.border_crossing,
-            "containers_or_wagons": application.containers_or_wagons,
-            "period": application.period,
-            "shipper": application.shipper,
-            "consignee": application.consignee,
-            "departure_country": application.departure_country,
-            "destination_country": application.destination_country,
-            "territories": ", ".join([t.name for t in application.territories.all()]),
-            "forwarder": application.forwarder.name if application.forwarder else "",
-            "manager": str(application.manager) if application.manager else "",
-            "comment": application.comment,
-        }
+        if context is None:
+            with span("document.context", application=application.id):
+                context = build_application_context(application)
 
         # Generate DOCX
-        doc = DocxTemplate(template_path)
-        doc.render(context)
-        doc.save(temp_docx_path)
+        with span("document.render", application=application.id):
+            doc = DocxTemplate(template_path)
+            doc.render(context)
+        with span("document.save", application=application.id):
+            doc.save(temp_docx_path)
 
         # Convert to PDF using custom converter
-        pdf_relative_path = convert(temp_docx_path, pdf_filename)
+        with span("document.convert", application=application.id):
+            pdf_relative_path = convert(temp_docx_path, pdf_filename)
 
         # Clean up temporary DOCX file
         if os.path.exists(temp_docx_path):
@@ -91,26 +80,138 @@ def generate_application_document(application):
         raise e
 
 
-def convert(
-    docx_file, file_name, path="applications", timeout=30
-):  # 30 seconds default timeout
-    url = DOC_TO_PDF_CONVERTER_URL
+# Application fields that appear in the generated document, changing any other
+# field does not require a new PDF
+PRINTED_FIELDS = frozenset(
+    {
+        "number",
+        "date",
+        "sending_type",
+        "quantity",
+        "departure",
+        "departure_code",
+        "destination",
+        "destination_code",
+        "cargo",
+        "hs_code",
+        "etcng",
+        "loading_type",
+        "weight",
+        "container_type",
+        "paid_telegram",
+        "rolling_stock_1",
+        "rolling_stock_2",
+        "conditions_of_carriage",
+        "agreed_rate",
+        "add_charges",
+        "border_crossing",
+        "containers_or_wagons",
+        "period",
+        "shipper",
+        "consignee",
+        "departure_country",
+        "destination_country",
+        "territories",
+        "forwarder",
+        "manager",
+        "comment",
+    }
+)
+
+
+# Labels of the choice fields, built once rather than for every document
+SENDING_TYPE_LABELS = dict(Application.SENDING_TYPE_CHOICES)
+LOADING_TYPE_LABELS = dict(Application.LOADING_TYPE_CHOICES)
+CONTAINER_TYPE_LABELS = dict(Application.CONTAINER_TYPE_CHOICES)
+
+
+def build_application_contexts(applications):
+    """
+    Prepare the template contexts of several application documents, keyed by
+    application id. Territories, forwarders and managers are loaded with one
+    query each for the whole batch, or not at all if already loaded.
+    """
+    applications = list(applications)
+    prefetch_related_objects(applications, "territories", "forwarder", "manager")
+    return {
+        application.pk: _application_context(application)
+        for application in applications
+    }
+
+
+def build_application_context(application):
+    """
+    Prepare the template context for an application document
+    """
+    return build_application_contexts([application])[application.pk]
+
+
+def _application_context(application):
+    return {
+        "order_number": application.number,
+        "date": application.date.strftime("%d.%m.%Y") if application.date else "",
+        "sending_type": SENDING_TYPE_LABELS.get(application.sending_type, ""),
+        "quantity": application.quantity,
+        "departure": application.departure,
+        "departure_code": application.departure_code,
+        "destination": application.destination,
+        "destination_code": application.destination_code,
+        "cargo": application.cargo,
+        "hs_code": application.hs_code,
+        "etcng": application.etcng,
+        "loading_type": LOADING_TYPE_LABELS.get(application.loading_type, ""),
+        "weight": application.weight,
+        "container_type": CONTAINER_TYPE_LABELS.get(application.container_type, ""),
+        "paid_telegram": (
+            "Прошу также предоставить проплатную телеграмму"
+            if application.paid_telegram
+            else ""
+        ),
+        "rolling_stock_1": application.rolling_stock_1,
+        "rolling_stock_2": application.rolling_stock_2,
+        "conditions_of_carriage": application.conditions_of_carriage,
+        "agreed_rate": application.agreed_rate,
+        "add_charges": application.add_charges,
+        "border_crossing": application.border_crossing,
+        "containers_or_wagons": application.containers_or_wagons,
+        "period": application.period,
+        "shipper": application.shipper,
+        "consignee": application.consignee,
+        "departure_country": application.departure_country,
+        "destination_country": application.destination_country,
+        "territories": ", ".join([t.name for t in application.territories.all()]),
+        "forwarder": application.forwarder.name if application.forwarder else "",
+        "manager": str(application.manager) if application.manager else "",
+        "comment": application.comment,
+    }
+
+
+def convert(docx_file, file_name, path="applications", timeout=None):
+    timeout = settings.CONVERTER_TIMEOUT_SECONDS if timeout is None else timeout
+    start = time.perf_counter()
+    outcome = "error"
     try:
-        response = requests.post(
-            url,
-            files={"document": open(docx_file, "rb")},
-            timeout=timeout,  # Added timeout parameter
-        )
-        response.raise_for_status()  # Raise an exception for bad status codes
-
-        with open(f"media/{path}/{file_name}", "wb") as f:
-            f.write(response.content)
-        print(f"File {file_name} uploaded successfully")
+        # Fails fast with CircuitOpenError while the converter is known to be down
+        with converter_breaker.guard(), span("converter.upload", file=file_name):
+            content = converters.get_converter().to_pdf(docx_file, timeout)
+
+        with span("converter.write", file=file_name):
+            with open(f"media/{path}/{file_name}", "wb") as f:
+                f.write(content)
+        outcome = "success"
+        logger.info(f"File {file_name} uploaded successfully")
         return f"{path}/" + file_name
 
-    except requests.Timeout:
-        print(f"Request timed out after {timeout} seconds")
+    except CircuitOpenError:
+        outcome = "rejected"
+        logger.warning(f"Converter circuit is open, skipped converting {file_name}")
+        raise
+    except converters.CONVERTER_TIMEOUTS:
+        outcome = "timeout"
+        logger.error(f"Conversion timed out after {timeout} seconds")
         raise
-    except requests.RequestException as e:
-        print(f"Error during conversion: {e}")
+    except (*converters.CONVERTER_UNAVAILABLE, converters.DocumentRejected) as e:
+        logger.error(f"Error during conversion: {e}")
         raise
+    finally:
+        CONVERTER_DURATION.observe(time.perf_counter() - start, outcome=outcome)
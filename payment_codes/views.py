@@ -1,23 +1,57 @@
 import logging
 import os
+from decimal import Decimal
 
-from django.db import transaction
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Prefetch, Sum, Value
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 from drf_spectacular.utils import extend_schema, OpenApiResponse
-from rest_framework import viewsets, generics, serializers, pagination
-from rest_framework.exceptions import ValidationError
+from rest_framework import viewsets, generics, serializers, pagination, status
 from rest_framework.permissions import IsAuthenticated
-
-from payment_codes.models import Territory, Counterparty, Application, PaymentCode
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from interrail_moscow_code.db_router import use_primary
+from payment_codes import jobs
+from payment_codes.changes import CursorExpired, read_changes
+from payment_codes.code_ranges import claim_range, create_codes, reserve_block
+from payment_codes.counters import recount_territories, reserve_codes
+from payment_codes.idempotency import IDEMPOTENCY_KEY_PARAMETER, IdempotentCreateMixin
+from payment_codes.models import (
+    Territory,
+    Counterparty,
+    Application,
+    PaymentCode,
+    TerritoryCodeSummary,
+    ForwarderMonthSummary,
+    BulkJob,
+    Tombstone,
+)
 from payment_codes.serializers import (
     TerritorySerializer,
     CounterpartySerializer,
     ApplicationSerializer,
+    ApplicationBatchItemSerializer,
+    ApplicationBatchUpdateResultSerializer,
     PaymentCodeCreateSerializer,
+    PaymentCodeAllocateSerializer,
+    PaymentCodeBlockSerializer,
     ApplicationRetrieveSerializer,
     ApplicationListSerializer,
+    StatsQuerySerializer,
+    DashboardStatsSerializer,
+    ChangeFeedQuerySerializer,
+    ApplicationChangePageSerializer,
+    PaymentCodeChangePageSerializer,
+)
+from payment_codes.stats import ensure_fresh
+from payment_codes.utils import (
+    PRINTED_FIELDS,
+    converter_unavailable,
+    generate_application_document,
 )
-from payment_codes.utils import generate_application_document
 
 logger = logging.getLogger(__name__)
 
@@ -141,6 +175,10 @@ class CounterpartyViewSet(viewsets.ModelViewSet):
     - Generate a PDF document
     - Store the PDF path in request_file field
 
+    While the PDF converter is unavailable the application is still created,
+    without request_file and with document_pending set. Its PDF is generated
+    once the converter recovers.
+
     Choice Fields:
     - sending_type: single (Одиночный) or block_train (КП)
     - loading_type: wagon (Вагон) or container (Контейнер)
@@ -151,7 +189,11 @@ class CounterpartyViewSet(viewsets.ModelViewSet):
     - rolling_stock_2: Платформа, Цистерна, Вагон , Фитинговая платформа
     - paid_telegram: true or false ('Прошу также предоставить проплатную телеграмму' if true else empty)
     - conditions_of_carriage: FOR-FOR,FOB-FOR ...
+
+    Send an Idempotency-Key header to make retries safe, a retry with the same
+    key returns the stored response instead of creating another application.
     """,
+    parameters=[IDEMPOTENCY_KEY_PARAMETER],
     responses={
         201: OpenApiResponse(
             description="Application created successfully",
@@ -162,27 +204,36 @@ class CounterpartyViewSet(viewsets.ModelViewSet):
         ),
     },
 )
-class ApplicationCreateView(generics.CreateAPIView):
+class ApplicationCreateView(IdempotentCreateMixin, generics.CreateAPIView):
     queryset = Application.objects.all()
     serializer_class = ApplicationSerializer
     permission_classes = [IsAuthenticated]
 
     @transaction.atomic
     def perform_create(self, serializer):
-        instance = serializer.save(manager=self.request.user)
+        # The id is enough, this avoids loading the user row
+        instance = serializer.save(manager_id=self.request.user.pk)
         try:
             # Generate PDF and update request_file field
             pdf_path = generate_application_document(instance)
             instance.request_file = pdf_path
             instance.save()
         except Exception as e:
-            logger.error(
-                f"Error generating PDF for application {instance.id}: {str(e)}"
-            )
-            instance.delete()  # Delete the application if document generation fails
-            raise serializers.ValidationError(
-                {"error": f"Failed to generate application document: {str(e)}"}
+            if not converter_unavailable(e):
+                logger.error(
+                    f"Error generating PDF for application {instance.id}: {str(e)}"
+                )
+                instance.delete()  # Delete the application if document generation fails
+                raise serializers.ValidationError(
+                    {"error": f"Failed to generate application document: {str(e)}"}
+                )
+            # Degraded mode: keep the application, its PDF follows once the
+            # converter is back (manage.py regenerate_pending_documents)
+            logger.warning(
+                f"Saved application {instance.id} without a document: {str(e)}"
             )
+            instance.document_pending = True
+            instance.save(update_fields=["document_pending", "modified"])
 
 
 class ApplicationPagination(pagination.PageNumberPagination):
@@ -227,54 +278,469 @@ class ApplicationUpdateView(generics.UpdateAPIView):
                 os.remove(old_file)
 
         except Exception as e:
-            logger.error(
-                f"Error generating PDF for application {instance.id}: {str(e)}"
+            if not converter_unavailable(e):
+                logger.error(
+                    f"Error generating PDF for application {instance.id}: {str(e)}"
+                )
+                raise serializers.ValidationError(
+                    {"error": f"Failed to generate application document: {str(e)}"}
+                )
+            logger.warning(
+                f"Updated application {instance.id} without a new document: {str(e)}"
+            )
+            instance.document_pending = True
+            instance.save(update_fields=["document_pending", "modified"])
+
+
+@extend_schema(tags=["Applications"])
+class ApplicationBatchUpdateView(APIView):
+    """
+    Partial update of many applications in one transaction.
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    @extend_schema(
+        summary="Update many applications",
+        description="""
+        Takes a list of objects with the id of an application and the fields
+        to change, at most APPLICATION_BATCH_MAX_ITEMS of them.
+
+        All applications are validated first and updated together, either all
+        changes are applied or none. Rows whose printed fields changed get
+        their PDF regenerated by a background job, its id is returned as
+        regeneration_job. Errors are returned as a list aligned with the input.
+        """,
+        request=ApplicationBatchItemSerializer(many=True),
+        responses={
+            200: ApplicationBatchUpdateResultSerializer,
+            400: OpenApiResponse(description="Validation errors per application"),
+        },
+    )
+    @transaction.atomic
+    def patch(self, request):
+        items = request.data
+        limit = settings.APPLICATION_BATCH_MAX_ITEMS
+        if not isinstance(items, list) or not items:
+            raise serializers.ValidationError(
+                {"error": "Expected a non-empty list of applications."}
             )
+        if len(items) > limit:
             raise serializers.ValidationError(
-                {"error": f"Failed to generate application document: {str(e)}"}
+                {"error": f"At most {limit} applications can be updated at once."}
+            )
+        if not all(isinstance(item, dict) for item in items):
+            raise serializers.ValidationError(
+                {"error": "Every application must be an object."}
+            )
+        ids = [item.get("id") for item in items]
+        if not all(type(pk) is int for pk in ids):
+            raise serializers.ValidationError(
+                {"error": "Every application needs an integer id."}
+            )
+        if len(set(ids)) != len(ids):
+            raise serializers.ValidationError(
+                {"error": "Each application can appear only once."}
             )
 
+        applications = Application.objects.select_for_update().in_bulk(ids)
+        missing = [pk for pk in ids if pk not in applications]
+        if missing:
+            raise serializers.ValidationError(
+                {"error": f"Applications not found: {missing}."}
+            )
+
+        context = {
+            "request": request,
+            "view": self,
+            "preloaded": self.preload_related(items),
+        }
+        batch = [
+            ApplicationBatchItemSerializer(
+                applications[item["id"]], data=item, partial=True, context=context
+            )
+            for item in items
+        ]
+        errors = [{} if item.is_valid() else item.errors for item in batch]
+        errors = self.check_duplicate_numbers(batch, errors)
+        if any(errors):
+            raise serializers.ValidationError(errors)
+
+        updated, regenerate = self.apply(batch)
+        job = None
+        if regenerate:
+            job = jobs.start_job(
+                BulkJob.REGENERATE,
+                Application.objects.filter(pk__in=regenerate),
+                user=request.user,
+            )
+        result = {"updated": updated, "regeneration_job": job.pk if job else None}
+        return Response(ApplicationBatchUpdateResultSerializer(result).data)
+
+    def preload_related(self, items):
+        """
+        Load every forwarder and territory the batch refers to, one query each.
+        """
+        forwarder_ids = [item.get("forwarder") for item in items]
+        territory_ids = [
+            pk
+            for item in items
+            if isinstance(item.get("territories"), list)
+            for pk in item["territories"]
+        ]
+
+        def ids(values):
+            # Anything else fails validation in the field itself
+            return {
+                int(pk)
+                for pk in values
+                if type(pk) is int or (isinstance(pk, str) and pk.isdigit())
+            }
+
+        return {
+            Counterparty: Counterparty.objects.in_bulk(ids(forwarder_ids)),
+            Territory: Territory.objects.in_bulk(ids(territory_ids)),
+        }
+
+    def check_duplicate_numbers(self, batch, errors):
+        """
+        Reject numbers that two rows would have once the batch is applied, or
+        that an application outside the batch already has.
+        """
+        # Rows keep their current number unless they change it, so a row can
+        # take the number another row gives up. A blank number is unique too.
+        numbers, changed = {}, {}
+        for index, item in enumerate(batch):
+            number = item.instance.number
+            if not errors[index] and "number" in item.validated_data:
+                number = item.validated_data["number"]
+                if number != item.instance.number:
+                    changed[index] = number
+            numbers.setdefault(number, []).append(index)
+        for indexes in numbers.values():
+            if len(indexes) > 1:
+                for index in indexes:
+                    if index in changed:
+                        errors[index] = {"number": ["Duplicate number in this batch."]}
+
+        taken = set(
+            Application.objects.filter(number__in=changed.values())
+            .exclude(pk__in=[item.instance.pk for item in batch])
+            .order_by()
+            .values_list("number", flat=True)
+        )
+        for index, number in changed.items():
+            if number in taken and not errors[index]:
+                errors[index] = {
+                    "number": ["application with this number already exists."]
+                }
+        return errors
+
+    def apply(self, batch):
+        """
+        Write the validated changes with one bulk UPDATE and return the ids of
+        the changed applications and of those whose document must be regenerated.
+        """
+        now = timezone.now()
+        through = Application.territories.through
+        current_territories = {}
+        if any("territories" in item.validated_data for item in batch):
+            for application_id, territory_id in through.objects.filter(
+                application_id__in=[item.instance.pk for item in batch]
+            ).values_list("application_id", "territory_id"):
+                current_territories.setdefault(application_id, set()).add(territory_id)
+
+        changed_rows, changed_fields, new_territories = [], set(), {}
+        regenerate = []
+        for item in batch:
+            instance = item.instance
+            data = dict(item.validated_data)
+            data.pop("id", None)
+            changed = set()
+            territories = data.pop("territories", None)
+            if territories is not None:
+                territory_ids = {territory.pk for territory in territories}
+                if territory_ids != current_territories.get(instance.pk, set()):
+                    new_territories[instance.pk] = territory_ids
+                    changed.add("territories")
+            for name, value in data.items():
+                field = Application._meta.get_field(name)
+                # Compare foreign keys by id, without fetching the related row
+                old = getattr(instance, field.attname)
+                new = value.pk if field.is_relation and value is not None else value
+                if old != new:
+                    setattr(instance, name, value)
+                    changed.add(name)
+            if not changed:
+                continue
+            instance.modified = now
+            changed_rows.append(instance)
+            changed_fields |= changed - {"territories"}
+            if changed & PRINTED_FIELDS:
+                regenerate.append(instance.pk)
+
+        if changed_rows:
+            # One statement, the unique number is checked at its end, so rows
+            # may swap numbers however many of them the batch holds
+            Application.objects.bulk_update(
+                changed_rows, [*sorted(changed_fields), "modified"], batch_size=None
+            )
+        if new_territories:
+            through.objects.filter(application_id__in=new_territories).delete()
+            through.objects.bulk_create(
+                [
+                    through(application_id=application_id, territory_id=territory_id)
+                    for application_id, territory_ids in new_territories.items()
+                    for territory_id in territory_ids
+                ],
+                batch_size=2000,
+            )
+            # Direct writes to the link table bypass the m2m signals
+            recount_territories(Application.objects.filter(pk__in=new_territories))
+        return sorted(instance.pk for instance in changed_rows), regenerate
+
 
 @extend_schema(tags=["Applications"])
 class ApplicationRetrieveView(generics.RetrieveAPIView):
-    queryset = Application.objects.all()
+    queryset = Application.objects.prefetch_related(
+        "territories",
+        Prefetch("codes", queryset=PaymentCode.objects.select_related("territory")),
+    )
     serializer_class = ApplicationRetrieveSerializer
     permission_classes = [IsAuthenticated]
     lookup_field = "pk"
 
 
-@extend_schema(tags=["Payment Codes"])
-class PaymentCodeCreateRange(generics.CreateAPIView):
+@extend_schema(tags=["Payment Codes"], parameters=[IDEMPOTENCY_KEY_PARAMETER])
+class PaymentCodeCreateRange(IdempotentCreateMixin, generics.CreateAPIView):
     serializer_class = PaymentCodeCreateSerializer
     permission_classes = [IsAuthenticated]
     lookup_field = "pk"
 
     @transaction.atomic
     def perform_create(self, serializer):
-        pk = self.kwargs.get(self.lookup_field)
         data = serializer.validated_data
-        start_range = data["start_range"]
-        end_range = data["end_range"]
+        start_range, end_range = int(data["start_range"]), int(data["end_range"])
+        count = end_range - start_range + 1
         territory_id = data["territory_id"]
+        # Already loaded and checked by the serializer
+        application = data["application"]
+
+        # Count the codes against the quota first, this also guards against a
+        # concurrent request having used it up since validation
+        if not reserve_codes(application, count):
+            raise serializers.ValidationError(
+                {"error": "Range exceeds the application's quantity."}
+            )
 
+        # Keep the numbers of this range out of later allocated blocks and
+        # reject it when some of them were already issued
+        overlap = serializers.ValidationError(
+            {"error": "Range overlaps numbers already issued for this territory."}
+        )
+        if not claim_range(territory_id, start_range, end_range):
+            raise overlap
         try:
-            application = Application.objects.get(id=pk)
-        except Application.DoesNotExist:
-            raise ValidationError({"error": "Application not found."})
-
-        # Create the codes
-        codes_to_create = []
-        for number in range(int(start_range), int(end_range) + 1):
-            codes_to_create.append(
-                PaymentCode(
-                    application=application,
-                    date=application.date,
-                    number=str(number).zfill(len(start_range)),
-                    territory_id=territory_id,
-                    created=timezone.now(),
-                    modified=timezone.now(),
+            with transaction.atomic():
+                create_codes(
+                    application,
+                    territory_id,
+                    start_range,
+                    count,
+                    width=len(data["start_range"]),
                 )
+        except IntegrityError:
+            # A block allocated concurrently got some of the numbers first
+            raise overlap
+
+
+@extend_schema(
+    tags=["Payment Codes"],
+    parameters=[IDEMPOTENCY_KEY_PARAMETER],
+    responses={201: PaymentCodeBlockSerializer},
+)
+class PaymentCodeAllocate(IdempotentCreateMixin, generics.CreateAPIView):
+    """
+    Issue the next ``count`` free code numbers of a territory, for dispatchers
+    that do not pick the numbers themselves.
+    """
+
+    serializer_class = PaymentCodeAllocateSerializer
+    permission_classes = [IsAuthenticated]
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        block = self.allocate(serializer.validated_data)
+        return Response(
+            PaymentCodeBlockSerializer(block).data, status=status.HTTP_201_CREATED
+        )
+
+    @transaction.atomic
+    def allocate(self, data):
+        application = data["application"]
+        territory_id = data["territory_id"]
+        count = data["count"]
+
+        # The quota first, a request that does not fit never uses up numbers
+        if not reserve_codes(application, count):
+            raise serializers.ValidationError(
+                {"error": "Range exceeds the application's quantity."}
             )
+        # Committed right away, the numbers are lost if the codes are not created
+        first = reserve_block(territory_id, count)
+        codes = create_codes(application, territory_id, first, count)
+        return {
+            "territory_id": territory_id,
+            "count": count,
+            "start_range": codes[0].number,
+            "end_range": codes[-1].number,
+        }
+
+
+@extend_schema(tags=["Statistics"])
+class DashboardStatsView(APIView):
+    """
+    Dashboard totals served from the materialized summaries. A read of a
+    snapshot older than STATS_MAX_STALENESS seconds starts a background refresh.
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    @extend_schema(
+        summary="Dashboard statistics",
+        description="""
+        Codes per territory and status, and applications with their agreed
+        rate and additional charges per forwarder and month.
+
+        The forwarder breakdown covers the last twelve months unless
+        month_from / month_to are given. refreshed_at is the time of the
+        snapshot the numbers come from, null before the first refresh.
+        """,
+        parameters=[StatsQuerySerializer],
+        responses={200: DashboardStatsSerializer},
+    )
+    def get(self, request):
+        query = StatsQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+
+        refreshed_at = ensure_fresh()
+
+        month_from = params.get("month_from")
+        if month_from is None:
+            today = timezone.localdate()
+            month_from = today.replace(year=today.year - 1, day=1)
+        forwarder_rows = ForwarderMonthSummary.objects.select_related(
+            "forwarder"
+        ).filter(month__gte=month_from.replace(day=1))
+        if "month_to" in params:
+            forwarder_rows = forwarder_rows.filter(month__lte=params["month_to"])
+        if "forwarder" in params:
+            forwarder_rows = forwarder_rows.filter(forwarder_id=params["forwarder"])
+
+        totals = forwarder_rows.aggregate(
+            applications=Coalesce(Sum("applications"), Value(0)),
+            agreed_rate=Coalesce(Sum("agreed_rate"), Value(Decimal(0))),
+            add_charges=Coalesce(Sum("add_charges"), Value(Decimal(0))),
+        )
+        stats = {
+            "refreshed_at": refreshed_at,
+            "codes_by_territory": TerritoryCodeSummary.objects.select_related(
+                "territory"
+            ).order_by("territory_id", "code_status"),
+            "applications_by_forwarder": forwarder_rows.order_by(
+                "-month", "forwarder_id"
+            ),
+            "totals": totals,
+        }
+        return Response(DashboardStatsSerializer(stats).data)
+
+
+CHANGE_FEED_DESCRIPTION = """
+    Records changed since the ``since`` cursor, oldest first, for clients that
+    keep a local copy in sync. Start without ``since``, then pass the ``next``
+    cursor of each page to the following request, and keep it for the next
+    sync once ``has_more`` is false.
+
+    Created and updated records carry their current data, deleted ones only
+    their id. A record changed several times between two syncs appears once.
+    The most recent changes are held back until no transaction still in
+    progress can commit an older one.
+
+    Deletes are remembered for CHANGE_FEED_RETENTION_DAYS days. An older
+    cursor gets 410 Gone and the client has to list everything again.
+    """
+
+
+class ChangeFeedView(APIView):
+    """
+    One page of the change feed of ``kind``, read from ``queryset``.
+    """
+
+    permission_classes = [IsAuthenticated]
+    kind = None
+    queryset = None
+
+    def get(self, request):
+        query = ChangeFeedQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+
+        # The horizon is taken on the primary, and the rows have to be
+        # at least as recent as it
+        with use_primary():
+            try:
+                changes, next_cursor, has_more = read_changes(
+                    self.queryset.all(),
+                    self.kind,
+                    since=params.get("since"),
+                    limit=params.get("limit", settings.CHANGE_FEED_PAGE_SIZE),
+                )
+            except ValueError as e:
+                raise serializers.ValidationError({"since": [str(e)]})
+            except CursorExpired as e:
+                return Response({"error": str(e)}, status=status.HTTP_410_GONE)
+            page = {
+                "results": [
+                    {"action": action, "id": pk, "timestamp": timestamp, "data": row}
+                    for action, pk, timestamp, row in changes
+                ],
+                "next": next_cursor,
+                "has_more": has_more,
+            }
+            return Response(self.page_serializer_class(page).data)
+
 
-        # Bulk create for better performance
-        PaymentCode.objects.bulk_create(codes_to_create)
+@extend_schema(
+    tags=["Changes"],
+    summary="Application changes",
+    description=CHANGE_FEED_DESCRIPTION,
+    parameters=[ChangeFeedQuerySerializer],
+    responses={
+        200: ApplicationChangePageSerializer,
+        400: OpenApiResponse(description="Malformed cursor or limit"),
+        410: OpenApiResponse(description="Cursor older than the retention"),
+    },
+)
+class ApplicationChangesView(ChangeFeedView):
+    kind = Tombstone.APPLICATION
+    queryset = Application.objects.prefetch_related("territories")
+    page_serializer_class = ApplicationChangePageSerializer
+
+
+@extend_schema(
+    tags=["Changes"],
+    summary="Payment code changes",
+    description=CHANGE_FEED_DESCRIPTION,
+    parameters=[ChangeFeedQuerySerializer],
+    responses={
+        200: PaymentCodeChangePageSerializer,
+        400: OpenApiResponse(description="Malformed cursor or limit"),
+        410: OpenApiResponse(description="Cursor older than the retention"),
+    },
+)
+class PaymentCodeChangesView(ChangeFeedView):
+    kind = Tombstone.PAYMENT_CODE
+    queryset = PaymentCode.objects.all()
+    page_serializer_class = PaymentCodeChangePageSerializer
@@ -1,18 +1,143 @@
+import json
 import os
+import re
 import shutil
+from collections import Counter
+from contextlib import contextmanager
 from datetime import date, datetime
 from decimal import Decimal
 
 import pytest
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.cache import cache, caches
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from rest_framework.test import APIClient
 from rest_framework_simplejwt.tokens import RefreshToken
 
+from interrail_moscow_code.db_router import SHARED_STATE_DB_ALIAS
 from payment_codes.models import Territory, Counterparty, Application, PaymentCode
+from payment_codes.converters import get_converter
+from users.blacklist import revocation_filter
 
 User = get_user_model()
 
+QUERY_BUDGETS_PATH = os.path.join(os.path.dirname(__file__), "query_budgets.json")
+
+measured_budgets_key = pytest.StashKey[dict]()
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--update-query-budgets",
+        action="store_true",
+        default=False,
+        help="Rewrite tests/query_budgets.json with the query counts measured in this run.",
+    )
+
+
+def pytest_configure(config):
+    config.stash[measured_budgets_key] = {}
+
+
+def pytest_collection_modifyitems(items):
+    # The shared cache is written on its own connection, which database tests
+    # have to be allowed to use
+    for item in items:
+        marker = item.get_closest_marker("django_db")
+        if marker is not None and "databases" not in marker.kwargs:
+            item.add_marker(
+                pytest.mark.django_db(
+                    *marker.args,
+                    databases=["default", SHARED_STATE_DB_ALIAS],
+                    **marker.kwargs,
+                ),
+                append=False,
+            )
+
+
+def pytest_sessionfinish(session):
+    measured = session.config.stash.get(measured_budgets_key, {})
+    if not session.config.getoption("--update-query-budgets") or not measured:
+        return
+    budgets = load_query_budgets()
+    budgets.update(measured)
+    with open(QUERY_BUDGETS_PATH, "w") as f:
+        json.dump(budgets, f, indent=2, sort_keys=True, ensure_ascii=False)
+        f.write("\n")
+
+
+def load_query_budgets():
+    if not os.path.exists(QUERY_BUDGETS_PATH):
+        return {}
+    with open(QUERY_BUDGETS_PATH) as f:
+        return json.load(f)
+
+
+def fingerprint_query(sql):
+    """Collapse literals so that the same statement with other values groups together"""
+    sql = re.sub(r'"s\d+_x\d+"', '"?"', sql)  # savepoint ids
+    sql = re.sub(r"'(?:[^']|'')*'", "?", sql)
+    sql = re.sub(r"\b\d+(?:\.\d+)?\b", "?", sql)
+    sql = re.sub(r"\(\s*\?(?:\s*,\s*\?)*\s*\)", "(...)", sql)
+    return sql
+
+
+def query_budget_report(name, budget, queries):
+    measured = Counter(fingerprint_query(q["sql"]) for q in queries)
+    recorded = Counter(budget.get("queries", {}))
+    lines = [
+        f"Query budget exceeded for {name!r}: "
+        f"{len(queries)} queries, budget is {budget['max_queries']}.",
+        "Statements that grew (recorded -> measured):",
+    ]
+    for sql, count in measured.most_common():
+        if count > recorded[sql]:
+            lines.append(f"  {recorded[sql]} -> {count}  {sql}")
+    lines.append(
+        "If the increase is intended, re-run with --update-query-budgets "
+        "and commit tests/query_budgets.json."
+    )
+    return "\n".join(lines)
+
+
+@pytest.fixture
+def query_budget(request):
+    """
+    Assert that a block stays within the query budget recorded for an endpoint.
+
+        with query_budget("application-detail"):
+            authenticated_client.get(url)
+    """
+    budgets = load_query_budgets()
+    update = request.config.getoption("--update-query-budgets")
+
+    @contextmanager
+    def check(name):
+        with CaptureQueriesContext(connection) as captured:
+            yield captured
+        queries = captured.captured_queries
+        if update:
+            request.config.stash[measured_budgets_key][name] = {
+                "max_queries": len(queries),
+                "queries": dict(
+                    sorted(
+                        Counter(fingerprint_query(q["sql"]) for q in queries).items()
+                    )
+                ),
+            }
+            return
+        if name not in budgets:
+            pytest.fail(
+                f"No query budget recorded for {name!r}, "
+                f"run with --update-query-budgets to record one."
+            )
+        if len(queries) > budgets[name]["max_queries"]:
+            pytest.fail(query_budget_report(name, budgets[name], queries))
+
+    return check
+
 
 @pytest.fixture(scope="session")
 def django_db_setup(django_db_setup, django_db_blocker, tmpdir_factory):
@@ -43,6 +168,23 @@ def django_db_setup(django_db_setup, django_db_blocker, tmpdir_factory):
         shutil.rmtree(applications_dir, ignore_errors=True)
 
 
+@pytest.fixture(autouse=True)
+def clear_cache(request):
+    """Keep cached state such as users' is_active or open circuits from leaking between tests"""
+    # The shared cache is a database table, only reachable from database tests
+    uses_db = request.node.get_closest_marker("django_db") is not None
+    caches_to_clear = [cache, caches["shared"]] if uses_db else [cache]
+    for c in caches_to_clear:
+        c.clear()
+    revocation_filter.reset()
+    get_converter.cache_clear()
+    yield
+    for c in caches_to_clear:
+        c.clear()
+    revocation_filter.reset()
+    get_converter.cache_clear()
+
+
 @pytest.fixture
 def api_client():
     return APIClient()
@@ -122,3 +264,25 @@ def payment_code(application, territory):
         created=datetime.now(),
         modified=datetime.now(),
     )
+
+
+@pytest.fixture
+def make_codes():
+    """
+    Create ``count`` codes of an application in a territory, numbered from
+    2000 + ``start``.
+    """
+
+    def make(application, territory, count, code_status=PaymentCode.CHECKING, start=0):
+        return [
+            PaymentCode.objects.create(
+                application=application,
+                territory=territory,
+                number=str(2000 + start + i),
+                code_status=code_status,
+                date=application.date,
+            )
+            for i in range(count)
+        ]
+
+    return make
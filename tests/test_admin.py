@@ -0,0 +1,102 @@
+import pytest
+from django.contrib import admin
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from payment_codes.admin import ApplicationAdmin, PaymentCodeAdmin, estimated_count
+from payment_codes.models import Application, PaymentCode, Territory
+
+pytestmark = pytest.mark.django_db
+
+CHANGELIST = "admin:payment_codes_paymentcode_changelist"
+
+
+@pytest.fixture
+def spread_codes(make_codes):
+    """
+    Create codes of an application, each in a territory of its own.
+    """
+
+    def make(application, count, start=0):
+        territories = Territory.objects.bulk_create(
+            Territory(name=f"Admin Territory {start + i}") for i in range(count)
+        )
+        return [
+            code
+            for i, territory in enumerate(territories)
+            for code in make_codes(application, territory, 1, start=start + i)
+        ]
+
+    return make
+
+
+def count_queries(sql_fragment, queries):
+    return sum(sql_fragment in q["sql"] for q in queries)
+
+
+class TestLargeTableAdmin:
+    @pytest.mark.parametrize(
+        "model_admin, model",
+        [(PaymentCodeAdmin, PaymentCode), (ApplicationAdmin, Application)],
+    )
+    def test_admin_checks_pass(self, model_admin, model):
+        """Test that the autocomplete fields point at searchable admins"""
+        assert model_admin(model, admin.site).check() == []
+
+    def test_changelist_does_not_grow_with_rows(
+        self, admin_client, application, spread_codes
+    ):
+        """Test that territories are joined rather than fetched per row"""
+        spread_codes(application, 3)
+        admin_client.get(reverse(CHANGELIST))  # warm the filter cache
+        with CaptureQueriesContext(connection) as few:
+            assert admin_client.get(reverse(CHANGELIST)).status_code == 200
+
+        spread_codes(application, 30, start=3)
+        with CaptureQueriesContext(connection) as many:
+            assert admin_client.get(reverse(CHANGELIST)).status_code == 200
+
+        assert len(many.captured_queries) == len(few.captured_queries)
+
+    def test_unfiltered_count_is_estimated(
+        self, admin_client, application, territory, settings, make_codes
+    ):
+        """Test that large unfiltered lists read the count from pg_class"""
+        make_codes(application, territory, 5)
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE payment_code")
+        assert estimated_count(PaymentCode) == 5
+        settings.ADMIN_ESTIMATED_COUNT_THRESHOLD = 1
+
+        with CaptureQueriesContext(connection) as captured:
+            response = admin_client.get(reverse(CHANGELIST))
+
+        assert response.context["cl"].result_count == 5
+        assert count_queries("COUNT(*)", captured.captured_queries) == 0
+
+    def test_filtered_count_is_exact(
+        self, admin_client, application, territory, settings, make_codes
+    ):
+        """Test that filtered lists still count the matching rows"""
+        make_codes(application, territory, 5)
+        PaymentCode.objects.filter(number="2000").update(code_status=PaymentCode.USED)
+        settings.ADMIN_ESTIMATED_COUNT_THRESHOLD = 1
+
+        response = admin_client.get(
+            reverse(CHANGELIST), {"code_status__exact": PaymentCode.USED}
+        )
+
+        assert response.context["cl"].result_count == 1
+
+    def test_filter_choices_are_cached(self, admin_client, application, spread_codes):
+        """Test that the territory filter does not list territories on every view"""
+        spread_codes(application, 3)
+        admin_client.get(reverse(CHANGELIST))
+
+        with CaptureQueriesContext(connection) as captured:
+            response = admin_client.get(reverse(CHANGELIST))
+
+        assert count_queries('FROM "territory"', captured.captured_queries) == 0
+        territory_filter = response.context["cl"].filter_specs[1]
+        assert len(territory_filter.lookup_choices) == Territory.objects.count()
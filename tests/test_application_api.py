@@ -2,11 +2,11 @@ from datetime import date
 from unittest.mock import patch
 
 import pytest
-from django.urls import reverse
+from django.urls import reverse, reverse_lazy
 from django.utils import timezone
 from rest_framework import status
 
-from payment_codes.models import Application
+from payment_codes.models import Application, BulkJob, Territory
 
 pytestmark = pytest.mark.django_db
 
@@ -212,3 +212,200 @@ class TestApplicationUpdateAPI:
         assert len(response.data["territories"]) == application.territories.count()
         assert len(response.data["codes"]) == 1
         assert response.data["codes"][0]["number"] == payment_code.number
+
+
+@pytest.fixture
+def applications(application, counterparty, territory):
+    others = [
+        Application.objects.create(
+            number=f"BATCH{i}", forwarder=counterparty, departure_code="MSK"
+        )
+        for i in range(2)
+    ]
+    for other in others:
+        other.territories.add(territory)
+    return [application, *others]
+
+
+class TestApplicationBatchUpdateAPI:
+    url = reverse_lazy("application-batch-update")
+
+    @pytest.fixture(autouse=True)
+    def scheduled(self):
+        with patch("payment_codes.jobs.schedule") as schedule:
+            yield schedule
+
+    def test_batch_update(self, authenticated_client, applications):
+        """Test that every listed application gets its own changes"""
+        payload = [
+            {"id": app.id, "departure_code": "MOW", "cargo": f"Cargo {i}"}
+            for i, app in enumerate(applications)
+        ]
+
+        response = authenticated_client.patch(self.url, payload, format="json")
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data["updated"] == sorted(app.id for app in applications)
+        for i, app in enumerate(applications):
+            app.refresh_from_db()
+            assert app.departure_code == "MOW"
+            assert app.cargo == f"Cargo {i}"
+        job = BulkJob.objects.get(pk=response.data["regeneration_job"])
+        assert job.kind == BulkJob.REGENERATE
+        assert job.object_ids == response.data["updated"]
+
+    def test_unchanged_rows_are_not_regenerated(
+        self, authenticated_client, applications
+    ):
+        """Test that rows sent with their current values are left alone"""
+        first, second, _ = applications
+        payload = [
+            {"id": first.id, "departure_code": "MOW"},
+            {"id": second.id, "departure_code": second.departure_code},
+        ]
+
+        response = authenticated_client.patch(self.url, payload, format="json")
+
+        assert response.data["updated"] == [first.id]
+        job = BulkJob.objects.get(pk=response.data["regeneration_job"])
+        assert job.object_ids == [first.id]
+
+    def test_nothing_changed(self, authenticated_client, application):
+        """Test that a no-op batch queues no regeneration"""
+        payload = [{"id": application.id, "cargo": application.cargo}]
+
+        response = authenticated_client.patch(self.url, payload, format="json")
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data == {"updated": [], "regeneration_job": None}
+        assert not BulkJob.objects.exists()
+
+    def test_territories_and_counters(self, authenticated_client, applications):
+        """Test that replaced territories are recounted"""
+        first, second, _ = applications
+        extra = Territory.objects.create(name="Extra Territory")
+        territory_ids = [extra.id, *first.territories.values_list("id", flat=True)]
+        payload = [
+            {"id": first.id, "territories": territory_ids},
+            {"id": second.id, "territories": [extra.id]},
+        ]
+
+        response = authenticated_client.patch(self.url, payload, format="json")
+
+        assert response.status_code == status.HTTP_200_OK
+        first.refresh_from_db()
+        second.refresh_from_db()
+        assert set(first.territories.values_list("id", flat=True)) == set(territory_ids)
+        assert first.territories_count == 2
+        assert list(second.territories.all()) == [extra]
+        assert second.territories_count == 1
+
+    def test_errors_are_aligned_with_the_input(
+        self, authenticated_client, applications
+    ):
+        """Test that one invalid row rejects the whole batch"""
+        first, second, _ = applications
+        payload = [
+            {"id": first.id, "cargo": "Changed"},
+            {"id": second.id, "forwarder": 99999, "quantity": "many"},
+        ]
+
+        response = authenticated_client.patch(self.url, payload, format="json")
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.data[0] == {}
+        assert set(response.data[1]) == {"forwarder", "quantity"}
+        first.refresh_from_db()
+        assert first.cargo != "Changed"
+
+    def test_duplicate_numbers(self, authenticated_client, applications):
+        """Test that two rows cannot take the same number"""
+        payload = [{"id": app.id, "number": "SAME"} for app in applications[:2]]
+
+        response = authenticated_client.patch(self.url, payload, format="json")
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.data[1] == {"number": ["Duplicate number in this batch."]}
+
+    def test_number_taken_outside_the_batch(self, authenticated_client, applications):
+        """Test that a row cannot take the number of another application"""
+        first, second, third = applications
+        payload = [{"id": first.id, "number": third.number}]
+
+        response = authenticated_client.patch(self.url, payload, format="json")
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert set(response.data[0]) == {"number"}
+
+    def test_number_kept_by_a_row_in_the_batch(
+        self, authenticated_client, applications
+    ):
+        """Test that a row cannot take a number another row keeps"""
+        first, second, _ = applications
+        payload = [
+            {"id": first.id, "number": second.number},
+            {"id": second.id, "cargo": "Kept number"},
+        ]
+
+        response = authenticated_client.patch(self.url, payload, format="json")
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.data == [
+            {"number": ["Duplicate number in this batch."]},
+            {},
+        ]
+
+    def test_blank_numbers_are_checked(self, authenticated_client, applications):
+        """Test that two rows cannot both clear their number"""
+        first, second, _ = applications
+        payload = [
+            {"id": first.id, "number": ""},
+            {"id": second.id, "number": ""},
+        ]
+
+        response = authenticated_client.patch(self.url, payload, format="json")
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.data == [
+            {"number": ["Duplicate number in this batch."]},
+            {"number": ["Duplicate number in this batch."]},
+        ]
+
+    def test_rows_can_swap_numbers(self, authenticated_client, applications):
+        """Test that two rows in one batch can exchange their numbers"""
+        first, second, _ = applications
+        numbers = first.number, second.number
+        payload = [
+            {"id": first.id, "number": numbers[1]},
+            {"id": second.id, "number": numbers[0]},
+        ]
+
+        response = authenticated_client.patch(self.url, payload, format="json")
+
+        assert response.status_code == status.HTTP_200_OK
+        first.refresh_from_db()
+        second.refresh_from_db()
+        assert (first.number, second.number) == (numbers[1], numbers[0])
+
+    @pytest.mark.parametrize(
+        "payload",
+        [
+            {"id": 1},
+            [],
+            [{"cargo": "No id"}],
+            [{"id": 99999, "cargo": "Missing"}],
+        ],
+    )
+    def test_invalid_batches(self, authenticated_client, payload):
+        """Test that malformed batches are rejected before any row is touched"""
+        response = authenticated_client.patch(self.url, payload, format="json")
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_batch_size_limit(self, authenticated_client, application, settings):
+        """Test that batches above the limit are rejected"""
+        settings.APPLICATION_BATCH_MAX_ITEMS = 1
+        payload = [{"id": application.id}, {"id": application.id + 1}]
+
+        response = authenticated_client.patch(self.url, payload, format="json")
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
@@ -0,0 +1,93 @@
+from datetime import timedelta
+
+import pytest
+from django.core.management import call_command
+from django.db import connection
+from django.utils import timezone
+
+from payment_codes.archive import archive_codes, months_ago, partition_name
+from payment_codes.counters import reconcile
+from payment_codes.models import ArchivedPaymentCode, PaymentCode
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def aged_codes(application, territory):
+    """Codes created two years ago in every status"""
+    created = timezone.now() - timedelta(days=730)
+    codes = PaymentCode.objects.bulk_create(
+        PaymentCode(
+            application=application,
+            territory=territory,
+            number=str(3000 + i),
+            code_status=code_status,
+        )
+        for i, code_status in enumerate(
+            [
+                PaymentCode.COMPLETED,
+                PaymentCode.COMPLETED,
+                PaymentCode.CANCELED,
+                PaymentCode.USED,
+            ]
+        )
+    )
+    PaymentCode.objects.filter(pk__in=[code.pk for code in codes]).update(
+        created=created, modified=created
+    )
+    call_command("reconcile_counters")
+    return codes
+
+
+class TestArchiveCodes:
+    def test_months_ago(self):
+        """Test that the cutoff lands on the first of the month"""
+        now = timezone.now().replace(year=2025, month=2, day=17)
+        assert months_ago(3, now=now).date().isoformat() == "2024-11-01"
+
+    def test_closed_codes_are_moved(self, application, aged_codes):
+        """Test that old Completed and Canceled codes move and the rest stay"""
+        fresh = PaymentCode.objects.create(
+            application=application,
+            number="9999",
+            code_status=PaymentCode.COMPLETED,
+        )
+
+        batches = list(archive_codes(months_ago(12), batch_size=2))
+
+        assert batches == [2, 1]
+        assert set(PaymentCode.objects.values_list("number", flat=True)) == {
+            "3003",
+            fresh.number,
+        }
+        assert ArchivedPaymentCode.objects.filter(application=application).count() == 3
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT 1 FROM pg_class WHERE relname = %s",
+                [partition_name(timezone.now().year - 2)],
+            )
+            assert cursor.fetchone()
+
+    def test_archived_codes_keep_counting(self, application, aged_codes):
+        """Test that the counters and reconcile still see archived codes"""
+        call_command("archive_codes", older_than_months=12)
+
+        application.refresh_from_db()
+        assert application.codes_count == 4
+        assert application.completed_codes_count == 2
+        assert reconcile(dry_run=True) == 0
+
+    def test_dry_run(self, aged_codes):
+        """Test that a dry run moves nothing"""
+        call_command("archive_codes", dry_run=True)
+        assert PaymentCode.objects.count() == 4
+
+    def test_deleting_an_application_removes_archived_codes(
+        self, application, aged_codes
+    ):
+        """Test that archived codes cascade with their application"""
+        list(archive_codes(months_ago(12)))
+
+        application.delete()
+
+        assert not ArchivedPaymentCode.objects.exists()
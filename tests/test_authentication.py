@@ -0,0 +1,88 @@
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+
+from interrail_moscow_code.metrics import CACHE_REQUESTS
+from users.authentication import LazyTokenUser, user_is_active
+
+pytestmark = pytest.mark.django_db
+
+
+class TestCachedJWTAuthentication:
+    def test_user_row_is_not_loaded(self, authenticated_client, territory, user):
+        """Test that a warm request authenticates without touching users_customuser"""
+        user_is_active(user.pk)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = authenticated_client.get(
+                reverse("territory-detail", args=[territory.id])
+            )
+
+        assert response.status_code == status.HTTP_200_OK
+        assert not any("users_customuser" in q["sql"] for q in queries)
+
+    def test_active_state_is_cached(self, authenticated_client, user):
+        """Test that only the first request looks up is_active"""
+        before = CACHE_REQUESTS.value(cache="jwt_user", result="miss")
+
+        authenticated_client.get(reverse("territory-list"))
+        authenticated_client.get(reverse("territory-list"))
+
+        assert CACHE_REQUESTS.value(cache="jwt_user", result="miss") == before + 1
+
+    def test_deactivated_user_is_rejected(self, authenticated_client, user):
+        """Test that deactivation drops the cached flag and locks the user out"""
+        assert user_is_active(user.pk)
+
+        user.is_active = False
+        user.save()
+
+        response = authenticated_client.get(reverse("territory-list"))
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+    def test_deleted_user_is_rejected(self, authenticated_client, user):
+        """Test that tokens of deleted users stop working"""
+        user.delete()
+
+        response = authenticated_client.get(reverse("territory-list"))
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+    def test_application_manager_is_set_from_the_token(
+        self, authenticated_client, user, territory, counterparty, monkeypatch
+    ):
+        """Test that the manager is assigned by id without loading the user"""
+        monkeypatch.setattr(
+            "payment_codes.views.generate_application_document",
+            lambda application: "applications/test.pdf",
+        )
+        payload = {
+            "number": "LAZY001",
+            "quantity": 1,
+            "territories": [territory.id],
+            "forwarder": counterparty.id,
+        }
+
+        response = authenticated_client.post(
+            reverse("application-create"), payload, format="json"
+        )
+
+        assert response.status_code == status.HTTP_201_CREATED
+        assert response.data["manager"] == user.id
+
+
+class TestLazyTokenUser:
+    def test_fields_are_loaded_on_demand(self, user, access_token):
+        """Test that model fields come from the row, loaded once"""
+        token_user = LazyTokenUser(access_token)
+
+        with CaptureQueriesContext(connection) as queries:
+            assert token_user.pk == user.pk
+            assert token_user.is_authenticated
+        assert len(queries) == 0
+
+        with CaptureQueriesContext(connection) as queries:
+            assert token_user.email == user.email
+            assert token_user.username == user.username
+        assert len(queries) == 1
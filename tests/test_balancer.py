@@ -0,0 +1,201 @@
+from unittest.mock import Mock, patch
+
+import pytest
+import requests
+
+from interrail_moscow_code.balancer import EndpointBalancer
+from interrail_moscow_code.metrics import REGISTRY
+from payment_codes.converters import HttpConverter, is_converter_failure
+
+URLS = ["http://a", "http://b", "http://c"]
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_balancer(clock=None, **kwargs):
+    return EndpointBalancer(
+        "test",
+        URLS,
+        eject_after=2,
+        eject_seconds=10,
+        max_eject_seconds=30,
+        clock=clock or Clock(),
+        **kwargs,
+    )
+
+
+def settle(balancer, url, elapsed):
+    endpoint = next(e for e in balancer.endpoints if e.url == url)
+    endpoint.outstanding += 1
+    balancer.release(endpoint, elapsed, failed=False)
+
+
+def fail(balancer, url, times=1):
+    for _ in range(times):
+        with pytest.raises(ValueError):
+            with balancer.lease(exclude=[u for u in URLS if u != url]):
+                raise ValueError()
+
+
+class TestEndpointBalancer:
+    def test_prefers_the_fastest_endpoint(self):
+        """Test that the endpoint with the lowest latency average is picked"""
+        balancer = make_balancer()
+        for url, elapsed in zip(URLS, [0.5, 0.1, 0.3]):
+            settle(balancer, url, elapsed)
+
+        assert balancer.pick().url == "http://b"
+
+    def test_outstanding_requests_spread_the_load(self):
+        """Test that a busy fast endpoint loses to an idle slower one"""
+        balancer = make_balancer()
+        for url, elapsed in zip(URLS, [0.1, 0.15, 1.0]):
+            settle(balancer, url, elapsed)
+
+        picked = [balancer.pick().url for _ in range(3)]
+
+        assert picked == ["http://a", "http://b", "http://a"]
+
+    def test_unsampled_endpoints_are_tried_first(self):
+        """Test that a newly added endpoint gets traffic straight away"""
+        balancer = make_balancer()
+        settle(balancer, "http://a", 0.1)
+        settle(balancer, "http://b", 0.1)
+
+        assert balancer.pick().url == "http://c"
+
+    def test_consecutive_failures_eject(self):
+        """Test that an endpoint is skipped after repeated failures"""
+        clock = Clock()
+        balancer = make_balancer(clock)
+
+        fail(balancer, "http://a", times=2)
+
+        assert {balancer.pick().url for _ in range(20)} == {"http://b", "http://c"}
+        assert [s["up"] for s in balancer.stats()] == [False, True, True]
+
+    def test_ejected_endpoint_is_readmitted(self):
+        """Test that an ejected endpoint is back after its ejection time"""
+        clock = Clock()
+        balancer = make_balancer(clock)
+        fail(balancer, "http://a", times=2)
+
+        clock.now = 10
+
+        assert balancer.stats()[0]["up"]
+        assert balancer.pick(exclude=["http://b", "http://c"]).url == "http://a"
+
+    def test_repeated_ejections_back_off(self):
+        """Test that the ejection doubles each time, up to the maximum"""
+        clock = Clock()
+        balancer = make_balancer(clock)
+        endpoint = balancer.endpoints[0]
+
+        durations = []
+        for _ in range(3):
+            fail(balancer, "http://a", times=2)
+            durations.append(endpoint.ejected_until - clock.now)
+            clock.now = endpoint.ejected_until
+
+        assert durations == [10, 20, 30]
+
+    def test_success_resets_the_failures(self):
+        """Test that only failures in a row count towards ejection"""
+        balancer = make_balancer()
+        fail(balancer, "http://a")
+        settle(balancer, "http://a", 0.1)
+        fail(balancer, "http://a")
+
+        assert balancer.stats()[0]["up"]
+
+    def test_client_errors_do_not_count(self):
+        """Test that errors the predicate dismisses leave the endpoint healthy"""
+        balancer = make_balancer(is_failure=lambda exc: False)
+        fail(balancer, "http://a", times=5)
+
+        assert balancer.stats()[0]["up"]
+
+    def test_all_ejected_falls_back_to_the_soonest(self):
+        """Test that a request is still sent when every endpoint is ejected"""
+        clock = Clock()
+        balancer = make_balancer(clock)
+        for url in ["http://b", "http://a", "http://c"]:
+            fail(balancer, url, times=2)
+            clock.now += 1
+
+        assert balancer.pick().url == "http://b"
+
+    def test_stats_are_exported(self):
+        """Test that per-endpoint state shows up in the metrics"""
+        balancer = make_balancer()
+        settle(balancer, "http://a", 0.25)
+
+        exposition = REGISTRY.render()
+
+        assert (
+            'upstream_endpoint_latency_ewma_seconds{upstream="test",endpoint="http://a"} 0.25'
+            in exposition
+        )
+        assert (
+            'upstream_endpoint_up{upstream="test",endpoint="http://c"} 1' in exposition
+        )
+
+
+class TestHttpConverter:
+    @pytest.fixture
+    def docx(self, tmp_path):
+        path = tmp_path / "application.docx"
+        path.write_bytes(b"docx")
+        return str(path)
+
+    @pytest.fixture
+    def converter(self, settings):
+        settings.DOC_TO_PDF_CONVERTER_URLS = URLS
+        return HttpConverter()
+
+    @patch("payment_codes.converters.requests.post")
+    def test_unreachable_converter_is_skipped(self, mock_post, docx, converter):
+        """Test that a refused connection is retried on another converter"""
+        response = Mock(status_code=200)
+        mock_post.side_effect = [requests.ConnectionError("refused"), response]
+
+        assert converter.post(docx, timeout=1) is response
+
+        first, second = (call.args[0] for call in mock_post.call_args_list)
+        assert first != second
+        failed = next(e for e in converter.balancer.endpoints if e.url == first)
+        assert failed.failures == 1
+
+    @patch("payment_codes.converters.requests.post")
+    def test_gives_up_after_every_converter(self, mock_post, docx, converter):
+        """Test that each converter is tried once before the error is raised"""
+        mock_post.side_effect = requests.ConnectionError("refused")
+
+        with pytest.raises(requests.ConnectionError):
+            converter.post(docx, timeout=1)
+
+        assert sorted(call.args[0] for call in mock_post.call_args_list) == URLS
+
+    @patch("payment_codes.converters.requests.post")
+    def test_read_timeout_is_not_retried(self, mock_post, docx, converter):
+        """Test that a converter that may be working on it is not sent it twice"""
+        mock_post.side_effect = requests.ReadTimeout("slow")
+
+        with pytest.raises(requests.ReadTimeout):
+            converter.post(docx, timeout=1)
+
+        assert mock_post.call_count == 1
+
+    def test_rejected_document_is_not_a_converter_failure(self):
+        """Test that 4xx responses do not count against the converter"""
+        assert not is_converter_failure(
+            requests.HTTPError(response=Mock(status_code=400))
+        )
+        assert is_converter_failure(requests.HTTPError(response=Mock(status_code=503)))
+        assert is_converter_failure(requests.ConnectionError())
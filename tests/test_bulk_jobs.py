@@ -0,0 +1,314 @@
+from datetime import timedelta
+from unittest.mock import patch
+
+import pytest
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from payment_codes.counters import transition_codes
+from payment_codes.jobs import run_job, start_job
+from payment_codes.models import (
+    Application,
+    BulkJob,
+    PaymentCode,
+    Territory,
+    TerritoryCodeCounter,
+)
+from payment_codes.utils import build_application_contexts
+
+pytestmark = pytest.mark.django_db
+
+CHANGELIST = "admin:payment_codes_paymentcode_changelist"
+
+
+@pytest.fixture
+def codes(application, territory, make_codes):
+    return make_codes(application, territory, 5)
+
+
+@pytest.fixture
+def scheduled():
+    with patch("payment_codes.jobs.schedule") as schedule:
+        yield schedule
+
+
+def post_action(admin_client, action, codes, **extra):
+    return admin_client.post(
+        reverse(CHANGELIST),
+        {"action": action, "_selected_action": [c.pk for c in codes], **extra},
+    )
+
+
+class TestBulkJobActions:
+    def test_stock_delete_action_is_replaced(self, admin_client, codes):
+        """Test that deleting from the changelist does not load the selection"""
+        response = admin_client.get(reverse(CHANGELIST))
+        actions = dict(response.context["action_form"].fields["action"].choices)
+        assert "delete_selected" not in actions
+        assert "delete_in_background" in actions
+
+    def test_status_action_starts_a_job(
+        self, admin_client, django_capture_on_commit_callbacks, scheduled, codes
+    ):
+        """Test that the action only snapshots the selection and schedules a job"""
+        with django_capture_on_commit_callbacks(execute=True):
+            response = post_action(admin_client, "mark_completed", codes)
+
+        assert response.status_code == 302
+        job = BulkJob.objects.get()
+        assert job.kind == BulkJob.TRANSITION
+        assert job.params == {"status": PaymentCode.COMPLETED}
+        assert job.object_ids == sorted(c.pk for c in codes)
+        assert job.status == BulkJob.PENDING
+        scheduled.assert_called_once_with(job.pk)
+        assert not PaymentCode.objects.filter(code_status=PaymentCode.COMPLETED)
+
+    def test_reassign_asks_for_a_territory(
+        self, admin_client, django_capture_on_commit_callbacks, scheduled, codes
+    ):
+        """Test that reassigning shows a form first and then starts a job"""
+        target = Territory.objects.create(name="Target Territory")
+
+        response = post_action(admin_client, "reassign_territory", codes)
+        assert response.status_code == 200
+        assert response.context["count"] == len(codes)
+        assert not BulkJob.objects.exists()
+
+        with django_capture_on_commit_callbacks(execute=True):
+            response = post_action(
+                admin_client,
+                "reassign_territory",
+                codes,
+                territory=target.pk,
+                apply="Reassign",
+            )
+        assert response.status_code == 302
+        job = BulkJob.objects.get()
+        assert job.params == {"territory_id": target.pk}
+
+        run_job(job.pk)
+        assert PaymentCode.objects.filter(territory=target).count() == len(codes)
+
+    def test_job_progress_page(self, admin_client, codes, scheduled):
+        """Test that a job shows how far it got"""
+        job = start_job(BulkJob.DELETE, PaymentCode.objects.all())
+        BulkJob.objects.filter(pk=job.pk).update(processed=2)
+
+        response = admin_client.get(
+            reverse("admin:payment_codes_bulkjob_change", args=[job.pk])
+        )
+
+        assert response.status_code == 200
+        assert "2/5 (40%)" in response.content.decode()
+
+
+class TestRunJob:
+    def test_transition_runs_in_chunks(self, application, codes, scheduled, settings):
+        """Test that each chunk is one set-based UPDATE and counters follow"""
+        settings.BULK_JOB_CHUNK_SIZE = 2
+        job = start_job(
+            BulkJob.TRANSITION,
+            PaymentCode.objects.all(),
+            {"status": PaymentCode.COMPLETED},
+        )
+
+        with CaptureQueriesContext(connection) as captured:
+            job = run_job(job.pk)
+
+        assert job.status == BulkJob.DONE
+        assert job.processed == 5
+        code_updates = [
+            q
+            for q in captured.captured_queries
+            if q["sql"].startswith('UPDATE "payment_code"')
+        ]
+        assert len(code_updates) == 3
+        application.refresh_from_db()
+        assert application.completed_codes_count == 5
+        assert application.checking_codes_count == 0
+
+    def test_interrupted_job_resumes(self, application, codes, scheduled, settings):
+        """Test that a job skips the chunks it already recorded"""
+        settings.BULK_JOB_CHUNK_SIZE = 2
+        job = start_job(
+            BulkJob.TRANSITION, PaymentCode.objects.all(), {"status": PaymentCode.USED}
+        )
+        BulkJob.objects.filter(pk=job.pk).update(
+            status=BulkJob.RUNNING,
+            processed=2,
+            modified=timezone.now() - timedelta(hours=1),
+        )
+
+        call_command("run_bulk_jobs", stale_minutes=10)
+
+        job.refresh_from_db()
+        assert job.status == BulkJob.DONE
+        assert job.processed == 5
+        assert PaymentCode.objects.filter(code_status=PaymentCode.USED).count() == 3
+
+    def test_running_job_is_not_run_twice(self, codes, scheduled):
+        """Test that a job making progress elsewhere cannot be claimed again"""
+        job = start_job(
+            BulkJob.TRANSITION, PaymentCode.objects.all(), {"status": PaymentCode.USED}
+        )
+        BulkJob.objects.filter(pk=job.pk).update(status=BulkJob.RUNNING)
+
+        assert run_job(job.pk, stale_after=timedelta(minutes=10)) is None
+        assert run_job(job.pk, stale_after=timedelta(0)).status == BulkJob.DONE
+        assert run_job(job.pk) is None
+        assert PaymentCode.objects.filter(code_status=PaymentCode.USED).count() == 5
+
+    def test_delete_keeps_counters(self, application, codes, scheduled, settings):
+        """Test that each chunk is one DELETE and one counter update"""
+        settings.BULK_JOB_CHUNK_SIZE = 2
+        transition_codes(PaymentCode.objects.filter(pk=codes[0].pk), PaymentCode.USED)
+        job = start_job(BulkJob.DELETE, PaymentCode.objects.all())
+
+        with CaptureQueriesContext(connection) as captured:
+            run_job(job.pk)
+
+        assert not PaymentCode.objects.exists()
+        application.refresh_from_db()
+        assert application.codes_count == 0
+        assert application.checking_codes_count == 0
+        assert application.used_codes_count == 0
+        deletes = [
+            q
+            for q in captured.captured_queries
+            if q["sql"].lstrip().startswith("DELETE")
+        ]
+        counter_updates = [
+            q
+            for q in captured.captured_queries
+            if q["sql"].startswith('UPDATE "application"')
+        ]
+        assert len(deletes) == len(counter_updates) == 3
+
+    def test_reassign_skips_taken_numbers(
+        self, application, codes, scheduled, make_codes
+    ):
+        """Test that codes whose number is taken in the target stay where they are"""
+        target = Territory.objects.create(name="Target Territory")
+        make_codes(application, target, 2, start=1)
+        job = start_job(
+            BulkJob.REASSIGN,
+            PaymentCode.objects.filter(pk__in=[c.pk for c in codes]),
+            params={"territory_id": target.pk},
+        )
+
+        job = run_job(job.pk)
+
+        assert job.status == BulkJob.DONE
+        assert job.failed == 2
+        left = PaymentCode.objects.filter(pk__in=[c.pk for c in codes]).exclude(
+            territory=target
+        )
+        assert sorted(left.values_list("number", flat=True)) == ["2001", "2002"]
+        assert PaymentCode.objects.filter(territory=target).count() == 5
+        assert TerritoryCodeCounter.objects.get(territory=target).next_number == 2005
+
+    @patch("payment_codes.jobs.generate_application_document")
+    def test_regenerate_counts_failures(
+        self, mock_generate_doc, application, counterparty, scheduled
+    ):
+        """Test that one failing document does not stop the others"""
+        other = Application.objects.create(number="TEST002", forwarder=counterparty)
+        mock_generate_doc.side_effect = [
+            "applications/first.pdf",
+            RuntimeError("converter down"),
+        ]
+        job = start_job(BulkJob.REGENERATE, Application.objects.all())
+
+        job = run_job(job.pk)
+
+        assert job.status == BulkJob.DONE
+        assert (job.processed, job.failed) == (2, 1)
+        application.refresh_from_db()
+        other.refresh_from_db()
+        assert application.request_file.name == "applications/first.pdf"
+        assert not other.request_file
+
+    @patch("payment_codes.jobs.generate_application_document")
+    def test_regenerate_keeps_the_job_alive(
+        self, mock_generate_doc, application, counterparty, scheduled
+    ):
+        """Test that a slow document chunk records progress per document"""
+        Application.objects.create(number="TEST002", forwarder=counterparty)
+        job = start_job(BulkJob.REGENERATE, Application.objects.all())
+        an_hour_ago = timezone.now() - timedelta(hours=1)
+        seen = []
+
+        def generate(application, context):
+            seen.append(BulkJob.objects.get(pk=job.pk).modified > an_hour_ago)
+            # As if this conversion took an hour
+            BulkJob.objects.filter(pk=job.pk).update(modified=an_hour_ago)
+            return "applications/alive.pdf"
+
+        mock_generate_doc.side_effect = generate
+
+        run_job(job.pk)
+
+        assert seen == [True, True]
+
+    def test_failed_job_records_the_error(self, codes, scheduled):
+        """Test that an exception marks the job failed instead of leaving it running"""
+        job = start_job(
+            BulkJob.TRANSITION, PaymentCode.objects.all(), {"status": "Unknown"}
+        )
+
+        job = run_job(job.pk)
+
+        assert job.status == BulkJob.FAILED
+        assert job.error
+        assert job.finished is not None
+
+
+class TestDocumentContexts:
+    @pytest.fixture
+    def applications(self, territory, counterparty, user):
+        other = Territory.objects.create(name="Context Territory")
+        for i in range(5):
+            application = Application.objects.create(
+                number=f"CTX{i}",
+                forwarder=counterparty,
+                manager=user,
+                sending_type="block_train",
+            )
+            application.territories.set([territory, other])
+        # Fresh instances with nothing related cached
+        return list(Application.objects.filter(number__startswith="CTX"))
+
+    def test_batch_loads_relations_once(
+        self, applications, territory, counterparty, user, django_assert_num_queries
+    ):
+        """Test that a batch of contexts needs one query per relation"""
+        with django_assert_num_queries(3):
+            contexts = build_application_contexts(applications)
+
+        assert set(contexts) == {a.pk for a in applications}
+        context = contexts[applications[0].pk]
+        assert context["sending_type"] == "КП"
+        assert context["forwarder"] == counterparty.name
+        assert context["manager"] == str(user)
+        assert set(context["territories"].split(", ")) == {
+            territory.name,
+            "Context Territory",
+        }
+
+    @patch("payment_codes.jobs.generate_application_document")
+    def test_regenerate_passes_batched_contexts(
+        self, mock_generate_doc, applications, scheduled
+    ):
+        """Test that regeneration builds the contexts of a chunk up front"""
+        mock_generate_doc.return_value = "applications/batch.pdf"
+        job = start_job(BulkJob.REGENERATE, Application.objects.all())
+
+        run_job(job.pk)
+
+        for call in mock_generate_doc.call_args_list:
+            application, context = call.args
+            assert context["order_number"] == application.number
+        assert mock_generate_doc.call_count == len(applications)
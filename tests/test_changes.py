@@ -0,0 +1,187 @@
+from datetime import timedelta
+from io import StringIO
+
+import pytest
+from django.core.management import call_command
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+
+from payment_codes.changes import encode_cursor
+from payment_codes.counters import transition_codes
+from payment_codes.models import PaymentCode, Tombstone
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture(autouse=True)
+def no_clock_skew(settings):
+    # Everything written by the test itself is final
+    settings.CHANGE_FEED_CLOCK_SKEW_SECONDS = 0
+
+
+def sync(client, name, since=None, **params):
+    if since:
+        params["since"] = since
+    return client.get(reverse(name), params)
+
+
+class TestApplicationChanges:
+    def test_lists_created_applications(self, authenticated_client, application):
+        """Test that a first sync returns every application as created"""
+        response = sync(authenticated_client, "application-changes")
+
+        assert response.status_code == status.HTTP_200_OK
+        [change] = response.data["results"]
+        assert change["action"] == "created"
+        assert change["id"] == application.id
+        assert change["data"]["number"] == application.number
+        assert change["data"]["territories"] == list(
+            application.territories.values_list("id", flat=True)
+        )
+        assert not response.data["has_more"]
+
+    def test_only_changes_after_the_cursor(self, authenticated_client, application):
+        """Test that the next sync only returns what changed since"""
+        cursor = sync(authenticated_client, "application-changes").data["next"]
+
+        assert (
+            sync(authenticated_client, "application-changes", cursor).data["results"]
+            == []
+        )
+
+        application.cargo = "Timber"
+        application.save()
+        response = sync(authenticated_client, "application-changes", cursor)
+
+        [change] = response.data["results"]
+        assert change["action"] == "updated"
+        assert change["data"]["cargo"] == "Timber"
+
+    def test_empty_page_keeps_the_cursor(self, authenticated_client, application):
+        """Test that a sync without changes hands the same cursor back"""
+        cursor = sync(authenticated_client, "application-changes").data["next"]
+
+        response = sync(authenticated_client, "application-changes", cursor)
+
+        assert response.data["next"] == cursor
+
+    def test_deleted_application_is_reported(
+        self, authenticated_client, application, territory, make_codes
+    ):
+        """Test that deleting an application leaves tombstones for it and its codes"""
+        codes = make_codes(application, territory, 2)
+        cursor = sync(authenticated_client, "application-changes").data["next"]
+        code_cursor = sync(authenticated_client, "code-changes").data["next"]
+        application_id = application.id
+
+        application.delete()
+
+        response = sync(authenticated_client, "application-changes", cursor)
+        assert response.data["results"] == [
+            {
+                "action": "deleted",
+                "id": application_id,
+                "timestamp": response.data["results"][0]["timestamp"],
+                "data": None,
+            }
+        ]
+        response = sync(authenticated_client, "code-changes", code_cursor)
+        assert [(c["action"], c["id"]) for c in response.data["results"]] == [
+            ("deleted", code.id) for code in codes
+        ]
+
+    def test_pages_through_all_changes(
+        self, authenticated_client, application, territory, make_codes
+    ):
+        """Test that following the cursors returns every change once, in order"""
+        codes = make_codes(application, territory, 5)
+        ids = [code.id for code in codes]
+        codes[1].delete()
+
+        seen, cursor = [], None
+        while True:
+            response = sync(authenticated_client, "code-changes", cursor, limit=2)
+            page = response.data["results"]
+            assert len(page) <= 2
+            seen += [(c["action"], c["id"]) for c in page]
+            cursor = response.data["next"]
+            if not response.data["has_more"]:
+                break
+
+        assert seen == [("created", ids[i]) for i in (0, 2, 3, 4)] + [
+            ("deleted", ids[1])
+        ]
+
+    def test_invalid_cursor(self, authenticated_client):
+        """Test that a malformed cursor is rejected"""
+        response = sync(authenticated_client, "application-changes", "garbage")
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert "since" in response.data
+
+    def test_limit_is_capped(self, authenticated_client, settings):
+        """Test that a page larger than CHANGE_FEED_MAX_PAGE_SIZE is rejected"""
+        settings.CHANGE_FEED_MAX_PAGE_SIZE = 10
+
+        response = sync(authenticated_client, "application-changes", limit=11)
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert "limit" in response.data
+
+    def test_expired_cursor(self, authenticated_client, settings):
+        """Test that a cursor older than the tombstones kept needs a full resync"""
+        cursor = encode_cursor(
+            timezone.now() - timedelta(days=settings.CHANGE_FEED_RETENTION_DAYS + 1),
+            1,
+        )
+
+        response = sync(authenticated_client, "application-changes", cursor)
+
+        assert response.status_code == status.HTTP_410_GONE
+
+    def test_requires_authentication(self, api_client):
+        """Test that the feed is not readable anonymously"""
+        response = api_client.get(reverse("code-changes"))
+
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+class TestPaymentCodeChanges:
+    def test_set_based_transition_is_reported(
+        self, authenticated_client, application, territory, make_codes
+    ):
+        """Test that codes moved with one UPDATE show up as updated"""
+        codes = make_codes(application, territory, 3)
+        cursor = sync(authenticated_client, "code-changes").data["next"]
+
+        transition_codes(PaymentCode.objects.filter(pk=codes[0].pk), PaymentCode.USED)
+        response = sync(authenticated_client, "code-changes", cursor)
+
+        [change] = response.data["results"]
+        assert change["action"] == "updated"
+        assert change["id"] == codes[0].id
+        assert change["data"]["code_status"] == PaymentCode.USED
+
+
+class TestPurgeTombstones:
+    def test_purges_expired_tombstones(
+        self, application, territory, settings, make_codes
+    ):
+        """Test that only tombstones past the retention are deleted"""
+        old, recent = [code.id for code in make_codes(application, territory, 2)]
+        PaymentCode.objects.all().delete()
+        Tombstone.objects.filter(object_id=old).update(
+            deleted=timezone.now()
+            - timedelta(days=settings.CHANGE_FEED_RETENTION_DAYS + 1)
+        )
+        out = StringIO()
+
+        call_command("purge_tombstones", "--batch-size", "1", stdout=out)
+
+        assert "Purged 1 tombstones" in out.getvalue()
+        assert list(
+            Tombstone.objects.filter(kind=Tombstone.PAYMENT_CODE).values_list(
+                "object_id", flat=True
+            )
+        ) == [recent]
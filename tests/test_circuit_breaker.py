@@ -0,0 +1,273 @@
+from io import StringIO
+from unittest.mock import patch
+
+import pytest
+import requests
+from django.core.management import call_command
+from django.db import transaction
+from django.urls import reverse
+from rest_framework import status
+
+from interrail_moscow_code.circuit_breaker import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    CircuitBreaker,
+    CircuitOpenError,
+)
+from payment_codes.jobs import start_job
+from payment_codes.models import Application, BulkJob, Territory
+from payment_codes.utils import converter_breaker
+
+pytestmark = pytest.mark.django_db
+
+
+class ServiceDown(Exception):
+    def __init__(self, rejected=False):
+        self.rejected = rejected
+
+
+def make_breaker(reset_timeout=60):
+    return CircuitBreaker(
+        "test",
+        failure_threshold=2,
+        window=60,
+        reset_timeout=reset_timeout,
+        failures=(ServiceDown,),
+        is_failure=lambda exc: not exc.rejected,
+    )
+
+
+def call(breaker, fail=False, rejected=False):
+    with breaker.guard():
+        if fail or rejected:
+            raise ServiceDown(rejected)
+        return "ok"
+
+
+class TestCircuitBreaker:
+    def test_opens_after_repeated_failures(self):
+        """Test that the threshold of failures opens the circuit"""
+        breaker = make_breaker()
+
+        with pytest.raises(ServiceDown):
+            call(breaker, fail=True)
+        assert breaker.state() == CLOSED
+        with pytest.raises(ServiceDown):
+            call(breaker, fail=True)
+
+        assert breaker.state() == OPEN
+        with pytest.raises(CircuitOpenError):
+            call(breaker)
+
+    def test_other_errors_do_not_count(self):
+        """Test that only the configured failures trip the circuit"""
+        breaker = make_breaker()
+        for _ in range(3):
+            with pytest.raises(KeyError), breaker.guard():
+                raise KeyError()
+        assert breaker.state() == CLOSED
+
+    def test_rejections_do_not_count(self):
+        """Test that errors the predicate dismisses leave the circuit closed"""
+        breaker = make_breaker()
+        for _ in range(3):
+            with pytest.raises(ServiceDown):
+                call(breaker, rejected=True)
+        assert breaker.state() == CLOSED
+
+    def test_rejected_probe_closes_the_circuit(self):
+        """Test that a probe the service answers with a rejection closes the circuit"""
+        breaker = make_breaker(reset_timeout=0)
+        breaker.open()
+
+        with pytest.raises(ServiceDown):
+            call(breaker, rejected=True)
+
+        assert breaker.state() == CLOSED
+
+    def test_probe_with_another_error_closes_the_circuit(self):
+        """Test that a probe raising an error that is no failure releases the probe"""
+        breaker = make_breaker(reset_timeout=0)
+        breaker.open()
+
+        with pytest.raises(KeyError), breaker.guard():
+            raise KeyError()
+
+        assert breaker.state() == CLOSED
+        assert call(breaker) == "ok"
+
+    def test_half_open_probe_closes_the_circuit(self):
+        """Test that one successful probe closes an expired open circuit"""
+        breaker = make_breaker(reset_timeout=0)
+        breaker.open()
+        assert breaker.state() == HALF_OPEN
+
+        assert call(breaker) == "ok"
+        assert breaker.state() == CLOSED
+
+    def test_only_one_probe_at_a_time(self):
+        """Test that other callers fail fast while a probe is running"""
+        breaker = make_breaker(reset_timeout=0)
+        breaker.open()
+
+        with breaker.guard():
+            with pytest.raises(CircuitOpenError):
+                call(breaker)
+
+    def test_failed_probe_reopens(self):
+        """Test that a failing probe opens the circuit again"""
+        breaker = make_breaker(reset_timeout=0)
+        breaker.open()
+
+        with pytest.raises(ServiceDown):
+            call(breaker, fail=True)
+
+        breaker.reset_timeout = 60
+        breaker.open()
+        assert breaker.state() == OPEN
+
+    def test_state_is_shared_between_instances(self):
+        """Test that a breaker in another worker sees the same circuit"""
+        make_breaker().open()
+        assert make_breaker().state() == OPEN
+
+    def test_failures_from_several_workers_add_up(self):
+        """Test that failures recorded by different breakers count together"""
+        make_breaker().record_failure()
+        assert make_breaker().state() == CLOSED
+
+        make_breaker().record_failure()
+
+        assert make_breaker().state() == OPEN
+
+    def test_state_survives_a_rollback(self):
+        """Test that the circuit is written outside the caller's transaction"""
+        breaker = make_breaker()
+
+        with pytest.raises(ServiceDown), transaction.atomic():
+            Territory.objects.create(name="Rolled back")
+            call(breaker, fail=True)
+        with pytest.raises(ServiceDown), transaction.atomic():
+            call(breaker, fail=True)
+
+        assert breaker.state() == OPEN
+        assert not Territory.objects.filter(name="Rolled back").exists()
+
+
+class TestDegradedApplicationCreate:
+    payload = {"number": "DEGRADED001", "quantity": 1}
+
+    def create(self, client, territory, counterparty, number):
+        return client.post(
+            reverse("application-create"),
+            {
+                **self.payload,
+                "number": number,
+                "territories": [territory.id],
+                "forwarder": counterparty.id,
+            },
+            format="json",
+        )
+
+    @patch("payment_codes.utils.DocxTemplate")
+    @patch("payment_codes.converters.requests.post")
+    def test_converter_outage(
+        self, mock_post, mock_template, authenticated_client, territory, counterparty
+    ):
+        """Test that an outage saves applications without PDFs and stops calling"""
+        mock_template.return_value.save.side_effect = lambda path: open(
+            path, "w"
+        ).close()
+        mock_post.side_effect = requests.ConnectionError("converter down")
+
+        responses = [
+            self.create(authenticated_client, territory, counterparty, f"DEG{i}")
+            for i in range(5)
+        ]
+
+        assert {r.status_code for r in responses} == {status.HTTP_201_CREATED}
+        assert all(r.data["document_pending"] for r in responses)
+        assert all(r.data["request_file"] is None for r in responses)
+        assert Application.objects.filter(document_pending=True).count() == 5
+        # Only the failures that opened the circuit waited on the converter
+        assert mock_post.call_count == converter_breaker.failure_threshold
+        assert converter_breaker.state() == OPEN
+
+    @patch("payment_codes.utils.DocxTemplate")
+    @patch("payment_codes.converters.requests.post")
+    def test_rejected_document(
+        self, mock_post, mock_template, authenticated_client, territory, counterparty
+    ):
+        """Test that a document the converter refuses fails the request, not the circuit"""
+        mock_template.return_value.save.side_effect = lambda path: open(
+            path, "w"
+        ).close()
+        rejection = requests.Response()
+        rejection.status_code = 422
+        mock_post.return_value = rejection
+
+        responses = [
+            self.create(authenticated_client, territory, counterparty, f"REJ{i}")
+            for i in range(converter_breaker.failure_threshold + 1)
+        ]
+
+        assert {r.status_code for r in responses} == {status.HTTP_400_BAD_REQUEST}
+        assert not Application.objects.filter(number__startswith="REJ").exists()
+        assert mock_post.call_count == converter_breaker.failure_threshold + 1
+        assert converter_breaker.state() == CLOSED
+
+    @patch("payment_codes.views.generate_application_document")
+    def test_other_errors_still_reject(
+        self, mock_generate_doc, authenticated_client, territory, counterparty
+    ):
+        """Test that a broken document is not mistaken for an outage"""
+        mock_generate_doc.side_effect = ValueError("bad template")
+
+        response = self.create(authenticated_client, territory, counterparty, "BAD1")
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert not Application.objects.filter(number="BAD1").exists()
+
+    @patch("payment_codes.jobs.generate_application_document")
+    def test_pending_documents_are_regenerated(self, mock_generate_doc, application):
+        """Test that pending PDFs are generated once the converter is back"""
+        mock_generate_doc.return_value = "applications/late.pdf"
+        Application.objects.filter(pk=application.pk).update(document_pending=True)
+
+        call_command("regenerate_pending_documents")
+
+        application.refresh_from_db()
+        assert not application.document_pending
+        assert application.request_file.name == "applications/late.pdf"
+
+    @patch("payment_codes.jobs.generate_application_document")
+    def test_regeneration_runs_once(self, mock_generate_doc, application):
+        """Test that a second run leaves a regeneration under way alone"""
+        Application.objects.filter(pk=application.pk).update(document_pending=True)
+        running = start_job(
+            BulkJob.REGENERATE,
+            Application.objects.all(),
+            {"pending_only": True},
+            background=False,
+        )
+        BulkJob.objects.filter(pk=running.pk).update(status=BulkJob.RUNNING)
+        out = StringIO()
+
+        call_command("regenerate_pending_documents", stdout=out)
+
+        assert "still regenerating" in out.getvalue()
+        mock_generate_doc.assert_not_called()
+        assert BulkJob.objects.get() == running
+
+    @patch("payment_codes.jobs.generate_application_document")
+    def test_regeneration_waits_for_the_circuit(self, mock_generate_doc, application):
+        """Test that nothing is attempted while the circuit is open"""
+        Application.objects.filter(pk=application.pk).update(document_pending=True)
+        converter_breaker.open()
+
+        call_command("regenerate_pending_documents")
+
+        mock_generate_doc.assert_not_called()
+        application.refresh_from_db()
+        assert application.document_pending
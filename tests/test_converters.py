@@ -0,0 +1,118 @@
+import os
+import sys
+import textwrap
+import threading
+
+import pytest
+
+from payment_codes.converters import (
+    ConverterTimeout,
+    ConverterUnavailable,
+    DocumentRejected,
+    LocalOfficeConverter,
+    get_converter,
+)
+
+FAKE_SOFFICE = f"""\
+#!{sys.executable}
+# Stands in for LibreOffice: sets up the profile and "converts" the document
+import os, sys, time
+from pathlib import Path
+from urllib.parse import urlparse
+
+args = sys.argv[1:]
+profile = urlparse(args[0].split("=", 1)[1]).path
+mode = os.environ.get("FAKE_SOFFICE_MODE", "")
+if mode == "hang":
+    time.sleep(30)
+if mode == "fail":
+    sys.exit("Error: source file could not be loaded")
+os.makedirs(profile, exist_ok=True)
+Path(profile, "runs").open("a").write("run\\n")
+source = Path(args[-1])
+outdir = Path(args[args.index("--outdir") + 1])
+(outdir / source.with_suffix(".pdf").name).write_bytes(b"%PDF " + source.read_bytes())
+"""
+
+
+@pytest.fixture
+def soffice(tmp_path, settings):
+    path = tmp_path / "soffice"
+    path.write_text(textwrap.dedent(FAKE_SOFFICE))
+    path.chmod(0o755)
+    settings.LIBREOFFICE_BINARY = str(path)
+    settings.CONVERTER_POOL_SIZE = 2
+    settings.CONVERTER_WORKER_MAX_JOBS = 3
+    settings.CONVERTER_BACKEND = "payment_codes.converters.LocalOfficeConverter"
+    return path
+
+
+@pytest.fixture
+def docx(tmp_path):
+    path = tmp_path / "application.docx"
+    path.write_bytes(b"docx")
+    return str(path)
+
+
+def profile_runs(worker):
+    with open(os.path.join(worker.profile, "runs")) as f:
+        return len(f.readlines())
+
+
+class TestLocalOfficeConverter:
+    def test_converts_document(self, soffice, docx):
+        """Test that the configured backend converts with LibreOffice"""
+        converter = get_converter()
+
+        assert isinstance(converter, LocalOfficeConverter)
+        assert converter.to_pdf(docx, timeout=10) == b"%PDF docx"
+
+    def test_profile_is_kept_then_recycled(self, soffice, docx):
+        """Test that a worker keeps its profile warm until it is recycled"""
+        converter = LocalOfficeConverter()
+        converter.workers.get()
+        worker = converter.workers.queue[0]
+
+        for _ in range(2):
+            converter.to_pdf(docx, timeout=10)
+        assert profile_runs(worker) == 2
+
+        converter.to_pdf(docx, timeout=10)
+        assert not os.path.exists(worker.profile)
+        assert worker.jobs == 0
+
+    def test_hung_conversion_is_killed(self, soffice, docx, monkeypatch):
+        """Test that a conversion past its timeout is killed and reported"""
+        monkeypatch.setenv("FAKE_SOFFICE_MODE", "hang")
+        converter = LocalOfficeConverter()
+
+        with pytest.raises(ConverterTimeout):
+            converter.to_pdf(docx, timeout=0.5)
+
+        assert converter.workers.qsize() == 2
+
+    def test_failed_conversion(self, soffice, docx, monkeypatch):
+        """Test that a failing LibreOffice run rejects the document with its error"""
+        monkeypatch.setenv("FAKE_SOFFICE_MODE", "fail")
+
+        with pytest.raises(DocumentRejected, match="could not be loaded"):
+            LocalOfficeConverter().to_pdf(docx, timeout=10)
+
+    def test_missing_binary(self, soffice, docx, settings):
+        """Test that a missing LibreOffice makes the converter unavailable"""
+        settings.LIBREOFFICE_BINARY = "/nonexistent/soffice"
+
+        with pytest.raises(ConverterUnavailable, match="Cannot run"):
+            LocalOfficeConverter().to_pdf(docx, timeout=10)
+
+    def test_pool_size_limits_concurrency(self, soffice, docx, settings):
+        """Test that requests beyond the pool size wait, then give up"""
+        settings.CONVERTER_POOL_SIZE = 1
+        converter = LocalOfficeConverter()
+        busy = converter.workers.get()
+
+        with pytest.raises(ConverterTimeout, match="No office worker"):
+            converter.to_pdf(docx, timeout=0.2)
+
+        threading.Timer(0.2, converter.workers.put, [busy]).start()
+        assert converter.to_pdf(docx, timeout=10) == b"%PDF docx"
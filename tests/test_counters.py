@@ -0,0 +1,133 @@
+import pytest
+from django.core.management import call_command
+from django.urls import reverse
+from rest_framework import status
+
+from payment_codes.counters import (
+    adjust_counters,
+    reconcile,
+    reserve_codes,
+    transition_codes,
+)
+from payment_codes.models import Application, PaymentCode, Territory
+
+pytestmark = pytest.mark.django_db
+
+
+class TestApplicationCounters:
+    def test_territory_links_are_counted(self, application, territory):
+        """Test that territories_count follows add, remove and clear from both sides"""
+        second = Territory.objects.create(name="Second Territory")
+        assert application.territories_count == 1
+
+        application.territories.add(second)
+        assert application.territories_count == 2
+
+        application.territories.remove(territory)
+        application.refresh_from_db()
+        assert application.territories_count == 1
+
+        second.ru_applications.clear()
+        application.refresh_from_db()
+        assert application.territories_count == 0
+
+        territory.ru_applications.add(application)
+        application.refresh_from_db()
+        assert application.territories_count == 1
+
+    def test_code_range_updates_counters(
+        self, authenticated_client, application, territory
+    ):
+        """Test that a created range is counted as Checking codes"""
+        url = reverse("code-range-create", args=[application.id])
+        payload = {
+            "start_range": "1001",
+            "end_range": "1003",
+            "territory_id": territory.id,
+        }
+
+        response = authenticated_client.post(url, payload)
+
+        assert response.status_code == status.HTTP_201_CREATED
+        application.refresh_from_db()
+        assert application.codes_count == 3
+        assert application.checking_codes_count == 3
+
+    def test_reserve_codes_enforces_the_quota(self, application):
+        """Test that the quota check and the increment happen in one UPDATE"""
+        # quantity 5 with one territory, a stale in-memory copy thinks nothing is used
+        adjust_counters(application.pk, codes_count=4)
+
+        assert reserve_codes(application, 2) is False
+        assert reserve_codes(application, 1) is True
+
+        application.refresh_from_db()
+        assert application.codes_count == 5
+        assert application.checking_codes_count == 1
+
+    def test_status_changes_and_deletes_are_counted(
+        self, application, territory, make_codes
+    ):
+        """Test that saving and deleting single codes keeps the status counters right"""
+        first, second = make_codes(application, territory, 2)
+
+        code = PaymentCode.objects.get(pk=first.pk)
+        code.code_status = PaymentCode.USED
+        code.save()
+        second.delete()
+
+        application.refresh_from_db()
+        assert application.codes_count == 1
+        assert application.checking_codes_count == 0
+        assert application.used_codes_count == 1
+
+    def test_transition_codes(self, application, territory, make_codes):
+        """Test that a set-based status change moves the counters in bulk"""
+        make_codes(application, territory, 3)
+        make_codes(application, territory, 1, code_status=PaymentCode.USED, start=3)
+
+        changed = transition_codes(
+            PaymentCode.objects.filter(application=application), PaymentCode.COMPLETED
+        )
+
+        assert changed == 4
+        application.refresh_from_db()
+        assert application.completed_codes_count == 4
+        assert application.checking_codes_count == 0
+        assert application.used_codes_count == 0
+        assert application.codes_count == 4
+
+    def test_saving_an_instance_keeps_concurrent_counter_updates(self, application):
+        """Test that a full save does not write back a stale copy of the counters"""
+        stale = Application.objects.get(pk=application.pk)
+        adjust_counters(application.pk, codes_count=5, checking_codes_count=5)
+
+        stale.cargo = "Updated cargo"
+        stale.save()
+
+        application.refresh_from_db()
+        assert application.cargo == "Updated cargo"
+        assert application.codes_count == 5
+
+    def test_deleting_an_application_with_codes(self, application, payment_code):
+        """Test that cascading code deletes do not trip over the counters"""
+        application.delete()
+        assert not PaymentCode.objects.exists()
+
+
+class TestReconcileCounters:
+    def test_reconcile_fixes_drift(self, application, territory):
+        """Test that reconcile recomputes counters that bulk writes bypassed"""
+        PaymentCode.objects.bulk_create(
+            PaymentCode(application=application, territory=territory, number=str(i))
+            for i in range(4)
+        )
+        assert reconcile(dry_run=True) == 1
+
+        call_command("reconcile_counters", batch_size=1)
+
+        application.refresh_from_db()
+        assert application.codes_count == 4
+        assert application.checking_codes_count == 4
+        assert application.territories_count == 1
+        assert reconcile(dry_run=True) == 0
@@ -0,0 +1,64 @@
+import pytest
+from django.db import connection
+from django.urls import reverse
+from rest_framework import status
+
+from interrail_moscow_code.metrics import DB_POOL_CONNECTIONS, DB_POOL_EVENTS, REGISTRY
+from payment_codes.models import Application
+
+pytestmark = pytest.mark.django_db
+
+options = connection.settings_dict["OPTIONS"]
+
+
+@pytest.mark.skipif(not options.get("pool"), reason="DB_POOL is off")
+class TestConnectionPool:
+    def test_connections_come_from_the_pool(self):
+        """Test that the default alias checks its connection out of a pool"""
+        connection.ensure_connection()
+        assert connection.pool is not None
+        assert connection.settings_dict["CONN_HEALTH_CHECKS"]
+        assert connection.pool.get_stats()["pool_max"] == options["pool"]["max_size"]
+
+    def test_pool_stats_are_rendered(self):
+        """Test that pool state is read into the registry on every scrape"""
+        connection.ensure_connection()
+        REGISTRY.clear()
+
+        rendered = REGISTRY.render()
+
+        assert 'db_pool_connections{alias="default",state="max"}' in rendered
+        assert DB_POOL_CONNECTIONS.value(alias="default", state="open") >= 1
+        assert DB_POOL_EVENTS.value(alias="default", event="connect_errors") == 0
+
+
+@pytest.mark.skipif(
+    not options.get("server_side_binding"), reason="DB_SERVER_SIDE_BINDING is off"
+)
+class TestPreparedStatements:
+    def test_repeated_queries_are_prepared(self):
+        """Test that a query run past the threshold becomes a prepared statement"""
+        with connection.cursor() as cursor:
+            for _ in range(options["prepare_threshold"] + 1):
+                cursor.execute("SELECT %s::int + 1", [1])
+            cursor.execute(
+                "SELECT COUNT(*) FROM pg_prepared_statements "
+                "WHERE statement LIKE 'SELECT $1::int + 1%%'"
+            )
+            assert cursor.fetchone()[0] == 1
+
+    def test_large_code_range(self, authenticated_client, application, territory):
+        """Test that a range needing more than 65535 bind parameters is batched"""
+        Application.objects.filter(pk=application.pk).update(quantity=5000)
+        payload = {
+            "start_range": "1",
+            "end_range": "5000",
+            "territory_id": territory.id,
+        }
+
+        response = authenticated_client.post(
+            reverse("code-range-create", args=[application.id]), payload
+        )
+
+        assert response.status_code == status.HTTP_201_CREATED
+        assert application.codes.count() == 5000
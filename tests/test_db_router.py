@@ -0,0 +1,158 @@
+from unittest.mock import patch
+
+import pytest
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, override_settings
+
+from interrail_moscow_code import db_router
+from interrail_moscow_code.db_router import (
+    SHARED_STATE_DB_ALIAS,
+    PrimaryReplicaRouter,
+    ReplicaLagMonitor,
+    use_primary,
+)
+from interrail_moscow_code.middleware import PrimaryPinningMiddleware
+from payment_codes.models import Territory
+
+WITHOUT_REPLICA = {
+    alias: settings.DATABASES[alias] for alias in ("default", SHARED_STATE_DB_ALIAS)
+}
+WITH_REPLICA = {
+    **WITHOUT_REPLICA,
+    "replica": {**settings.DATABASES["default"], "TEST": {"MIRROR": "default"}},
+}
+
+
+@pytest.fixture
+def router():
+    return PrimaryReplicaRouter()
+
+
+@pytest.fixture
+def healthy_replica():
+    with (
+        override_settings(DATABASES=WITH_REPLICA),
+        patch.object(db_router.lag_monitor, "healthy", return_value=True) as healthy,
+    ):
+        yield healthy
+
+
+class TestPrimaryReplicaRouter:
+    @override_settings(DATABASES=WITHOUT_REPLICA)
+    def test_without_replica(self, router):
+        """Test that the router stays out of the way without a replica"""
+        assert router.db_for_read(Territory) is None
+
+    def test_reads_go_to_the_replica(self, router, healthy_replica):
+        """Test that plain reads and all writes are split"""
+        assert router.db_for_read(Territory) == "replica"
+        assert router.db_for_write(Territory) == "default"
+
+    def test_pinned_reads_go_to_the_primary(self, router, healthy_replica):
+        """Test that use_primary overrides the replica"""
+        with use_primary():
+            assert router.db_for_read(Territory) == "default"
+        assert router.db_for_read(Territory) == "replica"
+
+    @pytest.mark.django_db
+    def test_reads_in_a_transaction_go_to_the_primary(self, router, healthy_replica):
+        """Test that a transaction reads its own writes"""
+        with transaction.atomic():
+            assert router.db_for_read(Territory) == "default"
+
+    def test_lagging_replica_is_bypassed(self, router, healthy_replica):
+        """Test that reads fall back to the primary when the replica lags"""
+        healthy_replica.return_value = False
+        assert router.db_for_read(Territory) == "default"
+
+    @pytest.mark.django_db(databases=["default", SHARED_STATE_DB_ALIAS])
+    def test_shared_cache_has_its_own_connection(self, router):
+        """Test that the cache table is used outside the request's transaction"""
+        cache_model = caches["shared"].cache_model_class
+
+        with transaction.atomic():
+            assert router.db_for_read(cache_model) == SHARED_STATE_DB_ALIAS
+            assert router.db_for_write(cache_model) == SHARED_STATE_DB_ALIAS
+        assert not router.allow_migrate(SHARED_STATE_DB_ALIAS, "payment_codes")
+
+    def test_migrations_only_run_on_the_primary(self, router):
+        """Test that the replica is never migrated"""
+        assert router.allow_migrate("default", "payment_codes")
+        assert not router.allow_migrate("replica", "payment_codes")
+
+
+class TestReplicaLagMonitor:
+    @override_settings(REPLICA_LAG_CHECK_SECONDS=60)
+    def test_checks_are_cached(self):
+        """Test that the lag is queried at most once per interval"""
+        monitor = ReplicaLagMonitor()
+        with patch.object(monitor, "check", return_value=False) as check:
+            assert monitor.healthy() is False
+            assert monitor.healthy() is False
+        assert check.call_count == 1
+
+    @pytest.mark.django_db
+    def test_primary_is_not_a_lagging_standby(self):
+        """Test the lag query against a server that is not in recovery"""
+        with patch.object(db_router, "REPLICA_DB_ALIAS", "default"):
+            assert ReplicaLagMonitor().check() is True
+
+
+class TestPrimaryPinningMiddleware:
+    def make_middleware(self, router, status=200):
+        seen = []
+
+        def get_response(request):
+            seen.append(router.db_for_read(Territory))
+            return HttpResponse(status=status)
+
+        return PrimaryPinningMiddleware(get_response), seen
+
+    def test_write_pins_the_client(self, router, healthy_replica):
+        """Test that a successful write runs on the primary and sets the pin"""
+        middleware, seen = self.make_middleware(router)
+
+        response = middleware(RequestFactory().post("/"))
+
+        assert seen == ["default"]
+        cookie = response.cookies[PrimaryPinningMiddleware.cookie_name]
+        assert cookie["max-age"] == settings.REPLICA_PIN_SECONDS
+
+    def test_pinned_client_reads_from_the_primary(self, router, healthy_replica):
+        """Test that reads after a write stay on the primary while pinned"""
+        middleware, seen = self.make_middleware(router)
+        factory = RequestFactory()
+
+        middleware(factory.get("/"))
+        factory.cookies[PrimaryPinningMiddleware.cookie_name] = "1"
+        middleware(factory.get("/"))
+
+        assert seen == ["replica", "default"]
+
+    @pytest.mark.django_db
+    def test_token_clients_are_pinned_by_user(
+        self, router, healthy_replica, access_token
+    ):
+        """Test that a bearer token client is pinned without relying on cookies"""
+        middleware, seen = self.make_middleware(router)
+        factory = RequestFactory(HTTP_AUTHORIZATION=f"Bearer {access_token}")
+
+        # The test transaction would otherwise keep every read on the primary
+        with patch.object(connections["default"], "in_atomic_block", False):
+            response = middleware(factory.post("/"))
+            middleware(factory.get("/"))
+            middleware(RequestFactory().get("/"))
+
+        assert PrimaryPinningMiddleware.cookie_name not in response.cookies
+        assert seen == ["default", "default", "replica"]
+
+    def test_failed_write_does_not_pin(self, router, healthy_replica):
+        """Test that rejected writes do not move the client to the primary"""
+        middleware, _ = self.make_middleware(router, status=400)
+
+        response = middleware(RequestFactory().post("/"))
+
+        assert PrimaryPinningMiddleware.cookie_name not in response.cookies
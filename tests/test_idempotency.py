@@ -0,0 +1,240 @@
+import threading
+from datetime import timedelta
+from unittest.mock import patch
+
+import pytest
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+
+from payment_codes.idempotency import REPLAYED_HEADER, request_fingerprint
+from payment_codes.models import Application, IdempotencyKey, PaymentCode
+
+KEY = "3f1c2a9e-retry"
+
+
+def create_range(client, application, territory, key=KEY, end="1003", start="1001"):
+    return client.post(
+        reverse("code-range-create", args=[application.id]),
+        {"start_range": start, "end_range": end, "territory_id": territory.id},
+        format="json",
+        HTTP_IDEMPOTENCY_KEY=key,
+    )
+
+
+@pytest.mark.django_db
+class TestIdempotencyKey:
+    @patch("payment_codes.views.generate_application_document")
+    def test_retried_create_is_replayed(
+        self, mock_generate_doc, authenticated_client, territory, counterparty
+    ):
+        """Test that a retry returns the stored response without a second run"""
+        mock_generate_doc.return_value = "applications/test.pdf"
+        payload = {
+            "number": "IDEM001",
+            "territories": [territory.id],
+            "forwarder": counterparty.id,
+        }
+
+        first, retry = (
+            authenticated_client.post(
+                reverse("application-create"),
+                payload,
+                format="json",
+                HTTP_IDEMPOTENCY_KEY=KEY,
+            )
+            for _ in range(2)
+        )
+
+        assert first.status_code == retry.status_code == status.HTTP_201_CREATED
+        assert retry.json() == first.json()
+        assert retry[REPLAYED_HEADER] == "true"
+        assert REPLAYED_HEADER not in first
+        assert mock_generate_doc.call_count == 1
+        assert Application.objects.filter(number="IDEM001").count() == 1
+
+    def test_retried_range_creates_codes_once(
+        self, authenticated_client, application, territory
+    ):
+        """Test that a retried range does not create duplicate codes"""
+        first = create_range(authenticated_client, application, territory)
+        retry = create_range(authenticated_client, application, territory)
+
+        assert first.status_code == retry.status_code == status.HTTP_201_CREATED
+        assert PaymentCode.objects.filter(application=application).count() == 3
+        application.refresh_from_db()
+        assert application.codes_count == 3
+
+    def test_key_reused_for_another_request(
+        self, authenticated_client, application, territory
+    ):
+        """Test that a key cannot be replayed for a different payload"""
+        create_range(authenticated_client, application, territory)
+
+        response = create_range(
+            authenticated_client, application, territory, end="1004"
+        )
+
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+        assert PaymentCode.objects.filter(application=application).count() == 3
+
+    @patch("payment_codes.views.generate_application_document")
+    def test_failed_request_can_be_retried(
+        self, mock_generate_doc, authenticated_client, territory, counterparty
+    ):
+        """Test that errors are not stored, the retry runs for real"""
+        mock_generate_doc.side_effect = [
+            Exception("converter down"),
+            "applications/test.pdf",
+        ]
+        payload = {
+            "number": "IDEM002",
+            "territories": [territory.id],
+            "forwarder": counterparty.id,
+        }
+
+        responses = [
+            authenticated_client.post(
+                reverse("application-create"),
+                payload,
+                format="json",
+                HTTP_IDEMPOTENCY_KEY=KEY,
+            )
+            for _ in range(2)
+        ]
+
+        assert [r.status_code for r in responses] == [
+            status.HTTP_400_BAD_REQUEST,
+            status.HTTP_201_CREATED,
+        ]
+        assert REPLAYED_HEADER not in responses[1]
+        assert IdempotencyKey.objects.get().status_code == status.HTTP_201_CREATED
+
+    def test_expired_key_runs_again(self, authenticated_client, application, territory):
+        """Test that a key past its TTL is claimed afresh"""
+        create_range(authenticated_client, application, territory, end="1001")
+        IdempotencyKey.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        response = create_range(
+            authenticated_client, application, territory, start="1002", end="1002"
+        )
+
+        assert response.status_code == status.HTTP_201_CREATED
+        assert REPLAYED_HEADER not in response
+        assert PaymentCode.objects.filter(application=application).count() == 2
+
+    def test_keys_are_per_user(self, api_client, user, application, territory):
+        """Test that another user's key does not replay"""
+        other = type(user).objects.create(username="other", email="other@example.com")
+        IdempotencyKey.objects.create(
+            user=other,
+            key=KEY,
+            fingerprint="0" * 64,
+            status_code=201,
+            response={},
+            expires_at=timezone.now() + timedelta(hours=1),
+        )
+        api_client.force_authenticate(user)
+
+        response = create_range(api_client, application, territory)
+
+        assert response.status_code == status.HTTP_201_CREATED
+        assert REPLAYED_HEADER not in response
+
+    def test_purge_expired_keys(self, user):
+        """Test that only expired keys are purged"""
+        now = timezone.now()
+        for key, expires_at in [
+            ("old", now - timedelta(hours=1)),
+            ("new", now + timedelta(hours=1)),
+        ]:
+            IdempotencyKey.objects.create(
+                user=user, key=key, fingerprint="0" * 64, expires_at=expires_at
+            )
+
+        call_command("purge_idempotency_keys", batch_size=1)
+
+        assert list(IdempotencyKey.objects.values_list("key", flat=True)) == ["new"]
+
+
+@pytest.mark.django_db(transaction=True)
+class TestConcurrentDuplicates:
+    @pytest.fixture
+    def in_flight(self, user):
+        """
+        Hold an uncommitted claim of KEY in another connection, as a request
+        that is still running would
+        """
+        claimed, release = threading.Event(), threading.Event()
+        outcome = {}
+
+        def hold():
+            try:
+                with transaction.atomic():
+                    record = IdempotencyKey.objects.create(
+                        user=user,
+                        key=KEY,
+                        fingerprint=outcome["fingerprint"],
+                        expires_at=timezone.now() + timedelta(hours=1),
+                    )
+                    claimed.set()
+                    release.wait(5)
+                    if "response" in outcome:
+                        record.status_code = 201
+                        record.response = outcome["response"]
+                        record.save()
+            finally:
+                connection.close()
+
+        def start(fingerprint):
+            outcome["fingerprint"] = fingerprint
+            thread.start()
+            assert claimed.wait(5)
+
+        thread = threading.Thread(target=hold)
+        yield start, release, outcome
+        release.set()
+        thread.join(5)
+
+    def fingerprint(self, application, territory):
+        class Request:
+            method = "POST"
+            path = reverse("code-range-create", args=[application.id])
+            data = {
+                "start_range": "1001",
+                "end_range": "1003",
+                "territory_id": territory.id,
+            }
+
+        return request_fingerprint(Request)
+
+    def test_duplicate_gives_up_after_waiting(
+        self, authenticated_client, application, territory, in_flight, settings
+    ):
+        """Test that a duplicate of a stuck request is told to retry later"""
+        start, release, _ = in_flight
+        settings.IDEMPOTENCY_WAIT_SECONDS = 0.2
+        start(self.fingerprint(application, territory))
+
+        response = create_range(authenticated_client, application, territory)
+
+        assert response.status_code == status.HTTP_409_CONFLICT
+        assert not PaymentCode.objects.exists()
+
+    def test_duplicate_waits_for_the_first_request(
+        self, authenticated_client, application, territory, in_flight
+    ):
+        """Test that a duplicate blocks until the first commits, then replays it"""
+        start, release, outcome = in_flight
+        outcome["response"] = {"codes": "from the first request"}
+        start(self.fingerprint(application, territory))
+        threading.Timer(0.2, release.set).start()
+
+        response = create_range(authenticated_client, application, territory)
+
+        assert response.status_code == status.HTTP_201_CREATED
+        assert response.json() == outcome["response"]
+        assert response[REPLAYED_HEADER] == "true"
+        assert not PaymentCode.objects.exists()
@@ -0,0 +1,96 @@
+import threading
+
+import pytest
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.http import HttpResponse
+from django.test import (
+    AsyncClient,
+    AsyncRequestFactory,
+    RequestFactory,
+    override_settings,
+)
+from django.urls import reverse
+from rest_framework import status
+
+from users.views import in_login_pool
+
+User = get_user_model()
+
+PASSWORD = "Shift-start-123"
+
+
+def login(client, username):
+    return client.post(
+        reverse("token_obtain_pair"), {"username": username, "password": PASSWORD}
+    )
+
+
+@pytest.mark.django_db
+class TestRehashOnLogin:
+    def test_pbkdf2_hash_is_upgraded(self, api_client):
+        """Test that a legacy PBKDF2 hash is replaced with Argon2 on login"""
+        user = User.objects.create(
+            username="legacy", password=make_password(PASSWORD, hasher="pbkdf2_sha256")
+        )
+
+        response = login(api_client, "legacy")
+
+        assert response.status_code == status.HTTP_200_OK
+        user.refresh_from_db()
+        assert user.password.startswith("argon2$argon2id$")
+        assert user.check_password(PASSWORD)
+
+    def test_changed_costs_are_applied_on_login(self, api_client, settings):
+        """Test that hashes made with other Argon2 costs are rehashed"""
+        with override_settings(ARGON2_MEMORY_COST=8192):
+            user = User.objects.create_user(username="cheap", password=PASSWORD)
+        assert "m=8192" in user.password
+
+        response = login(api_client, "cheap")
+
+        assert response.status_code == status.HTTP_200_OK
+        user.refresh_from_db()
+        assert f"m={settings.ARGON2_MEMORY_COST}" in user.password
+
+    def test_wrong_password(self, api_client):
+        """Test that a wrong password is still rejected"""
+        User.objects.create_user(username="worker", password=PASSWORD)
+
+        response = api_client.post(
+            reverse("token_obtain_pair"), {"username": "worker", "password": "nope"}
+        )
+
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+class TestLoginPool:
+    def view(self, request):
+        return HttpResponse(threading.current_thread().name)
+
+    def test_asgi_requests_run_on_the_login_pool(self):
+        """Test that ASGI logins leave the thread shared by sync views"""
+        response = async_to_sync(in_login_pool(self.view))(
+            AsyncRequestFactory().post("/")
+        )
+        assert response.content.decode().startswith("login")
+
+    def test_wsgi_requests_stay_on_their_thread(self):
+        """Test that WSGI logins run on the worker's own request thread"""
+        response = async_to_sync(in_login_pool(self.view))(RequestFactory().post("/"))
+        assert response.content.decode() == threading.current_thread().name
+
+    @pytest.mark.django_db(transaction=True)
+    def test_login_over_asgi(self):
+        """Test a full login served through the ASGI handler"""
+        User.objects.create_user(username="asgi", password=PASSWORD)
+
+        response = async_to_sync(AsyncClient().post)(
+            reverse("token_obtain_pair"),
+            {"username": "asgi", "password": PASSWORD},
+            content_type="application/json",
+        )
+
+        assert response.status_code == status.HTTP_200_OK
+        assert "access" in response.json()
@@ -0,0 +1,136 @@
+from unittest.mock import patch
+
+import pytest
+import requests
+from django.urls import reverse
+from rest_framework import status
+
+from interrail_moscow_code.metrics import (
+    CACHE_REQUESTS,
+    CONVERTER_DURATION,
+    REGISTRY,
+    REQUEST_DURATION,
+    REQUEST_QUERY_COUNT,
+    Counter,
+    Histogram,
+    record_cache_access,
+)
+from payment_codes.utils import convert
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture(autouse=True)
+def clean_registry():
+    REGISTRY.clear()
+    yield
+    REGISTRY.clear()
+
+
+class TestMetricTypes:
+    def test_histogram_renders_cumulative_buckets(self):
+        """Test that histogram buckets are cumulative and end with +Inf"""
+        metric = Histogram("test_latency", "Test.", ["view"], buckets=[0.1, 1])
+        metric.observe(0.05, view="a")
+        metric.observe(0.5, view="a")
+        metric.observe(3, view="a")
+
+        rendered = metric.render()
+
+        assert 'test_latency_bucket{view="a",le="0.1"} 1' in rendered
+        assert 'test_latency_bucket{view="a",le="1"} 2' in rendered
+        assert 'test_latency_bucket{view="a",le="+Inf"} 3' in rendered
+        assert 'test_latency_count{view="a"} 3' in rendered
+        assert 'test_latency_sum{view="a"} 3.55' in rendered
+
+    def test_counter_rejects_unknown_labels(self):
+        """Test that a counter refuses labels it was not declared with"""
+        metric = Counter("test_total", "Test.", ["cache"])
+        with pytest.raises(ValueError):
+            metric.inc(other="x")
+
+    def test_record_cache_access(self):
+        """Test that cache lookups are split into hits and misses"""
+        record_cache_access("filters", hit=True)
+        record_cache_access("filters", hit=False)
+        record_cache_access("filters", hit=True)
+
+        assert CACHE_REQUESTS.value(cache="filters", result="hit") == 2
+        assert CACHE_REQUESTS.value(cache="filters", result="miss") == 1
+
+
+class TestRequestMetricsMiddleware:
+    def test_records_latency_and_queries_per_view(
+        self, authenticated_client, territory
+    ):
+        """Test that a request is recorded under its URL name with its query count"""
+        response = authenticated_client.get(reverse("territory-list"))
+
+        assert response.status_code == status.HTTP_200_OK
+        labels = {"view": "territory-list", "method": "GET", "status": "200"}
+        assert REQUEST_DURATION.count(**labels) == 1
+        assert REQUEST_QUERY_COUNT.count(view="territory-list") == 1
+        assert REQUEST_QUERY_COUNT.sum(view="territory-list") >= 1
+
+    def test_unresolved_requests_share_one_label(self, api_client):
+        """Test that 404s do not create a series per unknown path"""
+        api_client.get("/does-not-exist/")
+        api_client.get("/does-not-exist-either/")
+
+        labels = {"view": "<unresolved>", "method": "GET", "status": "404"}
+        assert REQUEST_DURATION.count(**labels) == 2
+
+    def test_metrics_endpoint(self, api_client, authenticated_client):
+        """Test that /metrics serves the Prometheus text format"""
+        authenticated_client.get(reverse("counterparty-list"))
+
+        response = api_client.get(reverse("metrics"))
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response["Content-Type"].startswith("text/plain; version=0.0.4")
+        body = response.content.decode()
+        assert "# TYPE http_request_duration_seconds histogram" in body
+        assert 'http_request_db_queries_count{view="counterparty-list"} 1' in body
+
+    def test_metrics_endpoint_disabled(self, api_client, settings):
+        """Test that /metrics is hidden when metrics are disabled"""
+        settings.METRICS_ENABLED = False
+        response = api_client.get(reverse("metrics"))
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    def test_metrics_endpoint_rejects_other_addresses(self, api_client, settings):
+        """Test that /metrics is refused to clients outside METRICS_ALLOWED_IPS"""
+        settings.METRICS_ALLOWED_IPS = ["10.0.0.0/8"]
+
+        inside = api_client.get(reverse("metrics"), REMOTE_ADDR="10.1.2.3")
+        outside = api_client.get(reverse("metrics"), REMOTE_ADDR="203.0.113.7")
+
+        assert inside.status_code == status.HTTP_200_OK
+        assert outside.status_code == status.HTTP_403_FORBIDDEN
+
+    def test_metrics_endpoint_accepts_token(self, api_client, settings):
+        """Test that a scraper with METRICS_TOKEN is let in from anywhere"""
+        settings.METRICS_ALLOWED_IPS = []
+        settings.METRICS_TOKEN = "scrape-secret"
+        url = reverse("metrics")
+
+        wrong = api_client.get(url, HTTP_AUTHORIZATION="Bearer wrong")
+        assert api_client.get(url).status_code == status.HTTP_403_FORBIDDEN
+        assert wrong.status_code == status.HTTP_403_FORBIDDEN
+        response = api_client.get(url, HTTP_AUTHORIZATION="Bearer scrape-secret")
+        assert response.status_code == status.HTTP_200_OK
+
+
+class TestConverterMetrics:
+    @patch("payment_codes.converters.requests.post")
+    def test_converter_timeout_is_recorded(self, mock_post, tmp_path):
+        """Test that converter timeouts are timed under their own outcome"""
+        mock_post.side_effect = requests.Timeout()
+        docx = tmp_path / "application.docx"
+        docx.write_bytes(b"docx")
+
+        with pytest.raises(requests.Timeout):
+            convert(str(docx), "application.pdf")
+
+        assert CONVERTER_DURATION.count(outcome="timeout") == 1
+        assert CONVERTER_DURATION.count(outcome="success") == 0
@@ -0,0 +1,88 @@
+import re
+import threading
+from unittest.mock import patch
+
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+
+from payment_codes.models import Application
+from payment_codes.numbering import SEQUENCE, NumberAllocator
+
+
+@pytest.mark.django_db
+class TestApplicationNumbers:
+    @patch("payment_codes.views.generate_application_document")
+    def test_number_is_assigned(
+        self, mock_generate_doc, authenticated_client, territory, counterparty
+    ):
+        """Test that an application created without a number gets one"""
+        mock_generate_doc.return_value = "applications/test.pdf"
+
+        response = authenticated_client.post(
+            reverse("application-create"),
+            {"territories": [territory.id], "forwarder": counterparty.id},
+            format="json",
+        )
+
+        assert response.status_code == status.HTTP_201_CREATED
+        year = timezone.localdate().year
+        assert re.fullmatch(rf"{year}-\d{{6}}", response.data["number"])
+        assert mock_generate_doc.call_args.args[0].number == response.data["number"]
+
+    def test_chosen_number_is_kept(self, counterparty):
+        """Test that a number given by the client is not replaced"""
+        application = Application.objects.create(
+            number="MANUAL1", forwarder=counterparty
+        )
+        assert application.number == "MANUAL1"
+
+    def test_format_is_configurable(self, settings, counterparty):
+        """Test that numbers follow APPLICATION_NUMBER_FORMAT"""
+        settings.APPLICATION_NUMBER_FORMAT = "MSK/{seq:08d}"
+
+        number = Application.objects.create(forwarder=counterparty).number
+
+        assert re.fullmatch(r"MSK/\d{8}", number)
+
+    def test_sequence_is_read_once_per_block(self, settings):
+        """Test that a worker takes a block of numbers in one query"""
+        settings.APPLICATION_NUMBER_BLOCK = 10
+        allocator = NumberAllocator(SEQUENCE)
+
+        with CaptureQueriesContext(connection) as captured:
+            values = [allocator.next_value() for _ in range(15)]
+
+        assert len(set(values)) == 15
+        assert values == sorted(values)
+        assert len(captured) == 2
+
+
+@pytest.mark.django_db(transaction=True)
+class TestConcurrentNumbers:
+    def test_parallel_creates_get_distinct_numbers(self, settings, counterparty):
+        """Test that concurrent creates never collide on the number"""
+        settings.APPLICATION_NUMBER_BLOCK = 3
+        errors = []
+
+        def create():
+            try:
+                for _ in range(5):
+                    Application.objects.create(forwarder=counterparty)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=create) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+
+        assert errors == []
+        numbers = list(Application.objects.values_list("number", flat=True))
+        assert len(numbers) == len(set(numbers)) == 30
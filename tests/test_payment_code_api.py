@@ -1,7 +1,17 @@
+import threading
+from unittest.mock import patch
+
 import pytest
+from django.db import DatabaseError, connection
 from django.urls import reverse
 from rest_framework import status
-from payment_codes.models import PaymentCode
+from rest_framework.test import APIClient
+from payment_codes.models import (
+    Application,
+    PaymentCode,
+    Territory,
+    TerritoryCodeCounter,
+)
 from django.utils import timezone
 
 pytestmark = pytest.mark.django_db
@@ -107,6 +117,96 @@ class TestPaymentCodeAPI:
         # Verify no codes were created
         assert PaymentCode.objects.filter(application=application).count() == 0
 
+    def test_range_bounds_compare_as_numbers(
+        self, authenticated_client, application, territory
+    ):
+        """Test that a range crossing a power of ten is not mistaken as reversed"""
+        url = reverse("code-range-create", args=[application.id])
+        payload = {
+            "start_range": "999",
+            "end_range": "1000",
+            "territory_id": territory.id,
+        }
+
+        response = authenticated_client.post(url, payload)
+
+        assert response.status_code == status.HTTP_201_CREATED
+        assert sorted(PaymentCode.objects.values_list("number", flat=True)) == [
+            "1000",
+            "999",
+        ]
+
+    @pytest.mark.parametrize(
+        "start_range,end_range",
+        [
+            ("1003", "1004"),
+            ("1002", "1002"),
+            ("01000", "01001"),
+            ("00001002", "00001002"),
+        ],
+    )
+    def test_issued_numbers_are_rejected(
+        self, authenticated_client, application, territory, start_range, end_range
+    ):
+        """Test that a range cannot reuse numbers issued before in the territory"""
+        url = reverse("code-range-create", args=[application.id])
+        first = authenticated_client.post(
+            url,
+            {"start_range": "1001", "end_range": "1003", "territory_id": territory.id},
+        )
+
+        response = authenticated_client.post(
+            url,
+            {
+                "start_range": start_range,
+                "end_range": end_range,
+                "territory_id": territory.id,
+            },
+        )
+
+        assert first.status_code == status.HTTP_201_CREATED
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert "already issued" in response.data["error"]
+        assert PaymentCode.objects.count() == 3
+        application.refresh_from_db()
+        assert application.codes_count == 3
+
+    def test_unused_range_below_issued_numbers(
+        self, authenticated_client, application, territory
+    ):
+        """Test that a range below numbers issued before is accepted while unused"""
+        url = reverse("code-range-create", args=[application.id])
+        for start_range, end_range in [("1001", "1003"), ("998", "999")]:
+            response = authenticated_client.post(
+                url,
+                {
+                    "start_range": start_range,
+                    "end_range": end_range,
+                    "territory_id": territory.id,
+                },
+            )
+            assert response.status_code == status.HTTP_201_CREATED
+
+        assert TerritoryCodeCounter.objects.get(territory=territory).next_number == 1004
+        assert PaymentCode.objects.count() == 5
+
+    @pytest.mark.parametrize("start_range", ["abc", "-1", "1.5", ""])
+    def test_range_bounds_must_be_numbers(
+        self, authenticated_client, application, territory, start_range
+    ):
+        """Test that non-numeric bounds are rejected rather than failing"""
+        url = reverse("code-range-create", args=[application.id])
+        payload = {
+            "start_range": start_range,
+            "end_range": "1001",
+            "territory_id": territory.id,
+        }
+
+        response = authenticated_client.post(url, payload)
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert "start_range" in response.data
+
     def test_retrieve_application_with_codes(
         self, authenticated_client, application, territory
     ):
@@ -138,3 +238,124 @@ class TestPaymentCodeAPI:
         assert response.data["codes"][0]["number"] in ["1001", "1002"]
         assert response.data["codes"][1]["number"] in ["1001", "1002"]
         assert response.data["codes"][0]["territory"]["id"] == territory.id
+
+
+def allocate(client, application, territory, count):
+    return client.post(
+        reverse("code-range-allocate", args=[application.id]),
+        {"count": count, "territory_id": territory.id},
+        format="json",
+    )
+
+
+# Blocks are taken on a connection of their own, which only sees committed rows
+@pytest.mark.django_db(transaction=True)
+class TestPaymentCodeAllocateAPI:
+    def test_consecutive_blocks(self, authenticated_client, application, territory):
+        """Test that each request gets the next free block of the territory"""
+        first = allocate(authenticated_client, application, territory, 3)
+        second = allocate(authenticated_client, application, territory, 2)
+
+        assert first.status_code == second.status_code == status.HTTP_201_CREATED
+        assert first.data == {
+            "territory_id": territory.id,
+            "count": 3,
+            "start_range": "00000001",
+            "end_range": "00000003",
+        }
+        assert (second.data["start_range"], second.data["end_range"]) == (
+            "00000004",
+            "00000005",
+        )
+        assert PaymentCode.objects.filter(application=application).count() == 5
+        application.refresh_from_db()
+        assert application.codes_count == 5
+
+    def test_blocks_skip_explicit_ranges(
+        self, authenticated_client, application, territory
+    ):
+        """Test that a range chosen by a client is never allocated again"""
+        authenticated_client.post(
+            reverse("code-range-create", args=[application.id]),
+            {"start_range": "1001", "end_range": "1003", "territory_id": territory.id},
+        )
+
+        response = allocate(authenticated_client, application, territory, 2)
+
+        assert response.data["start_range"] == "00001004"
+
+    def test_territories_count_separately(
+        self, authenticated_client, application, territory
+    ):
+        """Test that every territory has its own numbers"""
+        other = Territory.objects.create(name="Second Territory")
+        application.territories.add(other)
+        Application.objects.filter(pk=application.pk).update(territories_count=2)
+
+        allocate(authenticated_client, application, territory, 2)
+        response = allocate(authenticated_client, application, other, 2)
+
+        assert response.data["start_range"] == "00000001"
+
+    def test_rejected_request_leaves_no_gap(
+        self, authenticated_client, application, territory
+    ):
+        """Test that numbers of a request over the quota are not used up"""
+        rejected = allocate(authenticated_client, application, territory, 6)
+        response = allocate(authenticated_client, application, territory, 1)
+
+        assert rejected.status_code == status.HTTP_400_BAD_REQUEST
+        assert "Range exceeds the application's quantity" in str(rejected.data)
+        assert response.data["start_range"] == "00000001"
+
+    def test_failed_request_leaves_a_gap(
+        self, authenticated_client, application, territory
+    ):
+        """Test that a block taken by a failed request is not handed out again"""
+        with patch(
+            "payment_codes.views.create_codes", side_effect=DatabaseError("lost")
+        ):
+            with pytest.raises(DatabaseError):
+                allocate(authenticated_client, application, territory, 2)
+
+        response = allocate(authenticated_client, application, territory, 2)
+
+        assert response.data["start_range"] == "00000003"
+        application.refresh_from_db()
+        assert application.codes_count == 2
+
+    @pytest.mark.parametrize("count", [0, -1, "many"])
+    def test_invalid_count(self, authenticated_client, application, territory, count):
+        """Test that the count must be a positive number"""
+        response = allocate(authenticated_client, application, territory, count)
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert "count" in response.data
+
+
+@pytest.mark.django_db(transaction=True)
+class TestConcurrentAllocation:
+    def test_parallel_requests_get_disjoint_blocks(self, user, application, territory):
+        """Test that dispatchers allocating at once never share a number"""
+        Application.objects.filter(pk=application.pk).update(quantity=100)
+        responses = []
+
+        def dispatcher():
+            client = APIClient()
+            client.force_authenticate(user)
+            try:
+                for _ in range(3):
+                    responses.append(allocate(client, application, territory, 4))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=dispatcher) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+
+        assert [r.status_code for r in responses] == [status.HTTP_201_CREATED] * 18
+        numbers = list(PaymentCode.objects.values_list("number", flat=True))
+        assert len(numbers) == len(set(numbers)) == 72
+        assert max(numbers) == "00000072"
@@ -0,0 +1,227 @@
+from unittest.mock import patch
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from payment_codes.models import Application, PaymentCode, Territory
+from users.authentication import user_is_active
+from users.blacklist import revocation_filter, revoke
+
+pytestmark = pytest.mark.django_db
+
+User = get_user_model()
+
+
+@pytest.fixture(autouse=True)
+def warm_user_cache(user):
+    """
+    Budgets are for the steady state, where is_active and revocations come
+    from process memory
+    """
+    user_is_active(user.pk)
+    revocation_filter.sync(force=True)
+
+
+class TestReferenceQueryBudgets:
+    @pytest.mark.parametrize("url_name", ["territory-list", "counterparty-list"])
+    def test_reference_list(
+        self, authenticated_client, query_budget, territory, counterparty, url_name
+    ):
+        """Test that reference lists run a fixed number of queries"""
+        with query_budget(url_name):
+            response = authenticated_client.get(reverse(url_name))
+        assert response.status_code == status.HTTP_200_OK
+
+    @pytest.mark.parametrize("url_name", ["territory-detail", "counterparty-detail"])
+    def test_reference_detail(
+        self, authenticated_client, query_budget, territory, counterparty, url_name
+    ):
+        """Test the query count of a reference lookup"""
+        instance = territory if url_name == "territory-detail" else counterparty
+        with query_budget(url_name):
+            response = authenticated_client.get(reverse(url_name, args=[instance.id]))
+        assert response.status_code == status.HTTP_200_OK
+
+
+class TestApplicationQueryBudgets:
+    @patch("payment_codes.views.generate_application_document")
+    def test_application_create(
+        self,
+        mock_generate_doc,
+        authenticated_client,
+        query_budget,
+        territory,
+        counterparty,
+    ):
+        """Test the query count of creating an application"""
+        mock_generate_doc.return_value = "applications/test.pdf"
+        payload = {
+            "number": "BUDGET001",
+            "quantity": 3,
+            "date": "2024-01-01",
+            "territories": [territory.id],
+            "forwarder": counterparty.id,
+        }
+        with query_budget("application-create"):
+            response = authenticated_client.post(
+                reverse("application-create"), payload, format="json"
+            )
+        assert response.status_code == status.HTTP_201_CREATED
+
+    def test_application_list(self, authenticated_client, query_budget, application):
+        """Test the query count of a list page"""
+        with query_budget("application-list"):
+            response = authenticated_client.get(reverse("application-list"))
+        assert response.status_code == status.HTTP_200_OK
+
+    @patch("payment_codes.views.generate_application_document")
+    def test_application_update(
+        self, mock_generate_doc, authenticated_client, query_budget, application
+    ):
+        """Test the query count of updating an application"""
+        mock_generate_doc.return_value = "applications/test.pdf"
+        payload = {
+            "number": "TEST001-UPDATED",
+            "quantity": 4,
+            "forwarder": application.forwarder.id,
+            "territories": [application.territories.first().id],
+        }
+        with query_budget("application-update"):
+            response = authenticated_client.put(
+                reverse("application-update", args=[application.id]),
+                payload,
+                format="json",
+            )
+        assert response.status_code == status.HTTP_200_OK
+
+    @pytest.mark.parametrize("codes", [3, 30])
+    def test_application_detail_does_not_grow_with_codes(
+        self, authenticated_client, query_budget, application, territory, codes
+    ):
+        """Test that nested codes and their territories are not loaded per row"""
+        other_territory = Territory.objects.create(name="Other Territory")
+        PaymentCode.objects.bulk_create(
+            PaymentCode(
+                application=application,
+                number=str(1000 + i),
+                territory=territory if i % 2 else other_territory,
+                created=timezone.now(),
+                modified=timezone.now(),
+            )
+            for i in range(codes)
+        )
+        with query_budget("application-detail"):
+            response = authenticated_client.get(
+                reverse("application-detail", args=[application.id])
+            )
+        assert response.status_code == status.HTTP_200_OK
+        assert len(response.data["codes"]) == codes
+
+    @pytest.mark.parametrize("size", [3, 30])
+    @patch("payment_codes.jobs.schedule")
+    def test_application_batch_update_does_not_grow_with_rows(
+        self, mock_schedule, authenticated_client, query_budget, counterparty, size
+    ):
+        """Test that a batch update costs the same for 3 or 30 applications"""
+        territories = Territory.objects.bulk_create(
+            Territory(name=f"Batch Territory {i}") for i in range(size)
+        )
+        applications = Application.objects.bulk_create(
+            Application(number=f"BATCH{i}", forwarder=counterparty) for i in range(size)
+        )
+        payload = [
+            {
+                "id": application.id,
+                "number": f"RENUMBERED{i}",
+                "departure_code": "MOW",
+                "forwarder": counterparty.id,
+                "territories": [territories[i].id],
+            }
+            for i, application in enumerate(applications)
+        ]
+        with query_budget("application-batch-update"):
+            response = authenticated_client.patch(
+                reverse("application-batch-update"), payload, format="json"
+            )
+        assert response.status_code == status.HTTP_200_OK
+        assert len(response.data["updated"]) == size
+
+
+class TestPaymentCodeQueryBudgets:
+    def test_code_range_create(
+        self, authenticated_client, query_budget, application, territory
+    ):
+        """Test that creating a range does not issue a query per code"""
+        payload = {
+            "start_range": "1001",
+            "end_range": "1005",
+            "territory_id": territory.id,
+        }
+        with query_budget("code-range-create"):
+            response = authenticated_client.post(
+                reverse("code-range-create", args=[application.id]), payload
+            )
+        assert response.status_code == status.HTTP_201_CREATED
+
+    # The block is taken on a connection of its own, which only sees committed rows
+    @pytest.mark.django_db(transaction=True)
+    def test_code_range_allocate(
+        self, authenticated_client, query_budget, application, territory
+    ):
+        """Test that allocating codes issues a fixed number of queries"""
+        payload = {"count": 5, "territory_id": territory.id}
+        with query_budget("code-range-allocate"):
+            response = authenticated_client.post(
+                reverse("code-range-allocate", args=[application.id]), payload
+            )
+        assert response.status_code == status.HTTP_201_CREATED
+
+
+class TestAuthQueryBudgets:
+    @pytest.fixture
+    def login_user(self):
+        return User.objects.create_user(
+            username="budget", email="budget@example.com", password="Budget-pass-123"
+        )
+
+    def test_login(self, api_client, query_budget, login_user):
+        """Test the query count of obtaining a token pair"""
+        payload = {"username": "budget", "password": "Budget-pass-123"}
+        with query_budget("token_obtain_pair"):
+            response = api_client.post(reverse("token_obtain_pair"), payload)
+        assert response.status_code == status.HTTP_200_OK
+
+    def test_refresh(self, api_client, query_budget, login_user):
+        """Test the query count of refreshing an access token"""
+        refresh = RefreshToken.for_user(login_user)
+        with query_budget("token_refresh"):
+            response = api_client.post(
+                reverse("token_refresh"), {"refresh": str(refresh)}
+            )
+        assert response.status_code == status.HTTP_200_OK
+
+    def test_logout(self, api_client, query_budget, login_user):
+        """Test that logout costs the same however many tokens were revoked"""
+        refresh = RefreshToken.for_user(login_user)
+        for _ in range(3):
+            revoke(RefreshToken.for_user(login_user))
+        api_client.credentials(HTTP_AUTHORIZATION=f"Bearer {refresh.access_token}")
+        user_is_active(login_user.pk)
+        revocation_filter.sync(force=True)
+
+        with query_budget("logout"):
+            response = api_client.post(
+                reverse("logout"), {"refresh_token": str(refresh)}
+            )
+        assert response.status_code == status.HTTP_200_OK
+
+    def test_profile_update(self, authenticated_client, query_budget):
+        """Test the query count of updating the profile"""
+        payload = {"username": "renamed", "email": "renamed@example.com"}
+        with query_budget("user_detail"):
+            response = authenticated_client.put(reverse("user_detail"), payload)
+        assert response.status_code == status.HTTP_200_OK
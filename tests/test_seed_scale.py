@@ -0,0 +1,60 @@
+import pytest
+from django.core.management import call_command
+from django.core.management.base import CommandError
+
+from payment_codes.models import Application, Counterparty, PaymentCode, Territory
+
+pytestmark = pytest.mark.django_db
+
+OPTIONS = {
+    "applications": 60,
+    "territories": 5,
+    "counterparties": 10,
+    "managers": 2,
+    "chunk_size": 25,
+    "seed": 7,
+}
+
+
+def snapshot():
+    return list(
+        PaymentCode.objects.order_by(
+            "application__number", "territory__name", "number"
+        ).values_list(
+            "application__number", "territory__name", "number", "code_status", "date"
+        )
+    )
+
+
+class TestSeedScaleCommand:
+    def test_seeds_requested_volume(self):
+        """Test that the command writes every table in chunks"""
+        call_command("seed_scale", **OPTIONS)
+
+        assert Application.objects.filter(number__startswith="SEED-").count() == 60
+        assert Territory.objects.filter(name__startswith="Seed territory").count() == 5
+        assert (
+            Counterparty.objects.filter(name__startswith="Seed forwarder").count() == 10
+        )
+        assert PaymentCode.objects.exists()
+        for application in Application.objects.prefetch_related("territories")[:10]:
+            assert application.territories.exists()
+            assert (
+                application.codes.count()
+                <= application.quantity * application.territories.count()
+            )
+
+    def test_is_deterministic_for_a_seed(self):
+        """Test that the same seed produces the same dataset"""
+        call_command("seed_scale", **OPTIONS)
+        first = snapshot()
+
+        call_command("seed_scale", flush=True, **OPTIONS)
+
+        assert snapshot() == first
+
+    def test_refuses_to_seed_twice(self):
+        """Test that existing seed data is not silently duplicated"""
+        call_command("seed_scale", **OPTIONS)
+        with pytest.raises(CommandError):
+            call_command("seed_scale", **OPTIONS)
@@ -0,0 +1,114 @@
+from datetime import timedelta
+from decimal import Decimal
+from unittest.mock import patch
+
+import pytest
+from django.core.management import call_command
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+
+from payment_codes.models import SummaryRefresh
+from payment_codes.stats import (
+    SUMMARY_NAME,
+    background_refresh,
+    ensure_fresh,
+    last_refreshed,
+    refresh_in_background,
+    refresh_summaries,
+)
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def mock_background_refresh():
+    # The thread would commit to the test database outside the test transaction
+    with patch("payment_codes.stats.refresh_in_background") as mock_refresh:
+        yield mock_refresh
+
+
+class TestDashboardStats:
+    url = reverse("dashboard-stats")
+
+    def test_requires_authentication(self, api_client):
+        """Test that anonymous users cannot read the statistics"""
+        response = api_client.get(self.url)
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+    def test_stats(self, authenticated_client, query_budget, payment_code, territory):
+        """Test that the summaries cover codes per territory and money per forwarder"""
+        refresh_summaries()
+        with query_budget("dashboard-stats"):
+            response = authenticated_client.get(
+                self.url, {"month_from": "2024-01-01", "month_to": "2024-12-31"}
+            )
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data["codes_by_territory"] == [
+            {
+                "territory": territory.id,
+                "territory_name": territory.name,
+                "code_status": "Checking",
+                "codes": 1,
+            }
+        ]
+        [row] = response.data["applications_by_forwarder"]
+        assert row["month"] == "2024-01-01"
+        assert row["applications"] == 1
+        assert Decimal(row["agreed_rate"]) == Decimal("500.00")
+        assert response.data["totals"]["applications"] == 1
+        assert Decimal(response.data["totals"]["add_charges"]) == Decimal("50.00")
+
+    def test_month_filter(
+        self, authenticated_client, application, mock_background_refresh
+    ):
+        """Test that the default window leaves out old months"""
+        response = authenticated_client.get(self.url)
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data["applications_by_forwarder"] == []
+        assert response.data["totals"]["applications"] == 0
+
+
+class TestSummaryRefresh:
+    def test_snapshot_is_kept_within_the_staleness_bound(self, mock_background_refresh):
+        """Test that reads inside the bound do not refresh"""
+        recent = timezone.now() - timedelta(seconds=10)
+        SummaryRefresh.objects.create(name=SUMMARY_NAME, refreshed_at=recent)
+
+        assert ensure_fresh(max_staleness=300) == recent
+        mock_background_refresh.assert_not_called()
+
+    def test_stale_snapshot_is_served_while_refreshing(self, mock_background_refresh):
+        """Test that a read past the bound serves the old snapshot and refreshes later"""
+        old = timezone.now() - timedelta(hours=1)
+        SummaryRefresh.objects.create(name=SUMMARY_NAME, refreshed_at=old)
+
+        assert ensure_fresh(max_staleness=60) == old
+        mock_background_refresh.assert_called_once_with()
+
+    def test_stats_before_the_first_refresh(
+        self, authenticated_client, mock_background_refresh
+    ):
+        """Test that the snapshot taken when the views were created is served"""
+        response = authenticated_client.get(reverse("dashboard-stats"))
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data["refreshed_at"] is None
+        mock_background_refresh.assert_called_once_with()
+
+    @pytest.mark.django_db(transaction=True)
+    def test_background_refresh(self):
+        """Test that the background thread refreshes once per process at a time"""
+        with background_refresh:
+            assert refresh_in_background() is None
+
+        refresh_in_background().join(timeout=30)
+
+        assert last_refreshed() is not None
+
+    def test_refresh_command(self):
+        """Test that the scheduled command records a refresh"""
+        call_command("refresh_stats")
+        assert last_refreshed() is not None
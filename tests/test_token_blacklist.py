@@ -0,0 +1,104 @@
+from datetime import timedelta
+
+import pytest
+from django.core.management import call_command
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from users.blacklist import BloomFilter, is_revoked, revocation_filter, revoke
+from users.models import RevokedToken
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def refresh(user):
+    return RefreshToken.for_user(user)
+
+
+@pytest.fixture
+def access(refresh):
+    return refresh.access_token
+
+
+@pytest.fixture
+def client_with_tokens(api_client, access):
+    api_client.credentials(HTTP_AUTHORIZATION=f"Bearer {access}")
+    return api_client
+
+
+class TestLogout:
+    def test_logout_revokes_both_tokens(self, client_with_tokens, refresh):
+        """Test that neither the refresh nor the access token work after logout"""
+        response = client_with_tokens.post(
+            reverse("logout"), {"refresh_token": str(refresh)}
+        )
+        assert response.status_code == status.HTTP_200_OK
+
+        response = client_with_tokens.get(reverse("territory-list"))
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+        response = client_with_tokens.post(
+            reverse("token_refresh"), {"refresh": str(refresh)}
+        )
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+    def test_invalid_refresh_token(self, client_with_tokens):
+        """Test that logout with a malformed token is rejected"""
+        response = client_with_tokens.post(
+            reverse("logout"), {"refresh_token": "not-a-token"}
+        )
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_revocations_from_other_workers_are_synced(
+        self, client_with_tokens, access
+    ):
+        """Test that a revocation this process did not make is picked up on sync"""
+        revocation_filter.sync(force=True)
+        RevokedToken.objects.create(
+            jti=access["jti"],
+            expires_at=timezone.now() + timedelta(hours=1),
+        )
+
+        revocation_filter.sync(force=True)
+
+        response = client_with_tokens.get(reverse("territory-list"))
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+class TestRevokedTokenStorage:
+    def test_revoking_twice(self, refresh):
+        """Test that revoking the same token again is a no-op"""
+        revoke(refresh)
+        revoke(refresh)
+        assert is_revoked(refresh["jti"])
+        assert RevokedToken.objects.count() == 1
+
+    def test_purge_only_removes_expired_tokens(self, refresh):
+        """Test that rows are kept exactly as long as their token is valid"""
+        revoke(refresh)
+        RevokedToken.objects.bulk_create(
+            RevokedToken(jti=f"expired-{i}", expires_at=timezone.now())
+            for i in range(5)
+        )
+
+        call_command("purge_revoked_tokens", batch_size=2)
+
+        assert list(RevokedToken.objects.values_list("jti", flat=True)) == [
+            refresh["jti"]
+        ]
+
+
+class TestBloomFilter:
+    def test_no_false_negatives(self):
+        """Test that every added item is reported and unrelated ones mostly not"""
+        bloom = BloomFilter(1000, 0.01)
+        added = [f"jti-{i}" for i in range(1000)]
+        for item in added:
+            bloom.add(item)
+
+        assert all(item in bloom for item in added)
+        false_positives = sum(f"other-{i}" in bloom for i in range(10_000))
+        assert false_positives < 300
@@ -0,0 +1,98 @@
+import logging
+import time
+from unittest.mock import patch
+
+import pytest
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse
+from django.test import RequestFactory
+
+from interrail_moscow_code.metrics import REGISTRY
+from interrail_moscow_code.middleware import SlowRequestProfilerMiddleware
+from interrail_moscow_code.tracing import SPAN_DURATION, span
+from payment_codes.utils import generate_application_document
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture(autouse=True)
+def clean_registry():
+    REGISTRY.clear()
+    yield
+    REGISTRY.clear()
+
+
+class TestSpan:
+    def test_span_logs_and_records_duration(self, caplog):
+        """Test that a span is logged with its fields and aggregated by name"""
+        with caplog.at_level(logging.INFO, logger="interrail_moscow_code.tracing"):
+            with span("unit.work", application=7):
+                pass
+
+        assert SPAN_DURATION.count(span="unit.work", outcome="ok") == 1
+        record = caplog.records[-1]
+        assert record.span == "unit.work"
+        assert record.fields == {"application": 7}
+        assert "span=unit.work" in record.getMessage()
+        assert "application=7" in record.getMessage()
+
+    def test_span_marks_errors(self):
+        """Test that a failing block is recorded with the error outcome"""
+        with pytest.raises(RuntimeError):
+            with span("unit.failing"):
+                raise RuntimeError("boom")
+
+        assert SPAN_DURATION.count(span="unit.failing", outcome="error") == 1
+        assert SPAN_DURATION.count(span="unit.failing", outcome="ok") == 0
+
+    @patch("payment_codes.utils.convert")
+    @patch("payment_codes.utils.DocxTemplate")
+    def test_document_pipeline_phases(self, mock_template, mock_convert, application):
+        """Test that every document generation phase gets its own span"""
+        mock_convert.return_value = "applications/test.pdf"
+
+        generate_application_document(application)
+
+        for name in (
+            "document.context",
+            "document.render",
+            "document.save",
+            "document.convert",
+        ):
+            assert SPAN_DURATION.count(span=name, outcome="ok") == 1
+
+
+class TestSlowRequestProfilerMiddleware:
+    def test_disabled_by_default(self, settings):
+        """Test that the profiler removes itself when no threshold is set"""
+        settings.PROFILE_SLOW_REQUEST_MS = 0
+        with pytest.raises(MiddlewareNotUsed):
+            SlowRequestProfilerMiddleware(lambda request: HttpResponse())
+
+    def test_dumps_profile_for_slow_requests(self, settings, tmp_path):
+        """Test that sampled requests over the threshold leave a .prof file"""
+        settings.PROFILE_SLOW_REQUEST_MS = 1
+        settings.PROFILE_SAMPLE_RATE = 1.0
+        settings.PROFILE_DIR = str(tmp_path)
+
+        def slow_view(request):
+            time.sleep(0.01)
+            return HttpResponse()
+
+        middleware = SlowRequestProfilerMiddleware(slow_view)
+        middleware(RequestFactory().get("/api/payment_codes/territories/"))
+
+        dumps = list(tmp_path.glob("*.prof"))
+        assert len(dumps) == 1
+        assert "_unresolved_" in dumps[0].name
+
+    def test_skips_fast_requests(self, settings, tmp_path):
+        """Test that requests under the threshold are not dumped"""
+        settings.PROFILE_SLOW_REQUEST_MS = 60_000
+        settings.PROFILE_SAMPLE_RATE = 1.0
+        settings.PROFILE_DIR = str(tmp_path)
+
+        middleware = SlowRequestProfilerMiddleware(lambda request: HttpResponse())
+        middleware(RequestFactory().get("/"))
+
+        assert list(tmp_path.glob("*.prof")) == []
@@ -0,0 +1,90 @@
+"""
+JWT authentication that does not load the user row on every request.
+
+The access token already carries the user id, which is all most endpoints
+need. ``is_active`` is still enforced, from a short-lived per-process cache,
+so deactivating a user locks them out within ``JWT_USER_CACHE_SECONDS``.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTStatelessUserAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+
+from interrail_moscow_code.metrics import record_cache_access
+from users.blacklist import is_probably_revoked
+from users.models import CustomUser
+
+
+def active_cache_key(user_id) -> str:
+    return f"users:active:{user_id}"
+
+
+def user_is_active(user_id) -> bool:
+    """
+    Whether the user exists and is active, cached for ``JWT_USER_CACHE_SECONDS``.
+    """
+    key = active_cache_key(user_id)
+    active = cache.get(key)
+    record_cache_access("jwt_user", hit=active is not None)
+    if active is None:
+        active = (
+            CustomUser.objects.filter(pk=user_id)
+            .values_list("is_active", flat=True)
+            .first()
+            is True
+        )
+        cache.set(key, active, settings.JWT_USER_CACHE_SECONDS)
+    return active
+
+
+class LazyTokenUser(TokenUser):
+    """
+    User built from the token claims. The ``CustomUser`` row is loaded on the
+    first access to anything the token does not carry.
+    """
+
+    @cached_property
+    def db_user(self) -> CustomUser:
+        return CustomUser.objects.get(pk=self.pk)
+
+    @cached_property
+    def username(self) -> str:
+        return self.db_user.username
+
+    @cached_property
+    def is_staff(self) -> bool:
+        return self.db_user.is_staff
+
+    @cached_property
+    def is_superuser(self) -> bool:
+        return self.db_user.is_superuser
+
+    def __str__(self) -> str:
+        return self.username
+
+    def __getattr__(self, attr):
+        if attr.startswith("_"):
+            raise AttributeError(attr)
+        if attr in self.token:
+            return self.token[attr]
+        return getattr(self.db_user, attr)
+
+
+class CachedJWTAuthentication(JWTStatelessUserAuthentication):
+    def get_validated_token(self, raw_token):
+        token = super().get_validated_token(raw_token)
+        if is_probably_revoked(token[api_settings.JTI_CLAIM]):
+            raise InvalidToken(_("Token is blacklisted"))
+        return token
+
+    def get_user(self, validated_token):
+        # A LazyTokenUser, see SIMPLE_JWT["TOKEN_USER_CLASS"]
+        user = super().get_user(validated_token)
+        if not user_is_active(user.pk):
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        return user
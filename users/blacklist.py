@@ -0,0 +1,194 @@
+"""
+Revocation of JWTs by ``jti``.
+
+Revoked tokens live in ``revoked_token`` only until they would have expired
+anyway, so the table stays as large as the number of tokens revoked within one
+token lifetime. Every authenticated request checks its access token against a
+per-process bloom filter of that table, and only goes to the database when the
+filter reports a possible match. Refresh and logout always check the table,
+by primary key.
+"""
+
+import hashlib
+import math
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.utils import timezone
+from rest_framework_simplejwt.settings import api_settings
+
+from interrail_moscow_code.metrics import record_cache_access
+from users.models import RevokedToken
+
+# Rows committed slightly out of revoked_at order are still picked up by a sync
+SYNC_OVERLAP = timedelta(seconds=30)
+# Share of revocations that also purge a batch of expired rows
+PURGE_PROBABILITY = 0.01
+PURGE_BATCH_SIZE = 1000
+
+
+class BloomFilter:
+    """
+    Fixed-size bloom filter over strings, sized for ``capacity`` items at the
+    given false positive rate.
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.size = max(
+            8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        )
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray(math.ceil(self.size / 8))
+        self.count = 0
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.hashes):
+            yield (first + i * second) % self.size
+
+    def add(self, item: str) -> None:
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(item)
+        )
+
+
+class RevocationFilter:
+    """
+    Per-process bloom filter of revoked ``jti`` values.
+
+    New revocations are pulled in at most every ``TOKEN_BLACKLIST_SYNC_SECONDS``,
+    which bounds how long another worker can keep accepting a revoked access
+    token. The filter is rebuilt from the unexpired rows once it is over
+    capacity or older than one access token lifetime, dropping purged entries.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._bloom = None
+            self._built_at = 0.0
+            self._synced_at = 0.0
+            self._watermark = None
+
+    def _build(self) -> None:
+        capacity = settings.TOKEN_BLACKLIST_BLOOM_CAPACITY
+        rows = list(
+            RevokedToken.objects.filter(expires_at__gt=timezone.now()).values_list(
+                "jti", "revoked_at"
+            )
+        )
+        bloom = BloomFilter(
+            max(capacity, len(rows) * 2), settings.TOKEN_BLACKLIST_BLOOM_ERROR_RATE
+        )
+        for jti, _ in rows:
+            bloom.add(jti)
+        self._bloom = bloom
+        self._watermark = max(
+            (revoked_at for _, revoked_at in rows),
+            default=datetime.min.replace(tzinfo=dt_timezone.utc) + SYNC_OVERLAP,
+        )
+        self._built_at = time.monotonic()
+
+    def _pull(self) -> None:
+        rows = RevokedToken.objects.filter(
+            revoked_at__gt=self._watermark - SYNC_OVERLAP
+        ).values_list("jti", "revoked_at")
+        for jti, revoked_at in rows:
+            self._bloom.add(jti)
+            self._watermark = max(self._watermark, revoked_at)
+
+    def sync(self, force: bool = False) -> None:
+        now = time.monotonic()
+        with self._lock:
+            if (
+                not force
+                and now - self._synced_at < settings.TOKEN_BLACKLIST_SYNC_SECONDS
+            ):
+                return
+            lifetime = api_settings.ACCESS_TOKEN_LIFETIME.total_seconds()
+            if (
+                self._bloom is None
+                or now - self._built_at > lifetime
+                or self._bloom.count > self._bloom.capacity
+            ):
+                self._build()
+            else:
+                self._pull()
+            self._synced_at = now
+
+    def add(self, jti: str) -> None:
+        with self._lock:
+            if self._bloom is not None:
+                self._bloom.add(jti)
+
+    def might_contain(self, jti: str) -> bool:
+        self.sync()
+        return jti in self._bloom
+
+
+revocation_filter = RevocationFilter()
+
+
+def revoke(token) -> None:
+    """
+    Stop accepting ``token`` until it expires.
+    """
+    jti = token[api_settings.JTI_CLAIM]
+    expires_at = datetime.fromtimestamp(token["exp"], tz=dt_timezone.utc)
+    RevokedToken.objects.bulk_create(
+        [RevokedToken(jti=jti, expires_at=expires_at)], ignore_conflicts=True
+    )
+    revocation_filter.add(jti)
+    if random.random() < PURGE_PROBABILITY:
+        purge_expired(batch_size=PURGE_BATCH_SIZE, max_batches=1)
+
+
+def is_revoked(jti: str) -> bool:
+    """
+    Exact check, one primary key lookup.
+    """
+    return RevokedToken.objects.filter(jti=jti).exists()
+
+
+def is_probably_revoked(jti: str) -> bool:
+    """
+    Check against the bloom filter first, so tokens that were never revoked
+    cost no query.
+    """
+    maybe = revocation_filter.might_contain(jti)
+    record_cache_access("token_blacklist_bloom", hit=not maybe)
+    return maybe and is_revoked(jti)
+
+
+def purge_expired(batch_size: int = 10_000, max_batches: int | None = None) -> int:
+    """
+    Delete revoked tokens that have expired anyway, ``batch_size`` rows at a
+    time. Returns the number of rows deleted.
+    """
+    deleted = batches = 0
+    now = timezone.now()
+    while max_batches is None or batches < max_batches:
+        expired = RevokedToken.objects.filter(expires_at__lte=now).values("jti")[
+            :batch_size
+        ]
+        count, _ = RevokedToken.objects.filter(jti__in=expired).delete()
+        deleted += count
+        batches += 1
+        if count < batch_size:
+            break
+    return deleted
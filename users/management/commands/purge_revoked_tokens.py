@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from users.blacklist import purge_expired
+
+
+class Command(BaseCommand):
+    help = "Delete revoked JWTs that have expired and no longer need to be rejected."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=10_000,
+            help="Rows deleted per statement.",
+        )
+
+    def handle(self, *args, **options):
+        deleted = purge_expired(batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Purged {deleted} expired tokens"))
@@ -1,4 +1,6 @@
 from django.contrib.auth.models import AbstractUser
+from django.db import models
+from django.utils import timezone
 
 
 class CustomUser(AbstractUser):
@@ -6,3 +8,21 @@ class CustomUser(AbstractUser):
 
     def __str__(self):
         return self.username
+
+
+class RevokedToken(models.Model):
+    """
+    A JWT that must no longer be accepted, kept until it would have expired.
+    """
+
+    jti: models.CharField = models.CharField(max_length=255, primary_key=True)
+    revoked_at: models.DateTimeField = models.DateTimeField(
+        default=timezone.now, db_index=True
+    )
+    expires_at: models.DateTimeField = models.DateTimeField(db_index=True)
+
+    class Meta:
+        db_table = "revoked_token"
+
+    def __str__(self):
+        return self.jti
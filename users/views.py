@@ -1,10 +1,19 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib.auth import logout
+from django.core.handlers.asgi import ASGIRequest
+from django.db import close_old_connections
 from drf_spectacular.utils import extend_schema_view, extend_schema
 from rest_framework import generics, status
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.views import TokenObtainPairView
 
+from users.blacklist import revoke
 from users.models import CustomUser
 from users.serializers import (
     RegisterSerializer,
@@ -12,6 +21,41 @@ from users.serializers import (
     ChangePasswordSerializer,
 )
 
+login_executor = ThreadPoolExecutor(
+    max_workers=settings.LOGIN_THREADS, thread_name_prefix="login"
+)
+
+
+def in_login_pool(view):
+    """
+    Run a sync view on the login thread pool when served over ASGI.
+
+    Under ASGI Django runs every sync view on one shared thread, where a burst
+    of password hashing would hold up all other requests of the process. WSGI
+    workers have a thread of their own per request, so the view stays on it.
+    """
+
+    def run(request, *args, **kwargs):
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            # Django only does this for the request thread, this returns the
+            # pool thread's connection
+            close_old_connections()
+
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if isinstance(request, ASGIRequest):
+            return await sync_to_async(
+                run, thread_sensitive=False, executor=login_executor
+            )(request, *args, **kwargs)
+        return await sync_to_async(view)(request, *args, **kwargs)
+
+    return wrapper
+
+
+login_view = in_login_pool(TokenObtainPairView.as_view())
+
 
 @extend_schema_view(post=extend_schema(exclude=True))
 class RegisterView(generics.CreateAPIView):
@@ -30,7 +74,8 @@ class UserDetailView(generics.RetrieveUpdateAPIView):
     http_method_names = ["put"]
 
     def get_object(self):
-        return self.request.user
+        # request.user is built from the token, updates need the model instance
+        return CustomUser.objects.get(pk=self.request.user.pk)
 
 
 class ChangePasswordView(generics.UpdateAPIView):
@@ -39,7 +84,8 @@ class ChangePasswordView(generics.UpdateAPIView):
     http_method_names = ["put"]
 
     def get_object(self):
-        return self.request.user
+        # request.user is built from the token, updates need the model instance
+        return CustomUser.objects.get(pk=self.request.user.pk)
 
     def update(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
@@ -61,7 +107,10 @@ class LogoutView(generics.GenericAPIView):
         try:
             refresh_token = request.data["refresh_token"]
             token = RefreshToken(refresh_token)
-            token.blacklist()
+            revoke(token)
+            # The access token used for this request stops working as well
+            if request.auth is not None:
+                revoke(request.auth)
             logout(request)
             return Response(
                 {"message": "Successfully logged out."}, status=status.HTTP_200_OK